@@ -35,6 +35,8 @@ from endpoints import model_play, human_play, analytics, website
 
 # local imports
 import register_environments
+from elo_updates import backfill_current_ratings
+from game_stats import rebuild_game_stats
 
 # Initialize FastAPI
 app = FastAPI()
@@ -66,6 +68,8 @@ register_environments.register_envs()
 db = next(get_db())
 try:
     register_environments.register_standard_models(db=db)
+    backfill_current_ratings(db=db)
+    rebuild_game_stats(db=db, if_empty=True)
 finally:
     db.close()
 
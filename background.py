@@ -1,14 +1,21 @@
 # background.py
 import time
 import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set
 
 # core imports
-from core.models import Matchmaking, Environment, Game, PlayerGame, Elo
+from core.models import Matchmaking, Environment, Game, PlayerGame, CurrentRating, ModelStats
 
 # import configs
 from config import (
     MATCHMAKING_INTERVAL, HUMANITY_MODEL_NAME, STANDARD_MODELS,
-    MIN_WAIT_FOR_STANDARD, DEFAULT_ELO
+    MIN_WAIT_FOR_STANDARD, DEFAULT_ELO, MATCHMAKING_DEBOUNCE,
+    MATCHMAKING_WORKERS, MATCHMAKING_ENV_INTERVALS,
+    TIMEOUT_CHECK_INTERVAL, TIMEOUT_SWEEP_INTERVAL,
+    HEARTBEAT_FLUSH_INTERVAL, ELO_COMPACTION_INTERVAL,
+    SETTLEMENT_INTERVAL, ENV_CACHE_SWEEP_INTERVAL
 )
 
 # db imports
@@ -18,7 +25,16 @@ from sqlalchemy.orm import Session
 
 # local imports
 from matchmaking import matchmaking_algorithm
-from timeout_manager import check_and_enforce_timeouts
+from pair_history import pair_history
+from queue_events import queue_events
+from metrics import metrics
+from deadline_scheduler import deadlines
+from timeout_manager import check_and_enforce_timeouts, sweep_timeouts
+from heartbeat_cache import heartbeats
+from elo_compaction import compact_elo_history
+from settlement_queue import settlement_queue
+from env_handlers import EnvironmentManagerBase
+from env_pool import env_pool
 
 
 # logging
@@ -30,45 +46,189 @@ from datetime import timedelta
 console = Console()
 logger = logging.getLogger(__name__)
 
-def matchmaking_loop():
+class MatchmakingWorkers:
     """
-    Continuously runs in the background, checking for matchmaking conditions,
-    handling timeouts, etc.
+    Runs matchmaking sharded per environment on a thread pool.
+
+    Each environment is matched by at most one worker at a time (guarded by a
+    per-environment lock), with its own session and its own fallback cadence,
+    so one slow queue never holds up the others.
     """
-    while True:
+    def __init__(self, max_workers: int = MATCHMAKING_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="matchmaking")
+        self._locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._last_run: Dict[str, float] = {}
+
+    @staticmethod
+    def interval(env_id: str) -> float:
+        return MATCHMAKING_ENV_INTERVALS.get(env_id, MATCHMAKING_INTERVAL)
+
+    def submit(self, env_id: str) -> bool:
+        """Schedule a matchmaking pass for `env_id`; False if one is already running."""
+        lock = self._locks[env_id]
+        if not lock.acquire(blocking=False):
+            return False
+        self._last_run[env_id] = time.time()
+        self._executor.submit(self._run, env_id, lock)
+        return True
+
+    def _run(self, env_id: str, lock: threading.Lock):
+        start = time.perf_counter()
+        db_session = next(get_db())
         try:
-            # Provide a db session
-            db_session = next(get_db())
+            environment = db_session.query(Environment).filter(Environment.environment_id == env_id).first()
+            if environment is not None:
+                matchmaking_algorithm(db=db_session, environment=environment)
+        except Exception as e:
+            logger.error(f"Error in matchmaking for '{env_id}': {e}")
+            metrics.increment("matchmaking_errors", env_id=env_id)
+        finally:
+            db_session.close()
+            lock.release()
+            metrics.observe("matchmaking_tick_seconds", time.perf_counter() - start, env_id=env_id)
 
-            # handle step timeouts
-            check_and_enforce_timeouts(db=db_session)
+    def next_due(self, env_ids: List[str]) -> float:
+        """Seconds until the next environment is due for a fallback sweep."""
+        now = time.time()
+        return max(0, min(
+            (self._last_run.get(env_id, 0) + self.interval(env_id) - now for env_id in env_ids),
+            default=MATCHMAKING_INTERVAL
+        ))
 
-            # run the matchmaking
-            environments = db_session.query(Environment).all()
-            for env in environments:
-                matchmaking_algorithm(db=db_session, environment=env)
+    def due(self, env_ids: List[str]) -> Set[str]:
+        now = time.time()
+        return {env_id for env_id in env_ids if now - self._last_run.get(env_id, 0) >= self.interval(env_id)}
 
-            # log current status
-            # log_matchmaking_status(db_session)
 
-            db_session.close()
+def load_environment_ids() -> List[str]:
+    db_session = next(get_db())
+    try:
+        return [env_id for env_id, in db_session.query(Environment.environment_id).all()]
+    finally:
+        db_session.close()
 
-            # Sleep for your chosen interval
-            time.sleep(MATCHMAKING_INTERVAL)
+
+def matchmaking_loop(workers: MatchmakingWorkers = None):
+    """
+    Continuously runs in the background, dispatching matchmaking passes to the
+    per-environment workers whenever a queue changes or its fallback sweep is due.
+    """
+    workers = MatchmakingWorkers() if workers is None else workers
+    deferred: Set[str] = set()
+    changed_envs: Set[str] = set()
+    while True:
+        try:
+            env_ids = load_environment_ids()
+
+            # queues that changed, are due for a sweep, or were busy last time
+            for env_id in (changed_envs | workers.due(env_ids) | deferred) & set(env_ids):
+                if workers.submit(env_id):
+                    deferred.discard(env_id)
+                else:
+                    deferred.add(env_id)
+
+            # Wait for queue events, falling back to the next periodic sweep
+            timeout = workers.next_due(env_ids)
+            if deferred:
+                timeout = min(timeout, MATCHMAKING_DEBOUNCE)
+            changed_envs = queue_events.wait(timeout=timeout) or set()
 
         except Exception as e:
             logger.error(f"Error in matchmaking loop: {e}")
             # To avoid spinning in an error loop, add a brief sleep:
             time.sleep(5)
+            changed_envs = set()
+
+
+def timeout_loop():
+    """
+    Enforces step and queue timeouts on its own thread and session: expired
+    deadlines every TIMEOUT_CHECK_INTERVAL, plus a set-based full sweep every
+    TIMEOUT_SWEEP_INTERVAL as a safety net. Queue heartbeats are written to the
+    db every HEARTBEAT_FLUSH_INTERVAL (and by the sweep itself), and expired
+    environments are evicted from the cache every ENV_CACHE_SWEEP_INTERVAL.
+
+    Heartbeats, the deadline heap and the game locks are in-process state, so
+    this loop and the endpoints must share one worker process (see main.py).
+    """
+    last_sweep, last_flush, last_eviction = 0, 0, 0
+    while True:
+        try:
+            db_session = next(get_db())
+            try:
+                check_and_enforce_timeouts(db=db_session)
+                if time.time() - last_sweep >= TIMEOUT_SWEEP_INTERVAL:
+                    sweep_timeouts(db=db_session)
+                    last_sweep = last_flush = time.time()
+                elif time.time() - last_flush >= HEARTBEAT_FLUSH_INTERVAL:
+                    heartbeats.flush(db_session)
+                    last_flush = time.time()
+                if time.time() - last_eviction >= ENV_CACHE_SWEEP_INTERVAL:
+                    EnvironmentManagerBase.evict_expired()
+                    last_eviction = time.time()
+            finally:
+                db_session.close()
+            time.sleep(TIMEOUT_CHECK_INTERVAL)
+
+        except Exception as e:
+            logger.error(f"Error in timeout loop: {e}")
+            time.sleep(5)
+
+
+def settlement_loop():
+    """
+    Settles the rating updates of finished games from the durable settlement
+    queue, in queue order, whenever games finish (or every SETTLEMENT_INTERVAL).
+    """
+    while True:
+        try:
+            db_session = next(get_db())
+            try:
+                # drain the queue batch by batch
+                while settlement_queue.process(db=db_session):
+                    pass
+            finally:
+                db_session.close()
+            settlement_queue.wait(timeout=SETTLEMENT_INTERVAL)
+
+        except Exception as e:
+            logger.error(f"Error in settlement loop: {e}")
+            time.sleep(5)
+
+
+def compaction_loop():
+    """Compacts the Elo history every ELO_COMPACTION_INTERVAL."""
+    while True:
+        try:
+            db_session = next(get_db())
+            try:
+                compact_elo_history(db=db_session)
+            finally:
+                db_session.close()
+        except Exception as e:
+            logger.error(f"Error in compaction loop: {e}")
+        time.sleep(ELO_COMPACTION_INTERVAL)
+
 
 def start_background_tasks():
     """
-    Creates and starts the matchmaking background thread.
+    Creates and starts the matchmaking and timeout background threads.
     Call this function once from your main startup logic.
     """
-    thread = threading.Thread(target=matchmaking_loop, daemon=True)
-    thread.start()
-    logging.info("Background matchmaking thread started.")
+    # warm the recency index and the timeout deadlines from the db
+    db_session = next(get_db())
+    try:
+        pair_history.rebuild(db_session)
+        deadlines.rebuild(db_session)
+    finally:
+        db_session.close()
+    # ready environments for the first matches
+    env_pool.warm(load_environment_ids())
+
+    for target in (matchmaking_loop, timeout_loop, settlement_loop, compaction_loop):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+    logging.info("Background matchmaking, timeout, settlement and compaction threads started.")
 
 
 
@@ -108,11 +268,10 @@ def get_queue_table(db: Session, environment: Environment) -> Table:
                                       else f"In {str(timedelta(seconds=int(time_until_standard)))}"
 
         # Get Elo score and games played
-        elo_entry = db.query(Elo).filter_by(model_name=player.model_name,
-                                              environment_id=environment.environment_id) \
-                         .order_by(Elo.updated_at.desc()).first()
+        elo_entry = db.get(CurrentRating, (player.model_name, environment.environment_id))
         elo_score = elo_entry.elo if elo_entry else DEFAULT_ELO
-        games_played = db.query(PlayerGame).filter(PlayerGame.model_name == player.model_name).count()
+        stats = db.get(ModelStats, (player.model_name, environment.environment_id))
+        games_played = stats.games if stats else 0
 
         table.add_row(
             player.model_name,
@@ -1,6 +1,30 @@
 DATABASE_URL = "sqlite:///./test.db"
 DEFAULT_ELO = 1000
 MIN_GAMES_LEADERBOARD = 1
+LEADERBOARD_HISTORY_POINTS = 100 # default max Elo history points per leaderboard entry
+
+# Elo history compaction
+ELO_HISTORY_FULL_RESOLUTION = 7 * 24 * 3600 # keep every point this recent
+ELO_HISTORY_HOURLY_RETENTION = 90 * 24 * 3600 # hourly checkpoints up to this age, daily beyond
+ELO_COMPACTION_INTERVAL = 3600
+
+# Rating settlement queue
+SETTLEMENT_INTERVAL = 1 # seconds the settlement worker waits for new finished games
+SETTLEMENT_BATCH_SIZE = 100 # finished games settled per transaction
+SETTLEMENT_MAX_ATTEMPTS = 5 # failed games are left in the queue (with last_error) after this many tries
+
+# Environment cache
+ENV_CACHE_MAX_ENTRIES = 1000 # LRU bound on cached environment handlers
+ENV_CACHE_MAX_BYTES = 512 * 1024 * 1024 # LRU bound on their estimated size
+ENV_CACHE_FINISHED_TTL = 300 # seconds a finished game's environment stays cached
+ENV_CACHE_IDLE_TTL = 3600 # handlers untouched this long are evicted (their game has long timed out)
+ENV_CACHE_SWEEP_INTERVAL = 30
+
+# Environment snapshots
+ENV_SNAPSHOTS_ENABLED = True # checkpoint handlers after every step so games survive restarts
+ENV_SNAPSHOT_DIR = "./env_snapshots"
+ENV_SNAPSHOT_COMPRESSION = 1 # zlib level
+ENV_SNAPSHOT_MAX_AGE = 24 * 3600 # snapshots not written for this long are pruned
 
 # K-factor settings
 HUMAN_K_FACTOR = 8
@@ -9,25 +33,54 @@ INITIAL_K = 32
 REDUCED_K = 16
 GAMES_THRESHOLD = 50
 
+# Rating systems
+RATING_SYSTEMS = ["elo", "glicko2"] # updated on every settlement; "elo" is the primary rating
+GLICKO2_INITIAL_RD = 350
+GLICKO2_INITIAL_VOLATILITY = 0.06
+GLICKO2_TAU = 0.5 # constrains volatility changes
+GLICKO2_PERIOD_SECONDS = 24 * 3600 # idle time counted as one empty rating period (deviation growth)
+
 # Timeouts
 MATCHMAKING_INACTIVITY_TIMEOUT = 30
 STEP_TIMEOUT = 180 #60
+TIMEOUT_CHECK_INTERVAL = 3
+TIMEOUT_SWEEP_INTERVAL = 60 # full set-based sweep next to the deadline scheduler
+HEARTBEAT_FLUSH_INTERVAL = 10 # seconds between batched writes of queue heartbeats to Matchmaking.last_checked
 
 # Matchmaking
-MATCHMAKING_INTERVAL = 3
+MATCHMAKING_INTERVAL = 3 # fallback sweep interval; queue events wake the matchmaker earlier
+MATCHMAKING_DEBOUNCE = 0.2 # seconds to coalesce a burst of queue events into one pass
+MATCHMAKING_WORKERS = 4 # thread pool size; each environment is matched by one worker at a time
+MATCHMAKING_ENV_INTERVALS = {} # per-environment fallback interval overrides, e.g. {"BalancedSubset-v0": 3}
 MAX_ELO_DELTA = 400
 PCT_TIME_BASE = 0.5
 NUM_RECENT_GAMES_CAP = 25
+RECENCY_WINDOW = 3 * 3600 # seconds of game history used for the recency component
+MATCHING_MODE = "greedy" # "greedy" or "max_weight" (2-player environments only)
+MATCHING_COMPARE_MODES = False # also run max-weight matching in shadow to compare match counts
+MATCHING_MAX_EDGES_PER_PLAYER = 4 # keep the top-k accepted pairs per player for max-weight matching
+MATCHMAKING_EXHAUSTIVE_MAX_COMBINATIONS = 20_000 # N-player queues above this many combinations use greedy grouping
+MATCHMAKING_GROUP_CANDIDATES = 32 # nearest-Elo neighbours considered when growing an N-player group
 MIN_WAIT_FOR_STANDARD = 60
 
 RATE_LIMIT = 100_000
 
+# Metrics
+METRICS_SAMPLE_SIZE = 1000 # observations kept per histogram
+
 # Standard model names
 STANDARD_MODELS = [] #"google/gemini-flash-1.5"]
 HUMANITY_MODEL_NAME = "Humanity"
 
 # Environment related
 DEFAULT_ENV_ID = "BalancedSubset-v0"
+ENV_BUILD_WORKERS = 4 # threads building environments for newly matched games
+ENV_POOL_SIZE = 4 # ready (made and reset) environments kept per registered environment id
+ENV_POOL_WORKERS = 2 # threads refilling the pool
+LOCAL_MODEL_WORKERS = 8 # threads playing standard-model turns off the request path
+LOCAL_AGENT = "openrouter" # agent playing standard models: "openrouter", or "standin" for offline load tests
+LOCAL_STANDIN_ACTION = "[0]" # action played by the stand-in agent
+LOCAL_STANDIN_DELAY = 1.0 # seconds the stand-in agent takes per move (simulated model latency)
 ENV_NAME_TO_ID = {
   'TruthAndDeception-v0': '0',
   'DontSayIt-v0': '1',
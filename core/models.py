@@ -23,6 +23,42 @@ class Elo(Base):
     model = relationship("Model", back_populates="elos")
     environment = relationship("Environment")
 
+class CurrentRating(Base):
+    __tablename__ = "current_ratings"
+    model_name = Column(String, ForeignKey("models.model_name"), primary_key=True)
+    environment_id = Column(String, ForeignKey("environments.environment_id"), primary_key=True)
+    elo = Column(Float, nullable=False, default=1000)
+    prev_elo = Column(Float, nullable=True)
+    updated_at = Column(Float, nullable=False)
+
+class SystemRating(Base):
+    __tablename__ = "system_ratings"
+    system = Column(String, primary_key=True)
+    model_name = Column(String, ForeignKey("models.model_name"), primary_key=True)
+    environment_id = Column(String, ForeignKey("environments.environment_id"), primary_key=True)
+    rating = Column(Float, nullable=False)
+    deviation = Column(Float, nullable=True)
+    volatility = Column(Float, nullable=True)
+    updated_at = Column(Float, nullable=False)
+
+class PendingSettlement(Base):
+    __tablename__ = "pending_settlements"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False, unique=True)
+    environment_id = Column(String, nullable=True)  # rating environment override
+    enqueued_at = Column(Float, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+
+class ModelStats(Base):
+    __tablename__ = "model_stats"
+    model_name = Column(String, ForeignKey("models.model_name"), primary_key=True)
+    environment_id = Column(String, ForeignKey("environments.environment_id"), primary_key=True)
+    games = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+
 class Environment(Base):
     __tablename__ = "environments"
     environment_id = Column(String, primary_key=True)
@@ -70,6 +106,12 @@ class PlayerGame(Base):
     model = relationship("Model", back_populates="player_games")
     logs = relationship("PlayerLog", back_populates="player_game")
 
+class FinalObservation(Base):
+    __tablename__ = "final_observations"
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    player_id = Column(Integer, primary_key=True)
+    observation = Column(Text, nullable=False)  # JSON, served once the environment is evicted
+
 class PlayerLog(Base):
     __tablename__ = "player_logs"
     id = Column(Integer, primary_key=True, autoincrement=True)
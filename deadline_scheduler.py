@@ -0,0 +1,123 @@
+import heapq, threading, time
+from typing import Any, Dict, List, Tuple
+
+# db imports
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+# core imports
+from core.models import Game, PlayerGame, PlayerLog, Matchmaking
+
+# import configs
+from config import STEP_TIMEOUT, MATCHMAKING_INACTIVITY_TIMEOUT
+
+
+# deadline kinds
+STEP = "step"    # keyed by player_game_id: an observation is waiting for an action
+LOAD = "load"    # keyed by game_id: a new game whose players have not observed anything yet
+QUEUE = "queue"  # keyed by matchmaking id: a queue entry waiting for its next heartbeat
+
+
+class DeadlineScheduler:
+    """
+    Min-heap of timeout deadlines keyed by (kind, key).
+
+    Re-scheduling a key replaces its deadline; stale heap entries are skipped
+    lazily when popped. `pop_expired` only touches entries that are due, so the
+    cost of a timeout check grows with the number of expiries rather than with
+    the amount of live state. Popped entries are candidates: the caller
+    verifies them against the db and re-schedules if needed.
+
+    The heap is per process, like the heartbeats and game locks it works
+    with; deadlines scheduled by another worker process would go unseen, so
+    the server runs as a single worker (the periodic sweep is only a safety net).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, str, int]] = []
+        self._deadlines: Dict[Tuple[str, int], Tuple[float, Any]] = {}
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, kind: str, key: int, deadline: float, payload: Any = None, keep_earliest: bool = False):
+        with self._lock:
+            current = self._deadlines.get((kind, key))
+            if keep_earliest and current is not None and current[0] <= deadline:
+                return
+            self._deadlines[(kind, key)] = (deadline, payload)
+            heapq.heappush(self._heap, (deadline, kind, key))
+
+    def cancel(self, kind: str, key: int):
+        with self._lock:
+            self._deadlines.pop((kind, key), None)
+
+    def pop_expired(self, now: float = None) -> List[Tuple[str, int, Any]]:
+        """Remove and return all (kind, key, payload) entries whose deadline has passed."""
+        now = time.time() if now is None else now
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, kind, key = heapq.heappop(self._heap)
+                current = self._deadlines.get((kind, key))
+                if current is None or current[0] != deadline:
+                    continue  # cancelled or re-scheduled
+                del self._deadlines[(kind, key)]
+                expired.append((kind, key, current[1]))
+        return expired
+
+    # feeding helpers
+    def watch_step(self, player_game_id: int, game_id: int, model_name: str, observed_at: float):
+        """An observation was logged; the player must act within STEP_TIMEOUT of the oldest open one."""
+        self.schedule(STEP, player_game_id, observed_at + STEP_TIMEOUT, (game_id, model_name), keep_earliest=True)
+
+    def watch_game_start(self, game_id: int, started_at: float):
+        """A game was created; its players must start observing within STEP_TIMEOUT."""
+        self.schedule(LOAD, game_id, started_at + STEP_TIMEOUT)
+
+    def watch_queue(self, matchmaking_id: int, last_checked: float):
+        """A queue entry joined or sent a heartbeat."""
+        self.schedule(QUEUE, matchmaking_id, last_checked + MATCHMAKING_INACTIVITY_TIMEOUT)
+
+    def rebuild(self, db: Session):
+        """Reload every pending deadline from the db (e.g. after a restart)."""
+        with self._lock:
+            self._heap.clear()
+            self._deadlines.clear()
+
+        # oldest open observation per player in active games
+        open_logs = (
+            db.query(PlayerGame.id, PlayerGame.game_id, PlayerGame.model_name, func.min(PlayerLog.timestamp_observation))
+            .join(PlayerLog, PlayerLog.player_game_id == PlayerGame.id)
+            .join(Game, Game.id == PlayerGame.game_id)
+            .filter(
+                Game.status == "active",
+                PlayerLog.timestamp_observation.isnot(None),
+                PlayerLog.timestamp_action.is_(None)
+            )
+            .group_by(PlayerGame.id, PlayerGame.game_id, PlayerGame.model_name)
+            .all()
+        )
+        for player_game_id, game_id, model_name, observed_at in open_logs:
+            self.watch_step(player_game_id, game_id, model_name, observed_at)
+
+        # active games with players that never observed anything
+        unloaded = (
+            db.query(PlayerGame.game_id, func.min(PlayerGame.last_action_time))
+            .join(Game, Game.id == PlayerGame.game_id)
+            .filter(
+                Game.status == "active",
+                PlayerGame.outcome.is_(None),
+                ~PlayerGame.logs.any()
+            )
+            .group_by(PlayerGame.game_id)
+            .all()
+        )
+        for game_id, last_action_time in unloaded:
+            self.watch_game_start(game_id, last_action_time)
+
+        for matchmaking_id, last_checked in db.query(Matchmaking.id, Matchmaking.last_checked).all():
+            self.watch_queue(matchmaking_id, last_checked)
+
+
+deadlines = DeadlineScheduler()
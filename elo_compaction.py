@@ -0,0 +1,74 @@
+"""
+Elo history compaction.
+
+Keeps every Elo row of the last ELO_HISTORY_FULL_RESOLUTION seconds, the last
+row of every hour up to ELO_HISTORY_HOURLY_RETENTION and the last row of every
+day beyond that, per (model, environment). The latest row of a model is always
+the last row of its bucket, so current ratings are never affected.
+
+    python elo_compaction.py
+"""
+import logging, time
+from typing import Dict
+
+# db imports
+from sqlalchemy import delete, select, func, cast, Integer
+from sqlalchemy.orm import Session
+
+# core imports
+from core.models import Elo
+
+# import configs
+from config import ELO_HISTORY_FULL_RESOLUTION, ELO_HISTORY_HOURLY_RETENTION
+
+# local imports
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def _compact_range(db: Session, start: float, end: float, bucket_seconds: int) -> int:
+    """Delete all rows in [start, end) except the last one per model, environment and bucket."""
+    in_range = (Elo.updated_at >= start, Elo.updated_at < end)
+    keep = (
+        select(func.max(Elo.id))
+        .where(*in_range)
+        .group_by(Elo.model_name, Elo.environment_id, cast(Elo.updated_at / bucket_seconds, Integer))
+    )
+    return db.execute(
+        delete(Elo)
+        .where(*in_range, Elo.id.not_in(keep))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def compact_elo_history(db: Session, now: float = None) -> Dict[str, int]:
+    """Compact the Elo history in one transaction; returns the rows deleted per tier."""
+    now = time.time() if now is None else now
+    full_cutoff = now - ELO_HISTORY_FULL_RESOLUTION
+    hourly_cutoff = now - ELO_HISTORY_HOURLY_RETENTION
+
+    deleted = {
+        "hourly": _compact_range(db, hourly_cutoff, full_cutoff, HOUR),
+        "daily": _compact_range(db, 0, hourly_cutoff, DAY),
+    }
+    db.commit()
+
+    total = sum(deleted.values())
+    if total:
+        metrics.increment("elo_rows_compacted", total)
+        logger.info(f"Compacted Elo history: {deleted}")
+    return deleted
+
+
+if __name__ == "__main__":
+    from database import get_db
+
+    db = next(get_db())
+    try:
+        print(compact_elo_history(db))
+    finally:
+        db.close()
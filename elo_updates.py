@@ -1,93 +1,297 @@
 from typing import List, Tuple, Dict
+from collections import defaultdict
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, func, insert, update, bindparam, and_, tuple_
 import logging, time
 
 # db imports
-from core.models import PlayerGame, Elo
+from core.models import PlayerGame, Elo, Game, CurrentRating, ModelStats, SystemRating
 
 # import configs
 from config import (
-    DEFAULT_ELO, 
-    INITIAL_K, HUMAN_K_FACTOR, 
-    STANDARD_MODEL_K_FACTOR,
-    REDUCED_K, GAMES_THRESHOLD,
     HUMANITY_MODEL_NAME,
-    STANDARD_MODELS
+    STANDARD_MODELS,
+    RATING_SYSTEMS
+)
+
+# rating backends
+from rating_systems import (
+    get_rating_system, get_k_factor,
+    get_outcome_scores
 )
 
 logger = logging.getLogger(__name__)
 
 
-def get_dynamic_k(db: Session, model_name: str) -> float:
+def get_dynamic_k(db: Session, model_name: str, env_id: str) -> float:
     """Determine K-factor based on model type and games played."""
-    if model_name == HUMANITY_MODEL_NAME:
-        return HUMAN_K_FACTOR
-    if model_name in STANDARD_MODELS:
-        return STANDARD_MODEL_K_FACTOR
+    if model_name == HUMANITY_MODEL_NAME or model_name in STANDARD_MODELS:
+        return get_k_factor(model_name, 0)
     
-    games_played = db.query(PlayerGame).filter(PlayerGame.model_name == model_name).count()
-    return INITIAL_K if games_played < GAMES_THRESHOLD else REDUCED_K
+    stats = db.get(ModelStats, (model_name, env_id))
+    return get_k_factor(model_name, stats.games if stats else 0)
 
 
 
-def update_elos(db: Session, game_id: int, env_id: str):
-    players = db.query(PlayerGame).filter(PlayerGame.game_id == game_id).all()
-    # logger.debug(f"Calculating Elo updates for game '{game_id}' in environment '{env_id}'.")
-    current_time = time.time()
+def add_elo_entries(db: Session, rows: List[Dict]):
+    """
+    Append rows (model_name, environment_id, elo, updated_at) to the Elo history
+    and move the matching `current_ratings` entries along in the same transaction.
+    The caller commits.
+    """
+    if not rows:
+        return
+    db.execute(insert(Elo), rows)
 
-    min_reward = min([p.reward for p in players])
-    max_reward = max([p.reward for p in players])
-
-    # Gather player details
-    player_details = []
-    for p in players:
-        if p.reward > min_reward:
-            outcome = 1  # Win
-        elif p.reward < max_reward:
-            outcome = 0  # Loss
-        else:
-            outcome = 0.5  # Draw
-
-        elo_entry = db.query(Elo).filter_by(model_name=p.model_name, environment_id=env_id).order_by(desc(Elo.updated_at)).first()
-        prev_elo = elo_entry.elo if elo_entry else DEFAULT_ELO
-        k_factor = get_dynamic_k(db, p.model_name)
-        player_details.append({
-            'model_name': p.model_name,
-            'outcome': outcome,
-            'prev_elo': prev_elo,
-            'k_factor': k_factor
-        })
-
-    # print(f"\n\n Min: {min_reward}, Max: {max_reward}")
-    # print(player_details)
-
-    # Calculate average opponent Elo for each player
-    for player in player_details:
-        opponents = [p for p in player_details if p['model_name'] != player['model_name']]
-        if opponents:
-            avg_opp_elo = sum([opp['prev_elo'] for opp in opponents]) / len(opponents)
-        else:
-            avg_opp_elo = DEFAULT_ELO  # Default if no opponents
-
-        expected_score = 1 / (1 + 10 ** ((avg_opp_elo - player['prev_elo']) / 400))
-        # print(f"Model Name: {player['model_name']}, Outcome: {player['outcome']}, Prev Elo: {player['prev_elo']}, K-factor: {player['k_factor']}, avg Opp elo: {avg_opp_elo}, opponents: {opponents}")
-        # print(f"expected score: {expected_score}")
-        new_elo = player['prev_elo'] + player['k_factor'] * (player['outcome'] - expected_score)
-        player['new_elo'] = round(new_elo, 2)
-        # logger.info(f"Elo Update - {player['model_name']}: {player['prev_elo']} -> {player['new_elo']}")
-
-
-    # print(player_details)
-    # Persist Elo updates
-    for player in player_details:
-        new_elo_entry = Elo(
-            model_name=player['model_name'],
-            environment_id=env_id,
-            elo=player['new_elo'],
-            updated_at=current_time
+    keys = {(row['model_name'], row['environment_id']) for row in rows}
+    current = {
+        (r.model_name, r.environment_id): r.elo
+        for r in db.query(CurrentRating.model_name, CurrentRating.environment_id, CurrentRating.elo)
+        .filter(
+            CurrentRating.model_name.in_({model_name for model_name, _ in keys}),
+            CurrentRating.environment_id.in_({env_id for _, env_id in keys})
         )
-        db.add(new_elo_entry)
+        .all()
+    }
+
+    latest = {}
+    for row in rows:
+        key = (row['model_name'], row['environment_id'])
+        prev_elo = latest[key]['elo'] if key in latest else current.get(key)
+        latest[key] = {**row, 'prev_elo': prev_elo}
+
+    updates = [
+        {"b_model_name": model_name, "b_env_id": env_id, "elo": row['elo'],
+         "prev_elo": row['prev_elo'], "updated_at": row['updated_at']}
+        for (model_name, env_id), row in latest.items() if (model_name, env_id) in current
+    ]
+    if updates:
+        db.connection().execute(
+            update(CurrentRating)
+            .where(
+                CurrentRating.model_name == bindparam("b_model_name"),
+                CurrentRating.environment_id == bindparam("b_env_id")
+            ),
+            updates
+        )
+    inserts = [row for key, row in latest.items() if key not in current]
+    if inserts:
+        db.execute(insert(CurrentRating), inserts)
+
 
+def backfill_current_ratings(db: Session) -> int:
+    """
+    Create the missing `current_ratings` entries from the Elo history: the latest
+    and second-latest rows of every (model, environment). Returns how many were added.
+    """
+    # ids are monotonic, so max(id) is the most recent entry
+    latest_ids = (
+        db.query(Elo.model_name, Elo.environment_id, func.max(Elo.id).label("elo_id"))
+        .group_by(Elo.model_name, Elo.environment_id)
+        .subquery()
+    )
+    prev_ids = (
+        db.query(Elo.model_name, Elo.environment_id, func.max(Elo.id).label("elo_id"))
+        .join(latest_ids, and_(
+            Elo.model_name == latest_ids.c.model_name,
+            Elo.environment_id == latest_ids.c.environment_id,
+            Elo.id < latest_ids.c.elo_id
+        ))
+        .group_by(Elo.model_name, Elo.environment_id)
+        .subquery()
+    )
+    prev_elo = db.query(Elo.id, Elo.elo).subquery()
+    missing = (
+        db.query(Elo.model_name, Elo.environment_id, Elo.elo, prev_elo.c.elo, Elo.updated_at)
+        .join(latest_ids, Elo.id == latest_ids.c.elo_id)
+        .outerjoin(prev_ids, and_(
+            prev_ids.c.model_name == Elo.model_name,
+            prev_ids.c.environment_id == Elo.environment_id
+        ))
+        .outerjoin(prev_elo, prev_elo.c.id == prev_ids.c.elo_id)
+        .outerjoin(CurrentRating, and_(
+            CurrentRating.model_name == Elo.model_name,
+            CurrentRating.environment_id == Elo.environment_id
+        ))
+        .filter(CurrentRating.model_name.is_(None))
+        .all()
+    )
+    if missing:
+        db.execute(insert(CurrentRating), [
+            {"model_name": model_name, "environment_id": env_id, "elo": elo,
+             "prev_elo": prev, "updated_at": updated_at}
+            for model_name, env_id, elo, prev, updated_at in missing
+        ])
     db.commit()
-    # logger.debug(f"Elo ratings updated for game '{game_id}' in environment '{env_id}'.")
+    return len(missing)
+
+
+def settle_games(db: Session, game_ids: List[int], env_id: str = None, commit: bool = True):
+    """
+    Apply the rating updates of several finished games in one transaction.
+
+    Players, their current ratings and their game counts are loaded in bulk,
+    the games are settled in chronological order (so a model that played
+    several of them carries its rating and game count from one game to the
+    next, exactly as when settling them one at a time) and all new
+    Elo rows are inserted and committed together. Every system in
+    RATING_SYSTEMS is updated through its `RatingSystem` backend; Elo keeps its
+    history in `elos`, the others are stored side by side in `system_ratings`.
+    `env_id` overrides the environment the ratings are read from and written to.
+    With `commit=False` the caller commits (e.g. together with its own writes).
+    """
+    if not game_ids:
+        return
+    current_time = time.time()
+
+    batch = (
+        db.query(Game.id, Game.environment_id, Game.started_at)
+        .filter(Game.id.in_(game_ids))
+        .order_by(Game.started_at, Game.id)
+        .all()
+    )
+    if not batch:
+        return
+    games = [(game_id, env_id or game_env_id) for game_id, game_env_id, _ in batch]
+    players_by_game = defaultdict(list)
+    for p in db.query(PlayerGame).filter(PlayerGame.game_id.in_(game_ids)).order_by(PlayerGame.player_id).all():
+        players_by_game[p.game_id].append(p)
+
+    model_names = {p.model_name for players in players_by_game.values() for p in players}
+    env_ids = {game_env_id for _, game_env_id in games}
+
+    # rating states per system; Elo is always settled and lives in elos/current_ratings
+    systems = [get_rating_system("elo")] + [get_rating_system(name) for name in RATING_SYSTEMS if name != "elo"]
+    states = {
+        ("elo", model_name, env_id): {"rating": elo, "deviation": None, "volatility": None, "updated_at": updated_at}
+        for model_name, env_id, elo, updated_at in db.query(
+            CurrentRating.model_name, CurrentRating.environment_id, CurrentRating.elo, CurrentRating.updated_at
+        )
+        .filter(CurrentRating.model_name.in_(model_names), CurrentRating.environment_id.in_(env_ids))
+        .all()
+    }
+    stored_system_keys = set()
+    if len(systems) > 1:
+        for r in db.query(SystemRating).filter(
+            SystemRating.system.in_([system.name for system in systems[1:]]),
+            SystemRating.model_name.in_(model_names),
+            SystemRating.environment_id.in_(env_ids)
+        ).all():
+            stored_system_keys.add((r.system, r.model_name, r.environment_id))
+            states[(r.system, r.model_name, r.environment_id)] = {
+                "rating": r.rating, "deviation": r.deviation, "volatility": r.volatility, "updated_at": r.updated_at
+            }
+    games_played = count_games_played(db, batch, model_names)
+
+    new_rows, changed_system_keys = [], set()
+    for idx, (game_id, game_env_id) in enumerate(games):
+        players = players_by_game[game_id]
+        if not players or any(p.reward is None for p in players):
+            logger.warning(f"Skipping Elo settlement for game '{game_id}': missing rewards.")
+            continue
+
+        # keep history timestamps strictly ordered within the batch
+        updated_at = current_time + idx * 1e-6
+        outcomes = get_outcome_scores([p.reward for p in players])
+        for system in systems:
+            keys = [(system.name, p.model_name, game_env_id) for p in players]
+            new_states = system.update([
+                {
+                    'model_name': p.model_name,
+                    'reward': p.reward,
+                    'outcome': outcome,
+                    'games_played': games_played.get((game_id, p.model_name), 1),
+                    'state': states.get(key) or system.initial_state()
+                }
+                for p, outcome, key in zip(players, outcomes, keys)
+            ], updated_at)
+            for key, state in zip(keys, new_states):
+                states[key] = state
+                if system.name == "elo":
+                    new_rows.append({
+                        "model_name": key[1],
+                        "environment_id": game_env_id,
+                        "elo": state['rating'],
+                        "updated_at": updated_at
+                    })
+                else:
+                    changed_system_keys.add(key)
+
+    # Persist Elo updates and the other systems' ratings
+    add_elo_entries(db, new_rows)
+    save_system_ratings(db, {key: states[key] for key in changed_system_keys}, stored_system_keys)
+    if commit:
+        db.commit()
+
+
+def count_games_played(db: Session, batch: List[Tuple[int, str, float]], model_names) -> Dict[Tuple[int, str], int]:
+    """
+    Number of games (this one included) each player of a batch game has
+    finished in the game's environment, keyed by (game_id, model_name).
+
+    Finished games are ordered by (started_at, id), the order `elo_replay`
+    replays them in, so a game's count does not depend on which batch it is
+    settled in. `batch` holds (game_id, environment_id, started_at) in that order.
+    """
+    env_ids = {game_env_id for _, game_env_id, _ in batch}
+    first = (batch[0][2], batch[0][0])
+    last = (batch[-1][2], batch[-1][0])
+    finished = (
+        db.query(PlayerGame.model_name, Game.environment_id)
+        .join(Game, Game.id == PlayerGame.game_id)
+        .filter(
+            Game.status == "finished",
+            PlayerGame.model_name.in_(model_names),
+            Game.environment_id.in_(env_ids)
+        )
+    )
+    # games ordered before the batch are only counted; those within its span are walked in order
+    counts = defaultdict(int, {
+        (model_name, game_env_id): games
+        for model_name, game_env_id, games in finished
+        .filter(tuple_(Game.started_at, Game.id) < first)
+        .group_by(PlayerGame.model_name, Game.environment_id)
+        .with_entities(PlayerGame.model_name, Game.environment_id, func.count())
+        .all()
+    })
+    batch_ids = {game_id for game_id, _, _ in batch}
+    games_played = {}
+    for game_id, model_name, game_env_id in (
+        finished
+        .filter(tuple_(Game.started_at, Game.id) >= first, tuple_(Game.started_at, Game.id) <= last)
+        .with_entities(Game.id, PlayerGame.model_name, Game.environment_id)
+        .order_by(Game.started_at, Game.id)
+    ):
+        counts[(model_name, game_env_id)] += 1
+        if game_id in batch_ids:
+            games_played[(game_id, model_name)] = counts[(model_name, game_env_id)]
+    return games_played
+
+
+def save_system_ratings(db: Session, states: Dict[Tuple[str, str, str], Dict], stored_keys=()):
+    """Write (system, model_name, environment_id) -> state; `stored_keys` already have a row. The caller commits."""
+    updates = [
+        {"b_system": system, "b_model_name": model_name, "b_env_id": env_id, **state}
+        for (system, model_name, env_id), state in states.items() if (system, model_name, env_id) in stored_keys
+    ]
+    if updates:
+        db.connection().execute(
+            update(SystemRating)
+            .where(
+                SystemRating.system == bindparam("b_system"),
+                SystemRating.model_name == bindparam("b_model_name"),
+                SystemRating.environment_id == bindparam("b_env_id")
+            ),
+            updates
+        )
+    inserts = [
+        {"system": system, "model_name": model_name, "environment_id": env_id, **state}
+        for (system, model_name, env_id), state in states.items() if (system, model_name, env_id) not in stored_keys
+    ]
+    if inserts:
+        db.execute(insert(SystemRating), inserts)
+
+
+def update_elos(db: Session, game_id: int, env_id: str):
+    """Settle a single finished game (see `settle_games`)."""
+    settle_games(db, [game_id], env_id=env_id)
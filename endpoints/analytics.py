@@ -11,16 +11,22 @@ from sqlalchemy import desc, func, case, label, and_
 
 # core imports
 from core.schemas import ModelRegistrationRequest
-from core.models import Model, Elo, Game, PlayerGame, PlayerLog
+from core.models import Model, Elo, Game, PlayerGame, PlayerLog, CurrentRating, ModelStats, SystemRating
 
 # import configs
-from config import RATE_LIMIT, ENV_NAME_TO_ID, DEFAULT_ENV_ID, MIN_GAMES_LEADERBOARD
+from config import (
+    RATE_LIMIT, ENV_NAME_TO_ID, DEFAULT_ENV_ID, MIN_GAMES_LEADERBOARD,
+    RATING_SYSTEMS, LEADERBOARD_HISTORY_POINTS
+)
 
 # import utilities
 import secrets, time
 from urllib.parse import unquote
 
 # local imports
+from metrics import metrics
+from env_handlers import EnvironmentManagerBase
+from env_pool import env_pool
 from utils import (
     categorize_reason,
     get_model, get_latest_elo,
@@ -37,7 +43,10 @@ limiter = Limiter(key_func=get_remote_address)
 
 
 @router.get("/models/{model_name}")
-async def get_model_details(model_name: str, db: Session = Depends(get_db)):
+async def get_model_details(
+    model_name: str, max_points: int = Query(None, ge=1), bucket_seconds: float = Query(None, gt=0),
+    db: Session = Depends(get_db)
+):
     # 1) Decode
     model_name = unquote(model_name)
     # 2) Fetch model & description (raises 404 if not found)
@@ -45,7 +54,7 @@ async def get_model_details(model_name: str, db: Session = Depends(get_db)):
 
     # 3) Gather data
     latest_elo = get_latest_elo(db, model_name, DEFAULT_ENV_ID)
-    elo_history = get_elo_history(db, model_name, DEFAULT_ENV_ID)
+    elo_history = get_elo_history(db, model_name, DEFAULT_ENV_ID, max_points=max_points, bucket_seconds=bucket_seconds)
     game_specific_stats, overall_stats = get_game_stats(db, model_name, DEFAULT_ENV_ID)
     recent_games = get_recent_games(db, model_name, DEFAULT_ENV_ID)
     # Get detailed game history (with environment, opponent and outcome)
@@ -72,8 +81,20 @@ async def get_model_details(model_name: str, db: Session = Depends(get_db)):
 
 
 
+@router.get("/metrics")
+def get_metrics():
+    """In-process performance metrics (counters, gauges and histogram summaries), the environment cache and pool."""
+    return {**metrics.summary(), "env_cache": EnvironmentManagerBase.cache_stats(), "env_pool": env_pool.stats()}
+
+
 @router.get("/leaderboard")
-def get_leaderboard(limit: int = Query(10), page: int = Query(1), db: Session = Depends(get_db)):
+def get_leaderboard(
+    limit: int = Query(10), page: int = Query(1), system: str = Query("elo"),
+    max_points: int = Query(LEADERBOARD_HISTORY_POINTS, ge=1), bucket_seconds: float = Query(None, gt=0),
+    db: Session = Depends(get_db)
+):
+    if system != "elo" and system not in RATING_SYSTEMS:
+        raise HTTPException(status_code=400, detail=f"Unknown rating system '{system}'.")
 
     def get_avg_move_time(model_name, specific_env_id=None):
         """Calculate average move time from observation to action for a model."""
@@ -99,65 +120,36 @@ def get_leaderboard(limit: int = Query(10), page: int = Query(1), db: Session =
             
         return round(result, 2)
 
-    # 1. Get the latest ELO timestamp for each model
-    latest_elo_times = (
-        db.query(
-            Elo.model_name,
-            func.max(Elo.updated_at).label('latest_time')
-        )
-        .filter(Elo.environment_id == DEFAULT_ENV_ID)
-        .group_by(Elo.model_name)
-        .subquery()
-    )
-
-    # 2. Get the latest ELO values for each model
-    latest_elos = (
-        db.query(
-            Elo.model_name,
-            Elo.elo
+    # 1-2. Get the current rating of each model in the requested system
+    if system == "elo":
+        latest_elos = (
+            db.query(
+                CurrentRating.model_name,
+                CurrentRating.elo
+            )
+            .filter(CurrentRating.environment_id == DEFAULT_ENV_ID)
+            .subquery()
         )
-        .join(
-            latest_elo_times,
-            and_(
-                Elo.model_name == latest_elo_times.c.model_name,
-                Elo.updated_at == latest_elo_times.c.latest_time
+    else:
+        latest_elos = (
+            db.query(
+                SystemRating.model_name,
+                SystemRating.rating.label("elo")
             )
+            .filter(SystemRating.environment_id == DEFAULT_ENV_ID, SystemRating.system == system)
+            .subquery()
         )
-        .filter(Elo.environment_id == DEFAULT_ENV_ID)
-        .subquery()
-    )
 
-    # 3. Get overall stats for each model
+    # 3-5. Get overall stats and game counts for each model from the counters
     model_stats = (
         db.query(
-            PlayerGame.model_name,
-            func.sum(case((PlayerGame.outcome == 'Win', 1), else_=0)).label('wins'),
-            func.sum(case((PlayerGame.outcome == 'Loss', 1), else_=0)).label('losses'),
-            func.sum(case((PlayerGame.outcome == 'Draw', 1), else_=0)).label('draws')
+            ModelStats.model_name,
+            ModelStats.wins,
+            ModelStats.losses,
+            ModelStats.draws,
+            ModelStats.games.label("game_count")
         )
-        .join(Game, PlayerGame.game_id == Game.id)
-        .filter(
-            Game.environment_id == DEFAULT_ENV_ID,
-            Game.status == 'finished'
-        )
-        .group_by(PlayerGame.model_name)
-        .subquery()
-    )
-
-    # 4. Create a subquery to count the number of games per model.
-    game_counts = (
-        db.query(
-            PlayerGame.model_name,
-            func.count(PlayerGame.id).label("game_count")
-        )
-        .group_by(PlayerGame.model_name)
-        .subquery()
-    )
-
-    # 5. Create a subquery of eligible models that meet the MIN_GAMES_LEADERBOARD criteria.
-    eligible_models = (
-        db.query(game_counts.c.model_name)
-        .filter(game_counts.c.game_count >= MIN_GAMES_LEADERBOARD)
+        .filter(ModelStats.environment_id == DEFAULT_ENV_ID)
         .subquery()
     )
 
@@ -169,11 +161,10 @@ def get_leaderboard(limit: int = Query(10), page: int = Query(1), db: Session =
             model_stats.c.wins,
             model_stats.c.losses,
             model_stats.c.draws,
-            game_counts.c.game_count
+            model_stats.c.game_count
         )
         .join(model_stats, latest_elos.c.model_name == model_stats.c.model_name)
-        .join(game_counts, latest_elos.c.model_name == game_counts.c.model_name)
-        .filter(latest_elos.c.model_name.in_(db.query(eligible_models.c.model_name)))
+        .filter(model_stats.c.game_count >= MIN_GAMES_LEADERBOARD)
         .order_by(desc(latest_elos.c.elo))
     )
 
@@ -232,23 +223,8 @@ def get_leaderboard(limit: int = Query(10), page: int = Query(1), db: Session =
         
         return stats_dict
 
-    def get_elo_history(model_name):
-        history = (
-            db.query(Elo)
-            .filter(
-                Elo.model_name == model_name,
-                Elo.environment_id == DEFAULT_ENV_ID
-            )
-            .order_by(Elo.updated_at)
-            .all()
-        )
-        return [
-            {
-                "time": time.strftime("%Y-%m-%d %H:%M", time.localtime(h.updated_at)),
-                "elo": round(h.elo)
-            }
-            for h in history
-        ]
+    def get_model_elo_history(model_name):
+        return get_elo_history(db, model_name, DEFAULT_ENV_ID, max_points=max_points, bucket_seconds=bucket_seconds)
 
     def get_recent_games(model_name):
         return (
@@ -273,7 +249,7 @@ def get_leaderboard(limit: int = Query(10), page: int = Query(1), db: Session =
         game_stats = get_game_specific_stats(model_name)
         overall_avg_time = get_avg_move_time(model_name)
         recent_games = get_recent_games(model_name)
-        elo_history = get_elo_history(model_name)
+        elo_history = get_model_elo_history(model_name)
 
         total_games = (row.wins or 0) + (row.losses or 0) + (row.draws or 0)
         win_rate = f"{((row.wins or 0)/total_games * 100 if total_games > 0 else 0):.1f}%"
@@ -298,5 +274,6 @@ def get_leaderboard(limit: int = Query(10), page: int = Query(1), db: Session =
         "leaderboard": leaderboard,
         "page": page,
         "limit": limit,
+        "system": system,
         # Optionally add total pages/next_page/prev_page info if available.
     }
\ No newline at end of file
@@ -20,7 +20,12 @@ from config import RATE_LIMIT, HUMANITY_MODEL_NAME
 
 # import utilities
 import secrets, time, json
-from elo_updates import update_elos
+from game_stats import record_outcomes
+from settlement_queue import settlement_queue
+from queue_events import queue_events
+from deadline_scheduler import deadlines
+from heartbeat_cache import heartbeats
+from metrics import metrics
 
 # import env handler
 from env_handlers import (
@@ -114,6 +119,8 @@ def human_join_matchmaking(request: Request, db: Session = Depends(get_db)):
         )
         db.add(mm)
         db.commit()
+        deadlines.watch_queue(mm.id, mm.last_checked)
+        queue_events.notify(mm.environment_id)
         
         return JSONResponse(
             content={"message": "Added to matchmaking queue"},
@@ -139,8 +146,8 @@ def human_check_matchmaking_status(request: Request, db: Session = Depends(get_d
         Matchmaking.human_ip == ip_address
     ).first()
     if mm:
-        mm.last_checked = time.time()
-        db.commit()
+        last_checked = heartbeats.touch(mm.id)
+        deadlines.watch_queue(mm.id, last_checked)
         return {"status": "Searching"}
 
     # 2. Check if a game has been created for you
@@ -202,13 +209,15 @@ def human_check_turn(
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    # 2. Get environment
-    env_manager = EnvironmentManagerBase.get_appropriate_manager(game_id, db)
-    env = env_manager.get_env(game_id=game_id, env_id="BalancedSubset-v0", db=db)
+    # 2. Get environment (concluded games are served from the cache or the stored final observation)
+    env = None
+    if game.status == "active":
+        env_manager = EnvironmentManagerBase.get_appropriate_manager(game_id, db)
+        env = env_manager.get_env(game_id=game_id, env_id="BalancedSubset-v0", db=db)
 
-    if game.status != "active" or env.check_done():
+    if env is None or env.check_done():
         # check observations if available
-        obs = env.force_get_observation(pg.player_id)
+        obs = EnvironmentManagerBase.get_final_observation(db, game_id, pg.player_id)
         # print(f"\n\nDone. Env: {env}, obs: {obs}")
 
         if obs and len(obs) != 0:
@@ -240,27 +249,32 @@ def human_check_turn(
     #         "observation": "Game has ended",
     #         "done": True
     #     }
-    # 4. Check if it's this player's turn
-    if env.check_player_turn(player_id=pg.player_id):
-        obs = env.get_observation(pg.player_id)
-        
-        # Log the observation
-        log_entry = PlayerLog(
-            player_game_id=pg.id,
-            model_name=HUMANITY_MODEL_NAME,  # or any label you use for humans
-            observation=json.dumps(obs),
-            timestamp_observation=time.time()
-        )
-        db.add(log_entry)
-        db.commit()
-
-        return {
-            "status": "Your turn",
-            "observation": obs,
-            "done": env.check_done()
-        }
-    else:
-        return {"status": "Not your turn"}
+    # 4. Check if it's this player's turn (never while a move or the standard model is changing the game)
+    with env_manager.game_lock(game_id):
+        if env.check_player_turn(player_id=pg.player_id):
+            obs = env.get_observation(pg.player_id)
+            
+            # Log the observation
+            log_entry = PlayerLog(
+                player_game_id=pg.id,
+                model_name=HUMANITY_MODEL_NAME,  # or any label you use for humans
+                observation=json.dumps(obs),
+                timestamp_observation=time.time()
+            )
+            db.add(log_entry)
+            db.commit()
+            deadlines.watch_step(pg.id, game_id, pg.model_name, log_entry.timestamp_observation)
+            if env.mark_observed():
+                metrics.observe("time_to_first_observation_seconds", log_entry.timestamp_observation - game.started_at,
+                                env_id=game.environment_id)
+
+            return {
+                "status": "Your turn",
+                "observation": obs,
+                "done": env.check_done()
+            }
+        else:
+            return {"status": "Not your turn"}
 
 
 
@@ -288,57 +302,57 @@ def human_make_move(
     env_manager = EnvironmentManagerBase.get_appropriate_manager(game_id, db)
     # print(env_manager)
     env = env_manager.get_env(game_id=game_id, env_id="BalancedSubset-v0", db=db)
-    if not env.check_player_turn(player_id=pg.player_id):
-        raise HTTPException(status_code=400, detail="Not your turn")
-
-    # 3) Execute step
-    env.execute_step(action=move)
-    pg.last_action_time = time.time()
-    db.commit()
-
-    # update log
-    log_entry = db.query(PlayerLog).filter(
-        PlayerLog.player_game_id==pg.id,
-        PlayerLog.model_name==pg.model_name
-    ).order_by(desc(PlayerLog.timestamp_observation)).first()
-    # print(pg.id, pg.model_name, log_entry)
-
-    if log_entry:
-        log_entry.action = payload.move
-        log_entry.timestamp_action = time.time()
-        db.commit()
 
-    # 4) Check if game done
-    if env.check_done():
-        rewards, info = env.extract_results()
-        game = db.query(Game).filter(Game.id == game_id).first()
-        game.status = "finished"
-        game.reason = info.get("reason", "No reason provided")
-
-        for player in db.query(PlayerGame).filter(PlayerGame.game_id == game_id).all():
-            player.reward = rewards[player.player_id]
-            if player.reward > min(rewards.values()):
-                player.outcome = "Win"
-            elif player.reward < max(rewards.values()):
-                player.outcome = "Loss"
-            else:
-                player.outcome = "Draw"
+    # one move of a game at a time: concurrent requests see the game as it is after the previous move
+    with env_manager.game_lock(game_id):
+        # the game may have timed out while this request waited for the lock
+        status = db.query(Game.status).filter(Game.id == game_id).scalar()
+        if env.check_done() or status != "active":
+            raise HTTPException(status_code=400, detail="Game already concluded")
 
+        if not env.check_player_turn(player_id=pg.player_id):
+            raise HTTPException(status_code=400, detail="Not your turn")
+
+        # 3) Execute step
+        env.execute_step(action=move)
+        pg.last_action_time = time.time()
         db.commit()
-        obs = env.force_get_observation(player.player_id)
-        env_manager.remove_env(game_id)
 
-        # Elo updates
-        update_elos(db, game_id, "BalancedSubset-v0")
+        # update log
+        log_entry = db.query(PlayerLog).filter(
+            PlayerLog.player_game_id==pg.id,
+            PlayerLog.model_name==pg.model_name
+        ).order_by(desc(PlayerLog.timestamp_observation)).first()
+        # print(pg.id, pg.model_name, log_entry)
 
-        return {
-            "status": "Game completed",
-            "reward": rewards[pg.player_id],
-            "observation": obs,
-            "reason": info.get("reason", "No reason provided")
-        }
+        if log_entry:
+            log_entry.action = payload.move
+            log_entry.timestamp_action = time.time()
+            db.commit()
+
+        # 4) Check if game done
+        if env.check_done():
+            rewards, info = env.extract_results()
+            game = record_outcomes(db, game_id, rewards, reason=info.get("reason", "No reason provided"))
+            if game is None:
+                raise HTTPException(status_code=400, detail="Game already concluded")
+            # Elo updates are queued and settled by the settlement worker
+            settlement_queue.enqueue(db, game_id, env_id="BalancedSubset-v0")
+            obs = env.force_get_observation(max(rewards))  # last player's final observation
+            env_manager.remove_env(game_id, db=db)
+            db.commit()
+            settlement_queue.notify()
+
+            queue_events.notify(game.environment_id)
+
+            return {
+                "status": "Game completed",
+                "reward": rewards[pg.player_id],
+                "observation": obs,
+                "reason": info.get("reason", "No reason provided")
+            }
 
-    return {"status": "Move accepted", "done": False}
+        return {"status": "Move accepted", "done": False}
 
 
 
@@ -15,7 +15,7 @@ from core.schemas import (
     LeaveMatchmakingRequest, StepRequest, GetResultsRequest
 )
 from core.models import (
-    Elo, Model, Game, Environment, Matchmaking, PlayerGame, PlayerLog
+    Elo, Model, Game, Environment, Matchmaking, PlayerGame, PlayerLog, CurrentRating
 )
 
 # import env handlers
@@ -25,8 +25,15 @@ from env_handlers import (
     LocalEnvHandler
 )
 
-# elo import
-from elo_updates import update_elos
+# outcomes and queued rating updates
+from game_stats import record_outcomes
+from settlement_queue import settlement_queue
+
+# matchmaker wake-up, timeout deadlines and queue heartbeats
+from queue_events import queue_events
+from deadline_scheduler import deadlines, QUEUE
+from heartbeat_cache import heartbeats
+from metrics import metrics
 
 
 # import configs
@@ -75,6 +82,8 @@ def join_matchmaking_endpoint(request: Request, payload: MatchmakingRegistration
                      joined_at=time.time(), time_limit=payload.queue_time_limit, last_checked=time.time())
     db.add(mm)
     db.commit()
+    deadlines.watch_queue(mm.id, mm.last_checked)
+    queue_events.notify(payload.env_id)
     return {"message": "Matchmaking request submitted"}
 
 @router.post("/leave_matchmaking")
@@ -104,6 +113,9 @@ def leave_matchmaking_endpoint(request: Request, payload: LeaveMatchmakingReques
     
     db.delete(mm)
     db.commit()
+    deadlines.cancel(QUEUE, mm.id)
+    heartbeats.discard(mm.id)
+    queue_events.notify(payload.env_id)
     
     return {"message": f"Model '{payload.model_name}' has left the matchmaking queue for environment '{payload.env_id}'."}
 
@@ -116,8 +128,8 @@ def check_matchmaking_status_endpoint(request: Request, env_id: str, model_token
 
     mm = db.query(Matchmaking).filter(Matchmaking.model_name == model_name, Matchmaking.environment_id == env_id).first()
     if mm:
-        mm.last_checked = time.time()
-        db.commit()
+        last_checked = heartbeats.touch(mm.id)
+        deadlines.watch_queue(mm.id, last_checked)
         return {"status": "Searching", "queue_time": time.time() - mm.joined_at, "queue_time_limit": mm.time_limit}
 
     game = db.query(Game).join(PlayerGame).filter(PlayerGame.model_name == model_name, Game.environment_id == env_id, Game.status == "active").first()
@@ -148,14 +160,8 @@ def check_turn_endpoint(request: Request, env_id: str, model_name: str, model_to
     pg = db.query(PlayerGame).filter(PlayerGame.game_id == game_id, PlayerGame.model_name == model_name).first()
 
     if game.status != "active":
-        db.query(PlayerGame).filter(
-            PlayerGame.model_name == model_name,
-            PlayerGame.game_id == game.id
-        ).first()
-        env_manager = EnvironmentManagerBase.get_appropriate_manager(game_id, db)
-        env = env_manager.get_env(game_id=game_id, env_id="BalancedSubset-v0", db=db)
-
-        obs = env.force_get_observation(pg.player_id)
+        # served from the cached environment or, once evicted, the stored final observation
+        obs = EnvironmentManagerBase.get_final_observation(db, game_id, pg.player_id)
         # obs = env.get_observation(pg.
         ### get player game)
         if obs:
@@ -177,15 +183,21 @@ def check_turn_endpoint(request: Request, env_id: str, model_name: str, model_to
     env_manager = EnvironmentManagerBase.get_appropriate_manager(game_id, db)
     env = env_manager.get_env(game_id=game_id, env_id=env_id, db=db)
     
-    if env.check_player_turn(player_id=player_id):
-        obs = env.get_observation(player_id)
-        log_entry = PlayerLog(player_game_id=pg.id, model_name=pg.model_name, 
-                            observation=json.dumps(obs), timestamp_observation=time.time())
-        db.add(log_entry)
-        db.commit()
-        return {"status": "Your turn", "game_id": game_id, "observation": obs, "done": env.check_done()}
-    else:
-        return {"status": "Not your turn"}
+    # never read the game while a step (or the standard model's worker) is changing it
+    with env_manager.game_lock(game_id):
+        if env.check_player_turn(player_id=player_id):
+            obs = env.get_observation(player_id)
+            log_entry = PlayerLog(player_game_id=pg.id, model_name=pg.model_name, 
+                                observation=json.dumps(obs), timestamp_observation=time.time())
+            db.add(log_entry)
+            db.commit()
+            deadlines.watch_step(pg.id, game_id, pg.model_name, log_entry.timestamp_observation)
+            if env.mark_observed():
+                metrics.observe("time_to_first_observation_seconds", log_entry.timestamp_observation - game.started_at,
+                                env_id=game.environment_id)
+            return {"status": "Your turn", "game_id": game_id, "observation": obs, "done": env.check_done()}
+        else:
+            return {"status": "Not your turn"}
 
 
 @router.post("/step")
@@ -223,49 +235,42 @@ def step_endpoint(request: Request, payload: StepRequest, db: Session = Depends(
 
     env_manager = EnvironmentManagerBase.get_appropriate_manager(payload.game_id, db)
     env = env_manager.get_env(game_id=payload.game_id, env_id=payload.env_id, db=db)
-    
-    if env.check_player_turn(player_id=pg.player_id):
-        env.execute_step(action=payload.action_text)
-        log_entry = db.query(PlayerLog).filter(
-            PlayerLog.player_game_id==pg.id, 
-            PlayerLog.model_name==pg.model_name
-        ).order_by(desc(PlayerLog.timestamp_observation)).first()
-        
-        if log_entry:
-            log_entry.action = payload.action_text
-            log_entry.timestamp_action = time.time()
-            db.commit()
 
-        done = env.check_done()
-        if done:
-            rewards, info = env.extract_results()
-            game = db.query(Game).filter(Game.id == payload.game_id).first()
-            if game:
-                game.status = "finished"
-                game.reason = info.get("reason", "No reason provided")
-                
-            env_manager.remove_env(payload.game_id)
-
-            players = db.query(PlayerGame).filter(PlayerGame.game_id == payload.game_id).all()
-            min_reward = min([rewards[player.player_id] for player in players])
-            max_reward = max([rewards[player.player_id] for player in players])
-            
-            for player in players:
-                player.reward = rewards[player.player_id]
-                if player.reward > min_reward:
-                    player.outcome = "Win"
-                elif player.reward < max_reward:
-                    player.outcome = "Loss"
-                else:
-                    player.outcome = "Draw"
-            
+    # one step of a game at a time: concurrent requests see the game as it is after the previous step
+    with env_manager.game_lock(payload.game_id):
+        # the game may have timed out while this request waited for the lock
+        status = db.query(Game.status).filter(Game.id == payload.game_id).scalar()
+        if env.check_done() or status != "active":
+            return {"message": "Game concluded.", "done": True}
+
+        if env.check_player_turn(player_id=pg.player_id):
+            env.execute_step(action=payload.action_text)
+            log_entry = db.query(PlayerLog).filter(
+                PlayerLog.player_game_id==pg.id, 
+                PlayerLog.model_name==pg.model_name
+            ).order_by(desc(PlayerLog.timestamp_observation)).first()
+        
+            if log_entry:
+                log_entry.action = payload.action_text
+                log_entry.timestamp_action = time.time()
                 db.commit()
-                
-            update_elos(db, payload.game_id, game.environment_id)
 
-        return {"message": "Action submitted.", "done": done}
-    else:
-        raise HTTPException(status_code=400, detail="Not your turn.")
+            done = env.check_done()
+            if done:
+                rewards, info = env.extract_results()
+
+                # outcomes, game counters and the queued rating update in one transaction
+                game = record_outcomes(db, payload.game_id, rewards, reason=info.get("reason", "No reason provided"))
+                if game is not None:
+                    env_manager.remove_env(payload.game_id, db=db)
+                    settlement_queue.enqueue(db, payload.game_id)
+                    db.commit()
+                    settlement_queue.notify()
+                    queue_events.notify(game.environment_id)
+
+            return {"message": "Action submitted.", "done": done}
+        else:
+            raise HTTPException(status_code=400, detail="Not your turn.")
 
 
 @router.post("/get_results")
@@ -276,16 +281,15 @@ def get_results_endpoint(request: Request, payload: GetResultsRequest, db: Sessi
         raise HTTPException(status_code=404, detail="Game not found.")
 
     reward = pg.reward
-    elo_scores = db.query(Elo).filter(Elo.model_name==payload.model_name, Elo.environment_id==payload.env_id).order_by(desc(Elo.updated_at)).limit(2).all()
-    if not elo_scores:
-        raise HTTPException(status_code=404, detail="No elo scores.")
-
-    elos = [e.elo for e in elo_scores]
-    if len(elos) == 1:
-        current_elo_score = elos[0]
-        prev_elo_score = None
+    # until the settlement worker rates this game the stored ratings predate it
+    rating_pending = settlement_queue.is_pending(db, payload.game_id)
+    if rating_pending:
+        current_elo_score, prev_elo_score = None, None
     else:
-        current_elo_score, prev_elo_score = elos[0], elos[1]
+        rating = db.get(CurrentRating, (payload.model_name, payload.env_id))
+        if not rating:
+            raise HTTPException(status_code=404, detail="No elo scores.")
+        current_elo_score, prev_elo_score = rating.elo, rating.prev_elo
 
     player_games = db.query(PlayerGame).filter(PlayerGame.game_id == payload.game_id).all()
     opponents = [p.model_name for p in player_games if p.model_name != payload.model_name]
@@ -299,7 +303,8 @@ def get_results_endpoint(request: Request, payload: GetResultsRequest, db: Sessi
         "prev_elo_score": prev_elo_score,
         "current_elo_score": current_elo_score,
         "opponent_names": ", ".join(opponents),
-        "outcome": outcome
+        "outcome": outcome,
+        "rating_pending": rating_pending
     }
 
 
@@ -0,0 +1,135 @@
+"""
+Offline benchmark for environment handlers.
+
+Builds handlers for each environment id and times a fresh build (`ta.make` and
+`reset`) against a snapshot save and a cold load from disk (read, decompress,
+unpickle), the path a restarted server takes on its first request of a game.
+The stress mode drives the environment manager from many threads at once.
+
+Usage:
+    python env_benchmark.py --envs BalancedSubset-v0 --games 20
+    python env_benchmark.py --stress --games 20 --threads 16   # concurrent builds and steps
+"""
+import argparse, os, statistics, tempfile, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# db imports
+from database import Base, engine
+
+# local imports
+import register_environments
+from env_snapshots import snapshots
+from env_pool import env_pool
+from env_handlers import OnlineEnvHandler, OnlineEnvironmentManager
+
+
+def benchmark_env(env_id: str, games: int):
+    build, save, load, size = [], [], [], []
+    for game_id in range(games):
+        start = time.perf_counter()
+        handler = OnlineEnvHandler(env_id)  # no game id: not checkpointed while building
+        build.append(time.perf_counter() - start)
+
+        handler.game_id = game_id
+        start = time.perf_counter()
+        if not snapshots.save(game_id, handler):
+            raise RuntimeError(f"{env_id} handlers cannot be snapshotted")
+        save.append(time.perf_counter() - start)
+        size.append(os.path.getsize(snapshots.path(game_id)))
+
+        start = time.perf_counter()
+        restored = snapshots.load(game_id)
+        load.append(time.perf_counter() - start)
+        assert restored.env.state.current_player_id == handler.env.state.current_player_id
+        snapshots.delete(game_id)
+
+    return {
+        "build_ms": statistics.median(build) * 1000,
+        "save_ms": statistics.median(save) * 1000,
+        "load_ms": statistics.median(load) * 1000,
+        "bytes": statistics.median(size),
+    }
+
+
+def stress(env_id: str, games: int, threads: int, steps: int, action: str):
+    """
+    Every thread requests every game and submits actions like the step endpoint
+    does (turn check and step under the game lock). Each game must be built
+    exactly once and no two threads may ever step the same game at once.
+    """
+    handlers = defaultdict(set)
+    accepted = defaultdict(int)
+    stepping = defaultdict(int)
+    overlaps = [0]
+    record_lock = threading.Lock()
+    game_ids = [1_000_000 + game_id for game_id in range(games)]
+
+    def worker(offset: int):
+        # threads start at different games so that builds and steps overlap
+        for game_id in game_ids[offset % games:] + game_ids[:offset % games]:
+            env = OnlineEnvironmentManager.get_env(game_id=game_id, env_id=env_id)
+            with record_lock:
+                handlers[game_id].add(id(env))
+            for _ in range(steps):
+                with OnlineEnvironmentManager.game_lock(game_id):
+                    if env.check_done() or accepted[game_id] >= steps:
+                        break
+                    with record_lock:
+                        stepping[game_id] += 1
+                        overlaps[0] += stepping[game_id] > 1
+                    time.sleep(0)  # let other threads race for the same game
+                    env.execute_step(action=action)
+                    with record_lock:
+                        stepping[game_id] -= 1
+                        accepted[game_id] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - start
+
+    rebuilt = sum(len(ids) > 1 for ids in handlers.values())
+    for game_id in game_ids:
+        OnlineEnvironmentManager.remove_env(game_id)
+    return {"seconds": elapsed, "steps": sum(accepted.values()), "rebuilt": rebuilt, "overlaps": overlaps[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark environment builds against snapshot cold loads.")
+    parser.add_argument("--envs", nargs="+", default=["BalancedSubset-v0"])
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--stress", action="store_true", help="build and step games from many threads at once")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--steps", type=int, default=20, help="stress mode: steps per game")
+    parser.add_argument("--action", default="[0]", help="stress mode: action submitted on every step")
+    args = parser.parse_args()
+
+    # same setup as the server: the default environment ids are registered at startup
+    Base.metadata.create_all(bind=engine)
+    register_environments.register_envs()
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshots.directory = directory
+        env_pool.size = 0  # time real builds, not pool hits
+        if args.stress:
+            for env_id in args.envs:
+                r = stress(env_id, args.games, args.threads, args.steps, args.action)
+                ok = r["rebuilt"] == 0 and r["overlaps"] == 0
+                print(f"{env_id}: {args.games} games x {args.threads} threads, {r['steps']} steps in "
+                      f"{r['seconds']:.2f}s, rebuilt {r['rebuilt']}, overlapping steps {r['overlaps']} "
+                      f"-> {'ok' if ok else 'FAILED'}")
+            return
+
+        print(f"{'environment':>24} {'build ms':>10} {'save ms':>9} {'cold load ms':>13} {'snapshot bytes':>15}")
+        for env_id in args.envs:
+            try:
+                r = benchmark_env(env_id, args.games)
+            except Exception as e:
+                print(f"{env_id:>24} failed: {e}")
+                continue
+            print(f"{env_id:>24} {r['build_ms']:>10.2f} {r['save_ms']:>9.2f} {r['load_ms']:>13.2f} {r['bytes']:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
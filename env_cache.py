@@ -0,0 +1,187 @@
+import logging, sys, threading, time
+from collections import OrderedDict
+from types import ModuleType, FunctionType, MethodType, BuiltinFunctionType
+from typing import Dict, Tuple
+
+# import configs
+from config import (
+    ENV_CACHE_MAX_ENTRIES, ENV_CACHE_MAX_BYTES,
+    ENV_CACHE_FINISHED_TTL, ENV_CACHE_IDLE_TTL
+)
+
+# local imports
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_OPAQUE = (type, ModuleType, FunctionType, MethodType, BuiltinFunctionType)
+
+
+def estimate_bytes(obj, max_objects: int = 100_000) -> int:
+    """Approximate deep size of an object graph (containers and instance attributes)."""
+    seen, stack, total = set(), [obj], 0
+    while stack and len(seen) < max_objects:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _OPAQUE):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current, 0)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        elif hasattr(current, "__dict__"):
+            stack.append(vars(current))
+    return total
+
+
+class EnvironmentCache:
+    """
+    Bounded registry of environment handlers, keyed by game id.
+
+    Entries are kept in LRU order. A finished game's handler stays cached for
+    ENV_CACHE_FINISHED_TTL (its final observations are stored in the db when it
+    finishes), handlers untouched for ENV_CACHE_IDLE_TTL are dropped, and when
+    the cache holds more than ENV_CACHE_MAX_ENTRIES handlers or
+    ENV_CACHE_MAX_BYTES (estimated), the least recently used finished handlers
+    are evicted first, then those of active games that have a snapshot on disk
+    (see `env_snapshots`) to be reloaded from. Unsaved active handlers are only
+    evicted by the idle TTL. Handlers whose `pinned` attribute is true (a
+    standard model's turn is being played on them) are never evicted.
+
+    A handler's object graph is walked once, when it is cached. Afterwards its
+    size follows the pickle size recorded by its latest snapshot
+    (`estimated_bytes`), scaled by the in-memory to pickle ratio measured at
+    that first walk, so neither steps nor sweeps walk the graph again.
+    """
+    def __init__(self, max_entries: int = ENV_CACHE_MAX_ENTRIES, max_bytes: int = ENV_CACHE_MAX_BYTES,
+                 finished_ttl: float = ENV_CACHE_FINISHED_TTL, idle_ttl: float = ENV_CACHE_IDLE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.finished_ttl = finished_ttl
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._over_bounds = False
+
+    @staticmethod
+    def _measure(handler) -> Tuple[int, float]:
+        """Estimated size of a handler and its ratio to the handler's pickle size (None if unknown)."""
+        size = estimate_bytes(getattr(handler, "env", handler))
+        pickled = getattr(handler, "estimated_bytes", None)
+        return size, (size / pickled if pickled else None)
+
+    @staticmethod
+    def _scaled_size(entry: Dict) -> int:
+        pickled = getattr(entry["handler"], "estimated_bytes", None)
+        if pickled is None or entry["ratio"] is None:
+            return entry["bytes"]
+        return int(pickled * entry["ratio"])
+
+    @staticmethod
+    def _pinned(entry: Dict) -> bool:
+        return getattr(entry["handler"], "pinned", False)
+
+    def __contains__(self, game_id: int) -> bool:
+        return game_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, game_id: int):
+        """Cached handler of `game_id` (marking it as recently used), or None."""
+        with self._lock:
+            entry = self._entries.get(game_id)
+            if entry is None:
+                return None
+            entry["last_used"] = time.time()
+            self._entries.move_to_end(game_id)
+            return entry["handler"]
+
+    def peek(self, game_id: int):
+        """Cached handler of `game_id` without touching its LRU position, or None."""
+        entry = self._entries.get(game_id)
+        return None if entry is None else entry["handler"]
+
+    def put(self, game_id: int, handler):
+        size, ratio = self._measure(handler)
+        with self._lock:
+            self._entries[game_id] = {
+                "handler": handler, "bytes": size, "ratio": ratio, "last_used": time.time(), "finished_at": None
+            }
+            self._entries.move_to_end(game_id)
+            self._evict(time.time())
+
+    def mark_finished(self, game_id: int):
+        """Start the finished TTL of `game_id`; returns its handler (None if not cached)."""
+        with self._lock:
+            entry = self._entries.get(game_id)
+            if entry is None:
+                return None
+            if entry["finished_at"] is None:
+                entry["finished_at"] = time.time()
+            return entry["handler"]
+
+    def pop(self, game_id: int):
+        with self._lock:
+            entry = self._entries.pop(game_id, None)
+            return None if entry is None else entry["handler"]
+
+    def evict_expired(self, now: float = None) -> int:
+        """Refresh entry sizes from the last snapshots and apply the TTLs and bounds; returns how many handlers were evicted."""
+        now = time.time() if now is None else now
+        with self._lock:
+            for entry in self._entries.values():
+                entry["bytes"] = self._scaled_size(entry)
+            return self._evict(now)
+
+    def _evict(self, now: float) -> int:
+        """Evict expired entries, then LRU finished and saved entries while over the bounds. Holds the lock."""
+        expired = [
+            game_id for game_id, entry in self._entries.items()
+            if not self._pinned(entry) and (
+                now - entry["last_used"] > self.idle_ttl
+                or (entry["finished_at"] is not None and now - entry["finished_at"] > self.finished_ttl)
+            )
+        ]
+        for game_id in expired:
+            del self._entries[game_id]
+        if expired:
+            metrics.increment("env_cache_evictions", len(expired), reason="ttl")
+
+        total_bytes = sum(entry["bytes"] for entry in self._entries.values())
+        evicted = 0
+        if len(self._entries) > self.max_entries or total_bytes > self.max_bytes:
+            evictable = [(game_id, entry) for game_id, entry in self._entries.items() if not self._pinned(entry)]
+            finished = [game_id for game_id, entry in evictable if entry["finished_at"] is not None]
+            saved = [
+                game_id for game_id, entry in evictable
+                if entry["finished_at"] is None and getattr(entry["handler"], "snapshot_stamp", None) is not None
+            ]
+            for game_id in finished + saved:
+                if len(self._entries) <= self.max_entries and total_bytes <= self.max_bytes:
+                    break
+                total_bytes -= self._entries.pop(game_id)["bytes"]
+                evicted += 1
+            if evicted:
+                metrics.increment("env_cache_evictions", evicted, reason="lru")
+        over_bounds = len(self._entries) > self.max_entries or total_bytes > self.max_bytes
+        if over_bounds and not self._over_bounds:
+            logger.warning(
+                f"Environment cache over its bounds with unsaved or pinned active games only "
+                f"({len(self._entries)} entries, ~{total_bytes} bytes)."
+            )
+        self._over_bounds = over_bounds
+
+        metrics.set_gauge("env_cache_entries", len(self._entries))
+        metrics.set_gauge("env_cache_bytes", total_bytes)
+        return len(expired) + evicted
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "finished": sum(entry["finished_at"] is not None for entry in self._entries.values()),
+                "bytes": sum(entry["bytes"] for entry in self._entries.values()),
+            }
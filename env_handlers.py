@@ -1,6 +1,8 @@
 import textarena as ta 
-import threading
-from typing import Optional, Dict, List , Tuple
+import threading, logging, json, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Dict, List , Set, Tuple
 
 
 # db imports
@@ -8,16 +10,32 @@ from database import get_db
 from sqlalchemy.orm import Session
 
 # core imports
-from core.models import Game, PlayerGame, PlayerLog
+from core.models import Game, PlayerGame, PlayerLog, FinalObservation
 
 # import configs
-from config import STANDARD_MODELS
+from config import (
+    STANDARD_MODELS, ENV_BUILD_WORKERS, ENV_SNAPSHOTS_ENABLED, ENV_SNAPSHOT_MAX_AGE,
+    LOCAL_MODEL_WORKERS, LOCAL_AGENT, LOCAL_STANDIN_ACTION, LOCAL_STANDIN_DELAY
+)
+
+# local imports
+from env_cache import EnvironmentCache
+from env_snapshots import snapshots, dump_env, load_env
+from env_pool import env_pool
+from game_stats import record_outcomes
+from settlement_queue import settlement_queue
+from queue_events import queue_events
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class EnvironmentManagerBase:
     _instance = None
-    _lock = threading.Lock()
-    _environments: Dict = {}
+    _lock = threading.Lock()  # guards the singleton and the game lock table, never held while building or stepping
+    _game_locks: Dict[int, Dict] = {}
+    _environments = EnvironmentCache()
+    _build_executor = ThreadPoolExecutor(max_workers=ENV_BUILD_WORKERS, thread_name_prefix="env-build")
     
     def __new__(cls):
         with cls._lock:
@@ -28,12 +46,114 @@ class EnvironmentManagerBase:
     @classmethod
     def get_env(cls, *args, **kwargs):
         raise NotImplementedError
+
+    @classmethod
+    @contextmanager
+    def game_lock(cls, game_id: int):
+        """
+        Serialize the construction and stepping of one game; other games never
+        wait on it. Re-entrant, and dropped from the table once nobody holds or
+        waits for it. The lock is per process, so the server runs as a single
+        worker process.
+        """
+        with cls._lock:
+            entry = cls._game_locks.get(game_id)
+            if entry is None:
+                entry = cls._game_locks[game_id] = {"lock": threading.RLock(), "users": 0}
+            entry["users"] += 1
+        try:
+            with entry["lock"]:
+                yield
+        finally:
+            with cls._lock:
+                entry["users"] -= 1
+                if entry["users"] == 0:
+                    del cls._game_locks[game_id]
         
     @classmethod
-    def remove_env(cls, game_id: int):
-        # if game_id in cls._environments:
-        #     del cls._environments[game_id]
-        pass
+    def _get_cached(cls, game_id: int):
+        """
+        Cached handler of a game; on a miss, or when another process has stepped
+        the game since, it is (re)loaded from its snapshot. None if neither exists.
+        A handler a standard model's job is still playing on is never replaced:
+        that job would keep stepping it and its moves would be lost.
+        """
+        env = cls._environments.get(game_id)
+        if env is not None and getattr(env, "pinned", False):
+            return env
+        if ENV_SNAPSHOTS_ENABLED and (env is None or snapshots.is_stale(game_id, env)):
+            loaded = snapshots.load(game_id)
+            if loaded is not None:
+                env = loaded
+                cls._environments.put(game_id, env)
+                if isinstance(env, LocalEnvHandler):
+                    # the standard model may have been due to move when the snapshot was taken
+                    env.schedule_local_turns()
+        return env
+
+    @classmethod
+    def peek_env(cls, game_id: int):
+        """The cached environment handler of a game, without creating one (None if not cached)."""
+        return cls._environments.peek(game_id)
+
+    @classmethod
+    def remove_env(cls, game_id: int, db: Session = None):
+        """
+        Release the environment of a finished game. With `db`, its players' final
+        observations are stored so they can still be served once the handler is
+        evicted (the caller commits); the handler itself stays cached for
+        ENV_CACHE_FINISHED_TTL and its snapshot is deleted. The observations
+        come from the snapshot when the handler is not cached or is stale.
+        """
+        env = cls._environments.peek(game_id)
+        if db is not None and ENV_SNAPSHOTS_ENABLED and (env is None or snapshots.is_stale(game_id, env)):
+            env = snapshots.load(game_id) or env
+        cls._environments.mark_finished(game_id)
+        if ENV_SNAPSHOTS_ENABLED:
+            snapshots.delete(game_id)
+        if env is None or db is None:
+            return
+        for player_id, observation in env.env.state.observations.items():
+            db.merge(FinalObservation(game_id=game_id, player_id=player_id, observation=json.dumps(observation)))
+
+    @classmethod
+    def get_final_observation(cls, db: Session, game_id: int, player_id: int):
+        """Final observation of a player in a concluded game, from the db or the cache (None if unknown)."""
+        # the stored observation wins: the cached handler may be stale if another process finished the game
+        row = db.get(FinalObservation, (game_id, player_id))
+        if row is not None:
+            return json.loads(row.observation)
+        env = cls.peek_env(game_id)
+        return env.force_get_observation(player_id) if env is not None else None
+
+    @classmethod
+    def evict_expired(cls) -> int:
+        if ENV_SNAPSHOTS_ENABLED:
+            snapshots.prune(ENV_SNAPSHOT_MAX_AGE)
+        return cls._environments.evict_expired()
+
+    @classmethod
+    def cache_stats(cls) -> Dict[str, int]:
+        """Cached environment handlers: entries, finished entries and estimated bytes."""
+        return cls._environments.stats()
+
+    @classmethod
+    def prepare_env_async(cls, game_id: int, env_id: str):
+        """Build the environment of a freshly created game on a background worker."""
+        cls._build_executor.submit(cls._prepare_env, game_id, env_id)
+
+    @staticmethod
+    def _prepare_env(game_id: int, env_id: str):
+        db = next(get_db())
+        try:
+            env_manager = EnvironmentManagerBase.get_appropriate_manager(game_id, db)
+            env = env_manager.get_env(game_id=game_id, env_id=env_id, db=db)
+            db.query(Game).filter(Game.id == game_id).update({Game.specific_env_id: env.env_id})
+            db.commit()
+        except Exception as e:
+            logger.error(f"Failed to initialize environment for game {game_id}: {e}")
+        finally:
+            db.close()
 
     @staticmethod
     def determine_env_type(game_id: int, db: Session) -> str:
@@ -51,14 +171,28 @@ class EnvironmentManagerBase:
 
 
 class OnlineEnvHandler:
-    def __init__(self, env_id: str):
-        self.env = ta.make(env_id)
-        self.env.reset()
+    def __init__(self, env_id: str, game_id: int = None):
+        self.env = env_pool.make_env(env_id)  # pre-warmed, made and reset
         self.done = False
         self.info = {}
         self.reward = {}
         self.env_id = self.env.env.env_id  # Store the specific env ID
+        self.game_id = game_id
+        self.snapshot_stamp = None
         # print("OnlineEnvHandler initialized:", self.env, self.env.env_id)
+        self.checkpoint()
+
+    def __getstate__(self):
+        return {**vars(self), "env": dump_env(self.env)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.env = load_env(state["env"])
+
+    def checkpoint(self):
+        """Snapshot this handler to disk (see `env_snapshots`)."""
+        if ENV_SNAPSHOTS_ENABLED and self.game_id is not None:
+            snapshots.save(self.game_id, self)
 
     def get_initial_observation(self, player_id):
         return self.initial_observations[player_id]
@@ -78,11 +212,19 @@ class OnlineEnvHandler:
     def force_get_observation(self, player_id: int):
         return self.env.state.observations[player_id]
 
+    def mark_observed(self) -> bool:
+        """True the first time an observation of this game is served (for time-to-first-observation)."""
+        first = not getattr(self, "observed", False)
+        self.observed = True
+        return first
+
     def execute_step(self, action: str):
         # print(f'\n\nExecuting action: {action}\n\n')
-        if self.done:
-            return
-        self.done, self.info = self.env.step(action=action)
+        with EnvironmentManagerBase.game_lock(self.game_id):
+            if self.done:
+                return
+            self.done, self.info = self.env.step(action=action)
+            self.checkpoint()
 
     def extract_results(self):
         self.rewards = self.env.close()
@@ -92,31 +234,83 @@ class OnlineEnvironmentManager(EnvironmentManagerBase):
     @classmethod
     def get_env(cls, game_id: int, env_id: str, db: Session = None) -> OnlineEnvHandler:
         """Get or create environment for a game."""
-        with cls._lock:
-            if game_id not in cls._environments:
-                cls._environments[game_id] = OnlineEnvHandler(env_id)
-            return cls._environments[game_id]
+        with cls.game_lock(game_id):
+            env = cls._get_cached(game_id)
+            if env is None:
+                env = OnlineEnvHandler(env_id, game_id=game_id)
+                cls._environments.put(game_id, env)
+            return env
+
+class StandInAgent(ta.Agent):
+    """Offline stand-in for standard models: plays a fixed action after a simulated latency."""
+    def __init__(self, action: str = LOCAL_STANDIN_ACTION, delay: float = LOCAL_STANDIN_DELAY):
+        self.action = action
+        self.delay = delay
+
+    def __call__(self, observation: str) -> str:
+        time.sleep(self.delay)
+        return self.action
+
+
+LOCAL_AGENTS = {
+    "openrouter": lambda model_name: ta.agents.OpenRouterAgent(model_name=model_name),
+    "standin": lambda model_name: StandInAgent(),
+}
+
+
+def get_local_agent(model_name: str) -> ta.Agent:
+    """Agent playing the standard model `model_name`, as configured by LOCAL_AGENT."""
+    if LOCAL_AGENT not in LOCAL_AGENTS:
+        raise ValueError(f"Unknown local agent '{LOCAL_AGENT}'.")
+    return LOCAL_AGENTS[LOCAL_AGENT](model_name)
+
 
 class LocalEnvHandler:
+    """
+    Game against a standard model played in-process. The standard model's turns
+    run on a bounded worker pool, so the opponent's step returns at once and the
+    opponent sees its next turn by polling. The worker holds the game lock while
+    it reads its observation and while it steps, but not while the model thinks.
+
+    Outstanding jobs are tracked per game id rather than per handler, so a
+    handler reloaded from its snapshot never starts a second job next to the
+    one still playing, and a handler with a job is pinned in the cache.
+    """
+    _turn_executor = ThreadPoolExecutor(max_workers=LOCAL_MODEL_WORKERS, thread_name_prefix="local-model")
+    _turn_jobs: Set[int] = set()  # game ids with a job on the pool; changed under the game's lock
+
     def __init__(self, env_id: str, local_model: str, local_pid: int, game_id: int):
-        self.env = ta.make(env_id)
-        self.env.reset()
+        self.env = env_pool.make_env(env_id)  # pre-warmed, made and reset
         self.done = False
         self.info = {}
         self.reward = {}
         self.env_id = self.env.env.env_id  # Store the specific env ID
         self.local_model_name = local_model
         # print("\nInitializing LocalEnvHandler for model:", self.local_model_name)
-        self.local_model = ta.agents.OpenRouterAgent(model_name=local_model)
+        self.local_model = get_local_agent(local_model)
         self.local_pid = local_pid 
         self.local_obs = []
         self.game_id = game_id
+        self.snapshot_stamp = None
 
+        self.checkpoint()
         # If local model should move immediately:
-        while self.env.state.current_player_id == self.local_pid and not self.done:
-            self._execute_local_model_step()
-            # print(f"LocalEnvHandler stuck: current_player_id={self.env.state.current_player_id}, local_pid={self.local_pid}")
-            time.sleep(1)
+        self.schedule_local_turns()
+
+    def __getstate__(self):
+        # the agent holds an API client; it is recreated on load
+        state = {k: v for k, v in vars(self).items() if k != "local_model"}
+        return {**state, "env": dump_env(self.env)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.env = load_env(state["env"])
+        self.local_model = get_local_agent(self.local_model_name)
+
+    def checkpoint(self):
+        """Snapshot this handler to disk (see `env_snapshots`)."""
+        if ENV_SNAPSHOTS_ENABLED:
+            snapshots.save(self.game_id, self)
 
     def get_initial_observation(self, player_id):
         return self.initial_observations[player_id]
@@ -135,6 +329,12 @@ class LocalEnvHandler:
     def force_get_observation(self, player_id: int):
         return self.env.state.observations[player_id]
 
+    def mark_observed(self) -> bool:
+        """True the first time an observation of this game is served (for time-to-first-observation)."""
+        first = not getattr(self, "observed", False)
+        self.observed = True
+        return first
+
 
     def execute_step(self, action: str):
         # print("LocalEnvHandler: Executing global model step.")
@@ -151,27 +351,87 @@ class LocalEnvHandler:
         finally:
             db.close()
 
-        if self.done:
-            return
-
-        self.done, self.info = self.env.step(action=action)
+        with EnvironmentManagerBase.game_lock(self.game_id):
+            if self.done:
+                return
+
+            self.done, self.info = self.env.step(action=action)
+            self.checkpoint()
+        self.schedule_local_turns()
+
+    @property
+    def pinned(self) -> bool:
+        """True while a job plays this game; the cache does not evict pinned handlers."""
+        return self.game_id in self._turn_jobs
+
+    def schedule_local_turns(self):
+        """Let the standard model play on the worker pool if it is its turn (at most one job per game)."""
+        with EnvironmentManagerBase.game_lock(self.game_id):
+            if self.game_id in self._turn_jobs or not self._is_local_turn():
+                return
+            self._turn_jobs.add(self.game_id)
+        self._turn_executor.submit(self._play_local_turns)
+
+    def _is_local_turn(self) -> bool:
+        return not self.done and self.env.state.current_player_id == self.local_pid
+
+    def _play_local_turns(self):
+        """Play the standard model's turns until it is the opponent's turn or the game ends."""
+        start = time.perf_counter()
+        try:
+            while True:
+                with EnvironmentManagerBase.game_lock(self.game_id):
+                    # cleared under the same lock as the turn check, so the next schedule is never lost
+                    if not self._is_local_turn():
+                        self._turn_jobs.discard(self.game_id)
+                        return
+                    turn = self._get_local_turn()
+                action = self.local_model(turn["prompt"])
+                with EnvironmentManagerBase.game_lock(self.game_id):
+                    # only this worker moves for the standard model, so the turn is still ours
+                    self._execute_local_model_step(turn, action)
+                    self.checkpoint()
+                    if self.done:
+                        self._conclude()
+        except Exception as e:
+            with EnvironmentManagerBase.game_lock(self.game_id):
+                self._turn_jobs.discard(self.game_id)
+            metrics.increment("local_turn_errors")
+            logger.error(f"Standard model '{self.local_model_name}' failed to play in game {self.game_id}: {e}")
+        finally:
+            metrics.observe("local_turn_seconds", time.perf_counter() - start)
 
-        while self.local_pid == self.env.state.current_player_id and not self.done:
-            self._execute_local_model_step()
-            time.sleep(1)
+    def _conclude(self):
+        """Record the outcome of a game the standard model's move ended (the endpoints do it for the opponent's moves)."""
+        rewards, info = self.extract_results()
+        db = next(get_db())
+        try:
+            game = record_outcomes(db, self.game_id, rewards, reason=info.get("reason", "No reason provided"))
+            if game is None:
+                # concluded meanwhile (e.g. timed out while the model was thinking)
+                EnvironmentManagerBase.remove_env(self.game_id)
+                return
+            settlement_queue.enqueue(db, self.game_id)
+            EnvironmentManagerBase.remove_env(self.game_id, db=db)
+            db.commit()
+            env_id = game.environment_id
+        finally:
+            db.close()
+        settlement_queue.notify()
+        queue_events.notify(env_id)
 
     def extract_results(self):
         self.rewards = self.env.close()
         return self.rewards, self.info
 
-    def _execute_local_model_step(self):
-        # print("LocalEnvHandler: Executing local step")
-        if self.done:
-            return
+    def _get_local_turn(self) -> Dict:
+        """Observation of the standard model's turn and the prompt built from it."""
         obs_timestamp = time.time()
         _, obs_json = self.env.get_observation()
-        obs = self._transform_local_obs(obs=obs_json)
-        action = self.local_model(obs)
+        return {"timestamp": obs_timestamp, "observation": obs_json, "prompt": self._transform_local_obs(obs=obs_json)}
+
+    def _execute_local_model_step(self, turn: Dict, action: str):
+        # print("LocalEnvHandler: Executing local step")
         action_timestamp = time.time()
 
         # Log the action
@@ -185,8 +445,8 @@ class LocalEnvHandler:
             log_entry = PlayerLog(
                 player_game_id=pg.id,
                 model_name=self.local_model_name,
-                observation=json.dumps(obs_json),
-                timestamp_observation=obs_timestamp,
+                observation=json.dumps(turn["observation"]),
+                timestamp_observation=turn["timestamp"],
                 timestamp_action=action_timestamp,
                 action=action
             )
@@ -220,15 +480,18 @@ class LocalEnvironmentManager(EnvironmentManagerBase):
     @classmethod
     def get_env(cls, game_id: int, env_id: str, db: Session = None) -> LocalEnvHandler:
         """Get or create environment for a game."""
-        with cls._lock:
-            if game_id not in cls._environments:
+        # the standard model's worker only holds the game lock between its model calls
+        with cls.game_lock(game_id):
+            env = cls._get_cached(game_id)
+            if env is None:
                 # Initialize if needed
                 players = db.query(PlayerGame).filter(PlayerGame.game_id == game_id).all()
                 standard_player = next(p for p in players if p.model_name in STANDARD_MODELS)
-                cls._environments[game_id] = LocalEnvHandler(
+                env = LocalEnvHandler(
                     env_id=env_id,
                     local_model=standard_player.model_name,
                     local_pid=standard_player.player_id,
                     game_id=game_id
                 )
-            return cls._environments[game_id]
\ No newline at end of file
+                cls._environments.put(game_id, env)
+            return env
\ No newline at end of file
@@ -0,0 +1,103 @@
+import logging, threading, time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable
+
+import textarena as ta
+
+# import configs
+from config import ENV_POOL_SIZE, ENV_POOL_WORKERS
+
+# local imports
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class EnvironmentPool:
+    """
+    Pre-warmed textarena environments per environment id.
+
+    Handlers take a made and reset environment with `make_env` instead of
+    building one on the path from match to first observation; every take
+    schedules an asynchronous refill up to `size`. Misses (empty pool) fall
+    back to building inline. Hits and misses are reported per environment id.
+    """
+    def __init__(self, size: int = ENV_POOL_SIZE, max_workers: int = ENV_POOL_WORKERS):
+        self.size = size
+        self._lock = threading.Lock()
+        self._ready: Dict[str, deque] = defaultdict(deque)
+        self._refilling = set()
+        self._hits: Dict[str, int] = defaultdict(int)
+        self._misses: Dict[str, int] = defaultdict(int)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="env-pool")
+
+    @staticmethod
+    def build(env_id: str):
+        env = ta.make(env_id)
+        env.reset()
+        return env
+
+    def warm(self, env_ids: Iterable[str]):
+        """Fill the pools of `env_ids` in the background."""
+        for env_id in env_ids:
+            self._schedule_refill(env_id)
+
+    def make_env(self, env_id: str):
+        """A ready environment from the pool, or a freshly built one if it is empty."""
+        with self._lock:
+            env = self._ready[env_id].popleft() if self._ready[env_id] else None
+            if env is None:
+                self._misses[env_id] += 1
+            else:
+                self._hits[env_id] += 1
+            hit_rate = self._hits[env_id] / (self._hits[env_id] + self._misses[env_id])
+            ready = len(self._ready[env_id])
+        metrics.increment("env_pool_hits" if env is not None else "env_pool_misses", env_id=env_id)
+        metrics.set_gauge("env_pool_hit_rate", hit_rate, env_id=env_id)
+        metrics.set_gauge("env_pool_ready", ready, env_id=env_id)
+        self._schedule_refill(env_id)
+        return env if env is not None else self.build(env_id)
+
+    def _schedule_refill(self, env_id: str):
+        if self.size <= 0:
+            return
+        with self._lock:
+            if env_id in self._refilling or len(self._ready[env_id]) >= self.size:
+                return
+            self._refilling.add(env_id)
+        self._executor.submit(self._refill, env_id)
+
+    def _refill(self, env_id: str):
+        try:
+            while True:
+                with self._lock:
+                    if len(self._ready[env_id]) >= self.size:
+                        break
+                start = time.perf_counter()
+                env = self.build(env_id)
+                metrics.observe("env_pool_build_seconds", time.perf_counter() - start, env_id=env_id)
+                with self._lock:
+                    self._ready[env_id].append(env)
+                    ready = len(self._ready[env_id])
+                metrics.set_gauge("env_pool_ready", ready, env_id=env_id)
+        except Exception as e:
+            metrics.increment("env_pool_errors", env_id=env_id)
+            logger.error(f"Failed to pre-build a '{env_id}' environment: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(env_id)
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                env_id: {
+                    "ready": len(self._ready[env_id]),
+                    "hits": self._hits[env_id],
+                    "misses": self._misses[env_id],
+                }
+                for env_id in set(self._ready) | set(self._hits) | set(self._misses)
+            }
+
+
+env_pool = EnvironmentPool()
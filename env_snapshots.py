@@ -0,0 +1,181 @@
+"""
+On-disk snapshots of environment handlers.
+
+Every handler is checkpointed after each step to ENV_SNAPSHOT_DIR/<game_id>.snap
+(a version header followed by a zlib-compressed pickle), so games survive a
+restart and can be served by several processes: a manager that misses a game
+in its cache, or whose cached handler is older than the snapshot on disk,
+loads it from there. Snapshots written by another format or textarena version
+are ignored.
+"""
+import logging, os, pickle, tempfile, time, zlib
+from importlib import metadata
+from typing import Dict, List, Tuple
+
+from filelock import FileLock
+
+# import configs
+from config import ENV_SNAPSHOT_DIR, ENV_SNAPSHOT_COMPRESSION
+
+# local imports
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+
+
+def _textarena_version() -> str:
+    try:
+        return metadata.version("textarena")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+SNAPSHOT_HEADER = f"env-snapshot:{SNAPSHOT_FORMAT}:textarena-{_textarena_version()}\n".encode()
+
+
+def dump_env(env) -> Tuple[List[Tuple[type, Dict]], object]:
+    """
+    Picklable form of a (wrapped) textarena environment: the wrapper chain as
+    (class, attributes) pairs and the innermost environment. Wrappers forward
+    unknown attributes to `env`, which makes them recurse forever when unpickled.
+    """
+    wrappers = []
+    while "env" in vars(env) and hasattr(type(env), "is_wrapped_with"):
+        wrappers.append((type(env), {k: v for k, v in vars(env).items() if k != "env"}))
+        env = vars(env)["env"]
+    return wrappers, env
+
+
+def load_env(dumped: Tuple[List[Tuple[type, Dict]], object]):
+    wrappers, env = dumped
+    for cls, attributes in reversed(wrappers):
+        wrapper = cls.__new__(cls)
+        wrapper.__dict__.update(attributes)
+        wrapper.__dict__["env"] = env
+        env = wrapper
+    return env
+
+
+class EnvSnapshotStore:
+    """
+    Directory of handler snapshots keyed by game id.
+
+    Writes go to a temporary file that replaces the snapshot atomically, under a
+    per-game file lock so concurrent writers (also across processes) never
+    interleave. Handlers remember the snapshot they were saved to or loaded
+    from in `snapshot_stamp` (inode and modification time, None while unsaved)
+    and their uncompressed pickle size in `estimated_bytes` (which
+    `EnvironmentCache` uses to follow their memory use).
+    """
+    def __init__(self, directory: str = ENV_SNAPSHOT_DIR, compression: int = ENV_SNAPSHOT_COMPRESSION):
+        self.directory = directory
+        self.compression = compression
+
+    def path(self, game_id: int) -> str:
+        return os.path.join(self.directory, f"{game_id}.snap")
+
+    def _lock(self, game_id: int) -> FileLock:
+        return FileLock(self.path(game_id) + ".lock")
+
+    @staticmethod
+    def _stamp(stat: os.stat_result) -> Tuple[int, int]:
+        # every write replaces the file, so the inode changes even within one mtime tick
+        return stat.st_ino, stat.st_mtime_ns
+
+    def save(self, game_id: int, handler) -> bool:
+        """Checkpoint `handler`; returns False (and marks it unsaved) if it cannot be pickled or written."""
+        start = time.perf_counter()
+        try:
+            raw = pickle.dumps(handler, pickle.HIGHEST_PROTOCOL)
+            data = SNAPSHOT_HEADER + zlib.compress(raw, self.compression)
+            os.makedirs(self.directory, exist_ok=True)
+            with self._lock(game_id):
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp_path, self.path(game_id))
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+                handler.snapshot_stamp = self._stamp(os.stat(self.path(game_id)))
+            handler.estimated_bytes = len(raw)
+        except Exception as e:
+            handler.snapshot_stamp = None
+            metrics.increment("env_snapshot_errors")
+            logger.error(f"Failed to snapshot environment of game {game_id}: {e}")
+            return False
+        metrics.observe("env_snapshot_save_seconds", time.perf_counter() - start)
+        metrics.observe("env_snapshot_bytes", len(data))
+        return True
+
+    def load(self, game_id: int):
+        """Handler restored from the snapshot of `game_id`, or None if there is no usable snapshot."""
+        start = time.perf_counter()
+        try:
+            with open(self.path(game_id), "rb") as f:
+                stamp = self._stamp(os.fstat(f.fileno()))
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(SNAPSHOT_HEADER):
+            logger.warning(f"Ignoring snapshot of game {game_id} written by another version.")
+            metrics.increment("env_snapshot_errors")
+            return None
+        try:
+            raw = zlib.decompress(data[len(SNAPSHOT_HEADER):])
+            handler = pickle.loads(raw)
+        except Exception as e:
+            logger.error(f"Failed to load the snapshot of game {game_id}: {e}")
+            metrics.increment("env_snapshot_errors")
+            return None
+        handler.snapshot_stamp = stamp
+        handler.estimated_bytes = len(raw)
+        metrics.observe("env_snapshot_load_seconds", time.perf_counter() - start)
+        return handler
+
+    def is_stale(self, game_id: int, handler) -> bool:
+        """Whether a newer snapshot of `game_id` than `handler` exists (e.g. written by another process)."""
+        try:
+            stamp = self._stamp(os.stat(self.path(game_id)))
+        except FileNotFoundError:
+            return False
+        return stamp != getattr(handler, "snapshot_stamp", None)
+
+    def delete(self, game_id: int):
+        with self._lock(game_id):
+            try:
+                os.unlink(self.path(game_id))
+            except FileNotFoundError:
+                pass
+
+    def prune(self, max_age: float, now: float = None) -> int:
+        """
+        Delete snapshots not written for `max_age` seconds (games that ended
+        elsewhere) and leftover lock and temporary files as old; returns how
+        many snapshots were deleted.
+        """
+        now = time.time() if now is None else now
+        pruned = 0
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.stat(path).st_mtime <= max_age:
+                    continue
+                if name.endswith(".snap"):
+                    self.delete(int(name[:-len(".snap")]))
+                    pruned += 1
+                elif name.endswith(".tmp") or (name.endswith(".lock") and not os.path.exists(path[:-len(".lock")])):
+                    os.unlink(path)
+            except (FileNotFoundError, ValueError):
+                continue
+        return pruned
+
+
+snapshots = EnvSnapshotStore()
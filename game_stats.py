@@ -0,0 +1,108 @@
+"""
+Per-model, per-environment game counters (games, wins, losses, draws).
+
+`record_outcomes` writes the outcome of a finished game and moves the counters
+along in the same transaction; `rebuild_game_stats` recomputes them from
+`player_games` to fix drift:
+
+    python game_stats.py
+"""
+from typing import Dict, Optional
+
+# db imports
+from sqlalchemy import func, case, insert, delete, update
+from sqlalchemy.orm import Session
+
+# core imports
+from core.models import Game, PlayerGame, ModelStats
+
+# local imports
+from rating_systems import get_outcome_scores
+
+
+OUTCOME_COLUMNS = {"Win": "wins", "Loss": "losses", "Draw": "draws"}
+
+
+def record_outcomes(db: Session, game_id: int, rewards: Dict[int, int], reason: str = None) -> Optional[Game]:
+    """
+    Mark a game finished, store each player's reward and outcome (keyed by
+    player_id) and increment the players' counters. The caller commits.
+
+    Only an active game is concluded (checked and set in one statement); for a
+    game that already finished or failed nothing is written and None is returned.
+    """
+    values = {"status": "finished"} if reason is None else {"status": "finished", "reason": reason}
+    concluded = db.execute(
+        update(Game).where(Game.id == game_id, Game.status == "active").values(**values)
+    ).rowcount
+    if not concluded:
+        return None
+    game = db.get(Game, game_id)
+
+    players = db.query(PlayerGame).filter(PlayerGame.game_id == game_id).order_by(PlayerGame.player_id).all()
+    scores = get_outcome_scores([rewards[p.player_id] for p in players])
+    for player, score in zip(players, scores):
+        player.reward = rewards[player.player_id]
+        player.outcome = "Win" if score == 1 else ("Loss" if score == 0 else "Draw")
+
+        stats = db.get(ModelStats, (player.model_name, game.environment_id))
+        if stats is None:
+            stats = ModelStats(model_name=player.model_name, environment_id=game.environment_id,
+                               games=0, wins=0, losses=0, draws=0)
+            db.add(stats)
+            db.flush()
+        # increments are applied in SQL so concurrent games do not lose updates
+        column = OUTCOME_COLUMNS[player.outcome]
+        stats.games = ModelStats.games + 1
+        setattr(stats, column, getattr(ModelStats, column) + 1)
+    db.flush()
+    return game
+
+
+def get_games_played(db: Session, model_name: str, env_id: str = None) -> int:
+    query = db.query(func.sum(ModelStats.games)).filter(ModelStats.model_name == model_name)
+    if env_id is not None:
+        query = query.filter(ModelStats.environment_id == env_id)
+    return query.scalar() or 0
+
+
+def rebuild_game_stats(db: Session, if_empty: bool = False) -> int:
+    """Recompute all counters from the finished games; returns the number of rows written."""
+    if if_empty and db.query(ModelStats).first() is not None:
+        return 0
+
+    rows = (
+        db.query(
+            PlayerGame.model_name,
+            Game.environment_id,
+            func.count(PlayerGame.id),
+            func.sum(case((PlayerGame.outcome == 'Win', 1), else_=0)),
+            func.sum(case((PlayerGame.outcome == 'Loss', 1), else_=0)),
+            func.sum(case((PlayerGame.outcome == 'Draw', 1), else_=0))
+        )
+        .join(Game, PlayerGame.game_id == Game.id)
+        .filter(Game.status == 'finished', PlayerGame.outcome.isnot(None))
+        .group_by(PlayerGame.model_name, Game.environment_id)
+        .all()
+    )
+    db.execute(delete(ModelStats))
+    if rows:
+        db.execute(insert(ModelStats), [
+            {"model_name": model_name, "environment_id": env_id, "games": games,
+             "wins": wins, "losses": losses, "draws": draws}
+            for model_name, env_id, games, wins, losses, draws in rows
+        ])
+    db.commit()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    from database import engine, get_db
+    from core.models import Base
+
+    Base.metadata.create_all(bind=engine)
+    db = next(get_db())
+    try:
+        print(f"Rebuilt {rebuild_game_stats(db)} model stats rows.")
+    finally:
+        db.close()
@@ -0,0 +1,79 @@
+import threading, time
+from typing import Dict
+
+# db imports
+from sqlalchemy import update, bindparam
+from sqlalchemy.orm import Session
+
+# core imports
+from core.models import Matchmaking
+
+# local imports
+from metrics import metrics
+
+
+class HeartbeatCache:
+    """
+    Write-behind store for queue heartbeats.
+
+    The matchmaking status endpoints `touch` a queue entry instead of committing
+    `Matchmaking.last_checked`; pending heartbeats are written to the db in one
+    batched UPDATE by `flush`. Until then `last_checked` combines the db value
+    with the pending one, so timeout checks always see the freshest heartbeat.
+
+    Pending heartbeats live in this process only: the server must run as a
+    single worker process, or a worker's timeout sweep would expire queue
+    entries whose heartbeats another worker has not flushed yet.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[int, float] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, matchmaking_id: int, checked_at: float = None) -> float:
+        checked_at = time.time() if checked_at is None else checked_at
+        with self._lock:
+            if checked_at > self._pending.get(matchmaking_id, 0):
+                self._pending[matchmaking_id] = checked_at
+        return checked_at
+
+    def discard(self, matchmaking_id: int):
+        """Forget a queue entry that left the queue."""
+        with self._lock:
+            self._pending.pop(matchmaking_id, None)
+
+    def last_checked(self, matchmaking_id: int, db_value: float) -> float:
+        with self._lock:
+            return max(db_value, self._pending.get(matchmaking_id, db_value))
+
+    def flush(self, db: Session) -> int:
+        """Write all pending heartbeats in one transaction; returns how many were written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            db.connection().execute(
+                update(Matchmaking)
+                .where(Matchmaking.id == bindparam("mm_id"), Matchmaking.last_checked < bindparam("checked_at"))
+                .values(last_checked=bindparam("checked_at")),
+                [{"mm_id": mm_id, "checked_at": checked_at} for mm_id, checked_at in pending.items()]
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            # keep the heartbeats for the next flush
+            with self._lock:
+                for mm_id, checked_at in pending.items():
+                    if checked_at > self._pending.get(mm_id, 0):
+                        self._pending[mm_id] = checked_at
+            raise
+
+        metrics.increment("heartbeats_flushed", len(pending))
+        return len(pending)
+
+
+heartbeats = HeartbeatCache()
@@ -13,7 +13,8 @@ if __name__ == "__main__":
     # 1. Start your background matchmaking (daemon) thread
     start_background_tasks()
 
-    # 2. Run the server. 
+    # 2. Run the server. Keep it to one worker process: heartbeats, timeout
+    #    deadlines, game locks and cached environments are in-process state.
     def run_server():
         uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
 
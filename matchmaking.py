@@ -1,22 +1,24 @@
 
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterator
 import logging
-from rich.table import Table
 
 # matchmaking imports
 import time, random
 import numpy as np
+import networkx as nx
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
 from itertools import combinations
+from math import comb
 
 # db imports
-from sqlalchemy import desc
-from sqlalchemy.sql import and_
+from sqlalchemy import desc, insert, and_
 from sqlalchemy.orm import Session
 
 # core imports
 from core.models import (
     Model, Matchmaking, Elo, Environment, Game, 
-    PlayerGame, PlayerLog, HumanPlayer
+    PlayerGame, PlayerLog, HumanPlayer, CurrentRating
 )
 
 # import configs
@@ -24,9 +26,17 @@ from config import (
     HUMANITY_MODEL_NAME, STANDARD_MODELS,
     MIN_WAIT_FOR_STANDARD, MAX_ELO_DELTA,
     PCT_TIME_BASE, NUM_RECENT_GAMES_CAP,
-    DEFAULT_ELO
+    DEFAULT_ELO, MATCHING_MODE, MATCHING_COMPARE_MODES,
+    MATCHING_MAX_EDGES_PER_PLAYER, MATCHMAKING_GROUP_CANDIDATES,
+    MATCHMAKING_EXHAUSTIVE_MAX_COMBINATIONS
 )
 
+# local imports
+from pair_history import pair_history
+from metrics import metrics
+from deadline_scheduler import deadlines
+from heartbeat_cache import heartbeats
+
 # import env handlers
 from env_handlers import (
     EnvironmentManagerBase,
@@ -36,125 +46,356 @@ from env_handlers import (
 
 logger = logging.getLogger(__name__)
 
-# def get_recency_count(db: Session, model1: str, model2: str, window: int = 7 * 86400) -> int:
-def get_recency_count(db: Session, model1: str, model2: str, window: int = 3*3600) -> int:
-    """Count recent matches between two models."""
-    current_time = time.time()
-    count = db.query(Game).join(PlayerGame, Game.id == PlayerGame.game_id).filter(
-        Game.started_at >= (current_time - window),
-        PlayerGame.model_name.in_([model1, model2])
-    ).group_by(Game.id).having(
-        and_(
-            PlayerGame.model_name == model1,
-            PlayerGame.model_name == model2
-        )
-    ).count()
-    return count
-
-def compute_match_score(db: Session, combo: List[Dict]) -> float:
-    """limited to two players"""
-    model_a, model_b = combo
-
-    # check if they have the same email
-    if model_a["email"] == model_b["email"]:
+def compute_match_score(combo: List[Dict]) -> float:
+    """
+    Score a group of players in [0, 1]; 0 means the group must not be matched.
+
+    For two players the Elo spread is simply their Elo difference; larger groups
+    use the spread between the highest and lowest rating and the mean recency
+    count over all pairs in the group.
+    """
+    # check if any two players have the same email
+    emails = [player["email"] for player in combo]
+    if len(set(emails)) < len(emails):
         return 0 
 
     # Check for standard models and humans
-    model_a["human"] = model_a["model_name"] == HUMANITY_MODEL_NAME
-    model_b["human"] = model_b["model_name"] == HUMANITY_MODEL_NAME
-    has_human = model_a["human"] or model_b["human"]
+    has_human = any(player["model_name"] == HUMANITY_MODEL_NAME for player in combo)
     # if has_human:
     #     return 0
     
-    model_a["standard"] = model_a["model_name"] in STANDARD_MODELS
-    model_b["standard"] = model_b["model_name"] in STANDARD_MODELS
-    has_standard = model_a["standard"] or model_b["standard"]
+    has_standard = any(player["model_name"] in STANDARD_MODELS for player in combo)
     
     # If any player has been waiting for less than standard model time limit
     # and one of them is a standard model, leave
     if has_standard and not has_human:
-        if not any(t > MIN_WAIT_FOR_STANDARD for t in [model_a["time_in_queue"], model_b["time_in_queue"]]):
+        if not any(player["time_in_queue"] > MIN_WAIT_FOR_STANDARD for player in combo):
             return 0 
 
-    # check for elo diff limit
-    elo_delta = abs(model_a["elo"] - model_b["elo"])
+    # check for elo spread limit
+    elos = [player["elo"] for player in combo]
+    elo_delta = max(elos) - min(elos)
     if elo_delta > MAX_ELO_DELTA:
         return 0 
 
-    # get the number of recent matches
-    recent_match_count = get_recency_count(db, model_a["model_name"], model_b["model_name"])
+    # get the (mean pairwise) number of recent matches
+    pair_counts = [
+        pair_history.count(model_a["model_name"], model_b["model_name"])
+        for model_a, model_b in combinations(combo, 2)
+    ]
+    recent_match_count = sum(pair_counts) / len(pair_counts)
 
 
     elo_component = (1 - (elo_delta/MAX_ELO_DELTA))**2     # [0, 1]
-    time_component = PCT_TIME_BASE + (max([model_a["pct_queue"], model_b["pct_queue"]])*(1-PCT_TIME_BASE)) # [0.5, 1]
+    time_component = PCT_TIME_BASE + (max(player["pct_queue"] for player in combo)*(1-PCT_TIME_BASE)) # [0.5, 1]
     recent_matches_component = 1 - (min([recent_match_count, NUM_RECENT_GAMES_CAP]) / (NUM_RECENT_GAMES_CAP*2)) # [0.5, 1]
     return elo_component * time_component * recent_matches_component
 
 
-def matchmaking_algorithm(db: Session, environment: Environment):
-    """Core matchmaking algorithm with support for humans and standard models."""
-    # logger.info(f"Starting matchmaking for environment '{environment.environment_id}'.")
+def compute_pair_score_matrix(player_data: List[Dict]) -> np.ndarray:
+    """
+    Vectorized version of `compute_match_score` for every pair in the queue.
+
+    Returns a symmetric (N, N) matrix where entry (i, j) is the score of pairing
+    player i with player j. The email, standard-model and Elo vetoes are applied
+    as boolean masks; the diagonal is always 0.
+    """
+    n = len(player_data)
+    if n < 2:
+        return np.zeros((n, n))
+
+    model_names = [p["model_name"] for p in player_data]
+    elo = np.array([p["elo"] for p in player_data], dtype=float)
+    pct_queue = np.array([p["pct_queue"] for p in player_data], dtype=float)
+    time_in_queue = np.array([p["time_in_queue"] for p in player_data], dtype=float)
+    _, email_id = np.unique([p["email"] for p in player_data], return_inverse=True)
+    human = np.array([name == HUMANITY_MODEL_NAME for name in model_names])
+    standard = np.array([name in STANDARD_MODELS for name in model_names])
+
+    # recency counts for the pairs present in the queue, set on every row of
+    # each model (several humans share one name)
+    index = defaultdict(list)
+    for i, name in enumerate(model_names):
+        index[name].append(i)
+    recency = np.zeros((n, n))
+    for (model1, model2), count in pair_history.snapshot().items():
+        if model1 in index and model2 in index:
+            i, j = np.ix_(index[model1], index[model2])
+            recency[i, j] = count
+            recency[j.T, i.T] = count
+
+    elo_delta = np.abs(elo[:, None] - elo[None, :])
+    elo_component = (1 - (elo_delta / MAX_ELO_DELTA)) ** 2
+    time_component = PCT_TIME_BASE + np.maximum(pct_queue[:, None], pct_queue[None, :]) * (1 - PCT_TIME_BASE)
+    recent_matches_component = 1 - (np.minimum(recency, NUM_RECENT_GAMES_CAP) / (NUM_RECENT_GAMES_CAP * 2))
+    scores = elo_component * time_component * recent_matches_component
+
+    waited = time_in_queue > MIN_WAIT_FOR_STANDARD
+    has_human = human[:, None] | human[None, :]
+    has_standard = standard[:, None] | standard[None, :]
+    veto = (
+        (email_id[:, None] == email_id[None, :])
+        | (has_standard & ~has_human & ~(waited[:, None] | waited[None, :]))
+        | (elo_delta > MAX_ELO_DELTA)
+    )
+    scores[veto] = 0
+    np.fill_diagonal(scores, 0)
+    return scores
+
+
+def greedy_pair_matching(rows: np.ndarray, cols: np.ndarray, weights: np.ndarray, n: int) -> List[int]:
+    """
+    Walk the edges in descending weight order, taking every edge whose endpoints
+    are still free. Returns the positions of the chosen edges in the edge list.
+    """
+    order = np.argsort(-weights, kind="stable")
+    matched = [False] * n
+    unmatched = n
+    edges = []
+    for edge, i, j in zip(order.tolist(), rows[order].tolist(), cols[order].tolist()):
+        if matched[i] or matched[j]:
+            continue
+        matched[i] = matched[j] = True
+        edges.append(edge)
+        unmatched -= 2
+        if unmatched < 2:
+            break
+    return edges
+
+
+def max_weight_pair_matching(rows: np.ndarray, cols: np.ndarray, weights: np.ndarray, n: int, seed_edges: List[int] = ()) -> List[int]:
+    """
+    Maximum-cardinality, maximum-weight matching over the edge list; returns the
+    positions of the chosen edges.
+
+    To keep the blossom algorithm affordable on large queues, each player only
+    contributes its MATCHING_MAX_EDGES_PER_PLAYER best edges to the graph. The
+    `seed_edges` (e.g. the greedy matching) are always kept, so the result never
+    matches fewer players than they do.
+    """
+    if len(weights) == 0:
+        return []
+
+    # rank every edge from both endpoints and keep it if either ranks it top-k
+    edge_ids = np.arange(len(weights))
+    nodes = np.concatenate([rows, cols])
+    both_ids = np.concatenate([edge_ids, edge_ids])
+    both_weights = np.concatenate([weights, weights])
+    order = np.lexsort((-both_weights, nodes))
+    sorted_nodes = nodes[order]
+    group_start = np.searchsorted(sorted_nodes, sorted_nodes, side="left")
+    rank = np.arange(len(order)) - group_start
+    keep = np.union1d(both_ids[order][rank < MATCHING_MAX_EDGES_PER_PLAYER], np.asarray(seed_edges, dtype=int))
+
+    graph = nx.Graph()
+    graph.add_edges_from(
+        (i, j, {"weight": w, "edge": edge})
+        for edge, i, j, w in zip(keep.tolist(), rows[keep].tolist(), cols[keep].tolist(), weights[keep].tolist())
+    )
+    return [graph[i][j]["edge"] for i, j in nx.max_weight_matching(graph, maxcardinality=True)]
+
+
+def sample_pair_matches(player_data: List[Dict], scores: np.ndarray, mode: str = None) -> List[Tuple[Dict, Dict]]:
+    """
+    Vectorized stochastic selection over a pair-score matrix.
+
+    Every candidate pair draws its acceptance (uniform < score) up front, which
+    filters the pair graph. In "greedy" mode the accepted pairs are walked in
+    descending score order, which is distributionally identical to drawing
+    lazily while walking all pairs greedily. In "max_weight" mode a
+    maximum-cardinality, maximum-weight matching is run over the accepted pairs.
+
+    As in the combination path, a model is matched at most once per tick, so
+    of several queued humans (who all play as HUMANITY_MODEL_NAME) only one
+    gets a game per tick. Both matchings therefore run over models rather than
+    queue rows, with each pair of models represented by its best accepted pair
+    of rows.
+    """
+    mode = MATCHING_MODE if mode is None else mode
+    n = len(player_data)
+    rows, cols = np.triu_indices(n, k=1)
+    pair_scores = scores[rows, cols]
+    accepted = np.random.uniform(size=pair_scores.shape) < pair_scores
+    rows, cols, pair_scores = rows[accepted], cols[accepted], pair_scores[accepted]
+
+    # one node per model; with several rows of a model, keep the best edge per pair of models
+    names, model_id = np.unique([p["model_name"] for p in player_data], return_inverse=True)
+    model_a, model_b = model_id[rows], model_id[cols]
+    if len(names) < n:
+        model_a, model_b = np.minimum(model_a, model_b), np.maximum(model_a, model_b)
+        order = np.lexsort((-pair_scores, model_b, model_a))
+        order = order[model_a[order] != model_b[order]]
+        key = model_a[order] * len(names) + model_b[order]
+        best = order[np.r_[True, key[1:] != key[:-1]]] if len(order) else order
+        rows, cols, pair_scores = rows[best], cols[best], pair_scores[best]
+        model_a, model_b = model_a[best], model_b[best]
+
+    greedy_edges = greedy_pair_matching(model_a, model_b, pair_scores, len(names))
+    metrics.observe("matchmaking_matched_players", 2 * len(greedy_edges), mode="greedy")
+    edges = greedy_edges
+    if mode == "max_weight" or MATCHING_COMPARE_MODES:
+        max_weight_edges = max_weight_pair_matching(model_a, model_b, pair_scores, len(names), seed_edges=greedy_edges)
+        metrics.observe("matchmaking_matched_players", 2 * len(max_weight_edges), mode="max_weight")
+        if mode == "max_weight":
+            edges = max_weight_edges
+
+    # map only the chosen edges back to queue rows
+    return [(player_data[i], player_data[j]) for i, j in zip(rows[edges].tolist(), cols[edges].tolist())]
+
+
+def get_queue_snapshot(db: Session, environment: Environment) -> List[Dict]:
+    """
+    Load the queue of an environment in a single joined query.
+
+    Returns one dict per queued player (plus one per standard model) holding the
+    matchmaking row, the model's current Elo and its owner email, ordered by join time.
+    """
     current_time = time.time()
+    env_id = environment.environment_id
+
+    rows = (
+        db.query(Matchmaking, Model.email, CurrentRating.elo)
+        .join(Model, Model.model_name == Matchmaking.model_name)
+        .outerjoin(CurrentRating, and_(
+            CurrentRating.model_name == Matchmaking.model_name,
+            CurrentRating.environment_id == env_id
+        ))
+        .filter(Matchmaking.environment_id == env_id)
+        .order_by(Matchmaking.joined_at.asc())
+        .all()
+    )
 
-    # Get queued players
-    queued_players = db.query(Matchmaking).filter_by(
-        environment_id=environment.environment_id
-    ).order_by(Matchmaking.joined_at.asc()).all()
-
-    # Prepare player data
     player_data = []
-    for p in queued_players:
-        elo_entry = db.query(Elo).filter_by(
-            model_name=p.model_name, 
-            environment_id=environment.environment_id
-        ).order_by(desc(Elo.updated_at)).first()
-        
-        elo_score = elo_entry.elo if elo_entry else DEFAULT_ELO
-        time_in_queue = current_time - p.joined_at
-
-        # get email
-        email = db.query(Model).filter_by(
-            model_name=p.model_name,
-        ).first().email
-        
+    for mm, email, elo in rows:
+        time_in_queue = current_time - mm.joined_at
         player_data.append({
-            'matchmaking': p,
-            'model_name': p.model_name,
+            'matchmaking': mm,
+            'model_name': mm.model_name,
             'email': email,
-            'elo': elo_score,
+            'elo': elo if elo is not None else DEFAULT_ELO,
             'time_in_queue': time_in_queue,
-            'pct_queue': time_in_queue / p.time_limit
+            'pct_queue': time_in_queue / mm.time_limit
         })
 
     # add standard models
-    for model_name in STANDARD_MODELS:
-        elo_entry = db.query(Elo).filter_by(
-            model_name=model_name,
-            environment_id=environment.environment_id
-        ).order_by(desc(Elo.updated_at)).first()
+    if STANDARD_MODELS:
+        standard_elos = dict(
+            db.query(CurrentRating.model_name, CurrentRating.elo)
+            .filter(CurrentRating.environment_id == env_id, CurrentRating.model_name.in_(STANDARD_MODELS))
+            .all()
+        )
+        for model_name in STANDARD_MODELS:
+            player_data.append({
+                'matchmaking': None,
+                'model_name': model_name,
+                'email': " ", # empty placeholder for email matching
+                'elo': standard_elos.get(model_name, DEFAULT_ELO),
+                'time_in_queue': -1,
+                'pct_queue': 0
+            })
+
+    return player_data
+
+
+def generate_candidates(player_data: List[Dict], num_players: int) -> Iterator[Tuple[Dict, ...]]:
+    """
+    Yield every combination whose Elo spread is within MAX_ELO_DELTA.
+
+    Players are sorted by Elo and each combination is generated once, from its
+    lowest-rated member and the players inside that member's Elo window, so the
+    work grows with the number of feasible combinations rather than N choose k.
+    Combinations outside the window would score 0 and can never be accepted.
+    """
+    players = sorted(player_data, key=lambda p: p["elo"])
+    end = 0
+    for i, low in enumerate(players):
+        end = max(end, i + 1)
+        while end < len(players) and players[end]["elo"] - low["elo"] <= MAX_ELO_DELTA:
+            end += 1
+        for rest in combinations(players[i + 1:end], num_players - 1):
+            yield (low,) + rest
+
+
+def select_groups(player_data: List[Dict], num_players: int) -> List[Tuple[Dict, ...]]:
+    """
+    Greedy N-player group building in Elo space.
+
+    Players are visited longest-waiting first (by queue percentage). Each
+    unmatched seed grows a group from its nearest unmatched neighbours in Elo,
+    looking at most MATCHMAKING_GROUP_CANDIDATES of them and skipping anyone who
+    shares an email with a member or would push the spread past MAX_ELO_DELTA.
+    A complete group is accepted with probability equal to its score, and a
+    model is matched at most once per tick (see `sample_pair_matches`). The cost
+    is O(N log N + N * candidates * num_players), independent of N choose k.
+    """
+    players = sorted(player_data, key=lambda p: p["elo"])
+    elos = [p["elo"] for p in players]
+    matched = [False] * len(players)
+    matched_models = set()
+    seeds = sorted(range(len(players)), key=lambda i: players[i]["pct_queue"], reverse=True)
 
-        elo_score = elo_entry.elo if elo_entry else DEFAULT_ELO
-        player_data.append({
-            'matchmaking': None,
-            'model_name': model_name,
-            'email': " ", # empty placeholder for email matching
-            'elo': elo_score,
-            'time_in_queue': -1,
-            'pct_queue': 0
-        })
+    final_matches = []
+    for seed in seeds:
+        if matched[seed] or players[seed]["model_name"] in matched_models:
+            continue
+        seed_elo = elos[seed]
+
+        # unmatched neighbours inside the seed's Elo window, nearest first
+        lo = bisect_left(elos, seed_elo - MAX_ELO_DELTA)
+        hi = bisect_right(elos, seed_elo + MAX_ELO_DELTA)
+        neighbours = sorted(
+            (i for i in range(lo, hi) if i != seed and not matched[i] and players[i]["model_name"] not in matched_models),
+            key=lambda i: abs(elos[i] - seed_elo)
+        )[:MATCHMAKING_GROUP_CANDIDATES]
+
+        group = [seed]
+        models = {players[seed]["model_name"]}
+        emails = {players[seed]["email"]}
+        low = high = seed_elo
+        for i in neighbours:
+            if players[i]["email"] in emails or players[i]["model_name"] in models:
+                continue
+            if max(high, elos[i]) - min(low, elos[i]) > MAX_ELO_DELTA:
+                continue
+            group.append(i)
+            models.add(players[i]["model_name"])
+            emails.add(players[i]["email"])
+            low, high = min(low, elos[i]), max(high, elos[i])
+            if len(group) == num_players:
+                break
+
+        if len(group) < num_players:
+            continue
+
+        combo = tuple(players[i] for i in group)
+        if np.random.uniform() < compute_match_score(combo):
+            for i in group:
+                matched[i] = True
+            matched_models.update(models)
+            final_matches.append(combo)
+
+    return final_matches
 
-    # shuffle
+
+def select_matches(player_data: List[Dict], num_players: int) -> List[Tuple[Dict, ...]]:
+    """Score the candidate combinations and stochastically pick non-overlapping matches."""
+    # shuffle (breaks ties between equally rated players at random)
+    player_data = list(player_data)
     random.shuffle(player_data)
 
+    if num_players == 2:
+        return sample_pair_matches(player_data, compute_pair_score_matrix(player_data))
+
+    # large N-player queues: greedy grouping instead of enumerating combinations
+    if comb(len(player_data), num_players) > MATCHMAKING_EXHAUSTIVE_MAX_COMBINATIONS:
+        return select_groups(player_data, num_players)
 
     # Generate and score combinations
-    possible_combinations = list(combinations(player_data, environment.num_players))
     scored_combinations = [
-        (compute_match_score(db, combo), combo)
-        for combo in possible_combinations
+        (compute_match_score(combo), combo)
+        for combo in generate_candidates(player_data, num_players)
     ]
     scored_combinations.sort(key=lambda x: x[0], reverse=True)
-    print(scored_combinations)
 
     # Select matches
     selected_players = set()
@@ -170,60 +411,80 @@ def matchmaking_algorithm(db: Session, environment: Environment):
             selected_players.update(models)
             final_matches.append(combo)
 
+    return final_matches
+
+
+def matchmaking_algorithm(db: Session, environment: Environment, prepare_envs: bool = True):
+    """Core matchmaking algorithm with support for humans and standard models."""
+    # logger.info(f"Starting matchmaking for environment '{environment.environment_id}'.")
+    player_data = get_queue_snapshot(db, environment)
+    final_matches = select_matches(player_data, environment.num_players)
+
     # Create games
-    for match in final_matches:
-        game_id = create_game(db, match, environment)
-        
-        # Log match details
-        table = Table(show_header=True, header_style="bold magenta")
-        table.add_column("Player ID", style="dim", width=12)
-        table.add_column("Model Name", style="dim", width=30)
-        table.add_column("Type", style="dim", width=20)
-        
-        for pg in db.query(PlayerGame).filter_by(game_id=game_id).all():
-            player_type = "Human" if pg.is_human else (
-                "Standard" if pg.model_name in STANDARD_MODELS else "Submitted"
-            )
-            table.add_row(str(pg.player_id), pg.model_name, player_type)
-            
-        # logger.info(f"Created game {game_id}:\n{table}")
+    if final_matches:
+        create_games(db, final_matches, environment, prepare_envs=prepare_envs)
 
 
+def create_games(db: Session, matches: List[Tuple[Dict, ...]], environment: Environment, prepare_envs: bool = True) -> List[int]:
+    """
+    Create the games for a whole matchmaking tick in a single transaction.
 
-def create_game(db: Session, match: List[Dict], environment: Environment) -> int:
-    """Create a new game with appropriate environment manager."""
+    Game rows, player rows and the queue deletions are written with bulk
+    statements and committed once. The environments themselves are built in the
+    background by the environment managers (see `prepare_env_async`), so the
+    matchmaking thread never waits on `ta.make`.
+    """
     current_time = time.time()
-    
-    # Create game record
-    game = Game(
-        environment_id=environment.environment_id,
-        started_at=current_time,
-        status="active"
-    )
-    db.add(game)
+    env_id = environment.environment_id
+
+    # Create game records in one batched insert. The rows are identical, so the
+    # returned ids can be handed out in any order; asking for them in parameter
+    # order would make SQLite run one INSERT per game.
+    game_ids = list(db.execute(
+        insert(Game).returning(Game.id),
+        [{"environment_id": env_id, "started_at": current_time, "status": "active"} for _ in matches]
+    ).scalars())
+
+    # Add players and clear their queue entries
+    player_rows, matchmaking_ids = [], []
+    for game_id, match in zip(game_ids, matches):
+        for idx, player in enumerate(match):
+            is_human = player['model_name'] == HUMANITY_MODEL_NAME
+            player_rows.append({
+                "game_id": game_id,
+                "model_name": player['model_name'],
+                "player_id": idx,
+                "last_action_time": current_time,
+                "is_human": is_human,
+                "human_ip": player['matchmaking'].human_ip if is_human else None
+            })
+            if player['matchmaking'] is not None:
+                matchmaking_ids.append(player['matchmaking'].id)
+                metrics.observe(
+                    "queue_to_match_seconds",
+                    current_time - player['matchmaking'].joined_at,
+                    env_id=env_id
+                )
+
+    db.execute(insert(PlayerGame), player_rows)
+    if matchmaking_ids:
+        db.query(Matchmaking).filter(Matchmaking.id.in_(matchmaking_ids)).delete(synchronize_session=False)
     db.commit()
-    db.refresh(game)
-    
-    # Add players to game first
-    for idx, player in enumerate(match):
-        pg = PlayerGame(
-            game_id=game.id,
-            model_name=player['model_name'],
-            player_id=idx,
-            last_action_time=current_time,
-            is_human=player['model_name'] == HUMANITY_MODEL_NAME,
-            human_ip=player['matchmaking'].human_ip if player['model_name'] == HUMANITY_MODEL_NAME else None
-        )
-        db.add(pg)
-        if player['matchmaking'] is not None:
-            db.delete(player['matchmaking'])
-    db.commit()
-    
-    # Now initialize the appropriate environment
-    env_manager = EnvironmentManagerBase.get_appropriate_manager(game.id, db)
-    env = env_manager.get_env(game_id=game.id, env_id=environment.environment_id, db=db)
+    for matchmaking_id in matchmaking_ids:
+        heartbeats.discard(matchmaking_id)
 
-    game.specific_env_id = env.env_id 
-    db.commit()
+    for game_id, match in zip(game_ids, matches):
+        pair_history.record_game([player['model_name'] for player in match], started_at=current_time)
+        deadlines.watch_game_start(game_id, current_time)
 
-    return game.id
\ No newline at end of file
+    # Initialize the environments off the matchmaking thread
+    if prepare_envs:
+        for game_id in game_ids:
+            EnvironmentManagerBase.prepare_env_async(game_id=game_id, env_id=env_id)
+
+    return game_ids
+
+
+def create_game(db: Session, match: List[Dict], environment: Environment) -> int:
+    """Create a new game with appropriate environment manager."""
+    return create_games(db, [match], environment)[0]
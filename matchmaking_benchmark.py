@@ -0,0 +1,199 @@
+"""
+Offline benchmark for the matchmaking tick.
+
+Seeds an in-memory SQLite database with a synthetic queue and times the
+queue snapshot and the match selection for growing queue sizes.
+
+Usage:
+    python matchmaking_benchmark.py --sizes 10 50 100 200 --repeats 3
+    python matchmaking_benchmark.py --verify   # compare candidates/score matrix with brute force
+    python matchmaking_benchmark.py --compare-modes   # players matched by greedy vs max-weight
+    python matchmaking_benchmark.py --num-players 4 --sizes 100 500   # N-player grouping
+"""
+import argparse, random, time
+import numpy as np
+from itertools import combinations
+
+# db imports
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# core imports
+from database import Base
+from core.models import Model, Elo, Environment, Matchmaking
+
+# local imports
+from matchmaking import (
+    get_queue_snapshot, select_matches,
+    generate_candidates, compute_match_score,
+    compute_pair_score_matrix, sample_pair_matches
+)
+from pair_history import pair_history
+from elo_updates import backfill_current_ratings
+
+
+class QueryCounter:
+    """Counts the SQL statements executed on an engine."""
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def make_session():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def seed_queue(db, env_id: str, queue_size: int, num_players: int = 2, history_len: int = 5, num_emails: int = 50):
+    """Register an environment and `queue_size` queued models with some Elo history."""
+    current_time = time.time()
+    db.add(Environment(environment_id=env_id, num_players=num_players))
+    for i in range(queue_size):
+        model_name = f"model-{i}"
+        db.add(Model(
+            model_name=model_name,
+            description="benchmark model",
+            email=f"owner-{i % num_emails}@example.com",
+            model_token=f"token-{i}"
+        ))
+        elo = random.gauss(1000, 150)
+        for h in range(history_len):
+            db.add(Elo(
+                model_name=model_name,
+                environment_id=env_id,
+                elo=elo + random.uniform(-20, 20),
+                updated_at=current_time - (history_len - h) * 60
+            ))
+        db.add(Matchmaking(
+            environment_id=env_id,
+            model_name=model_name,
+            joined_at=current_time - random.uniform(0, 300),
+            time_limit=300,
+            last_checked=current_time
+        ))
+    db.commit()
+    backfill_current_ratings(db)
+    return db.query(Environment).filter(Environment.environment_id == env_id).one()
+
+
+def benchmark_tick(queue_size: int, repeats: int = 3, num_players: int = 2):
+    engine, db = make_session()
+    counter = QueryCounter(engine)
+    environment = seed_queue(db, "Benchmark-v0", queue_size, num_players=num_players)
+
+    snapshot_times, selection_times, queries = [], [], []
+    for _ in range(repeats):
+        counter.count = 0
+        t0 = time.perf_counter()
+        player_data = get_queue_snapshot(db, environment)
+        t1 = time.perf_counter()
+        select_matches(player_data, environment.num_players)
+        t2 = time.perf_counter()
+        snapshot_times.append(t1 - t0)
+        selection_times.append(t2 - t1)
+        queries.append(counter.count)
+
+    db.close()
+    engine.dispose()
+    return {
+        "queue_size": queue_size,
+        "snapshot_ms": 1000 * min(snapshot_times),
+        "selection_ms": 1000 * min(selection_times),
+        "tick_ms": 1000 * (min(snapshot_times) + min(selection_times)),
+        "queries": max(queries),
+    }
+
+
+def verify_candidates(queue_size: int, num_players: int = 2) -> bool:
+    """Check that the Elo-window candidates and the score matrix agree with brute-force scoring."""
+    engine, db = make_session()
+    environment = seed_queue(db, "Benchmark-v0", queue_size, num_players=num_players)
+    player_data = get_queue_snapshot(db, environment)
+    for _ in range(queue_size):
+        pair_history.record_game(p["model_name"] for p in random.sample(player_data, 2))
+
+    def scored(combos):
+        scores = {}
+        for combo in combos:
+            score = compute_match_score(combo)
+            if score > 0:
+                scores[frozenset(p["model_name"] for p in combo)] = score
+        return scores
+
+    brute_force = scored(combinations(player_data, num_players))
+    windowed = scored(generate_candidates(player_data, num_players))
+    ok = brute_force.keys() == windowed.keys() and all(
+        np.isclose(brute_force[k], windowed[k]) for k in brute_force
+    )
+
+    if num_players == 2:
+        matrix = compute_pair_score_matrix(player_data)
+        for i, j in combinations(range(len(player_data)), 2):
+            expected = brute_force.get(frozenset((player_data[i]["model_name"], player_data[j]["model_name"])), 0)
+            ok = ok and np.isclose(matrix[i, j], expected) and np.isclose(matrix[j, i], expected)
+
+    db.close()
+    engine.dispose()
+    return ok
+
+
+def compare_modes(queue_size: int, seed: int = 0):
+    """Number of players matched by each matching mode on the same queue and acceptance draws."""
+    engine, db = make_session()
+    environment = seed_queue(db, "Benchmark-v0", queue_size)
+    player_data = get_queue_snapshot(db, environment)
+    scores = compute_pair_score_matrix(player_data)
+
+    result = {"queue_size": queue_size}
+    for mode in ["greedy", "max_weight"]:
+        np.random.seed(seed)
+        t0 = time.perf_counter()
+        matches = sample_pair_matches(player_data, scores, mode=mode)
+        result[mode] = (2 * len(matches), 1000 * (time.perf_counter() - t0))
+
+    db.close()
+    engine.dispose()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matchmaking tick on an in-memory database.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 25, 50, 100, 200])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--num-players", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verify", action="store_true", help="check candidate generation against brute force")
+    parser.add_argument("--compare-modes", action="store_true", help="compare greedy and max-weight matching")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.verify:
+        for size in args.sizes:
+            ok = verify_candidates(size, num_players=args.num_players)
+            print(f"queue {size:>6}: {'ok' if ok else 'MISMATCH'}")
+        return
+
+    if args.compare_modes:
+        print(f"{'queue':>8} {'greedy matched':>15} {'greedy ms':>10} {'max-weight matched':>19} {'max-weight ms':>14}")
+        for size in args.sizes:
+            r = compare_modes(size, seed=args.seed)
+            print(f"{size:>8} {r['greedy'][0]:>15} {r['greedy'][1]:>10.2f} {r['max_weight'][0]:>19} {r['max_weight'][1]:>14.2f}")
+        return
+
+    print(f"{'queue':>8} {'snapshot ms':>12} {'selection ms':>13} {'tick ms':>10} {'queries':>9}")
+    for size in args.sizes:
+        r = benchmark_tick(size, repeats=args.repeats, num_players=args.num_players)
+        print(f"{r['queue_size']:>8} {r['snapshot_ms']:>12.2f} {r['selection_ms']:>13.2f} {r['tick_ms']:>10.2f} {r['queries']:>9}")
+
+
+if __name__ == "__main__":
+    main()
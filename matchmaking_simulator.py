@@ -0,0 +1,271 @@
+"""
+Offline matchmaking simulator.
+
+Drives the real matchmaker (`matchmaking_algorithm`, `compute_match_score`,
+`create_game`, `settle_games`) tick by tick against an in-memory SQLite
+database populated with a synthetic workload, and reports tick latency, SQL
+query counts, queue waits, Elo gaps and match rates.
+
+Queue time is simulated: every tick all queue entries are aged by
+`tick_seconds`, so a run of a few hundred ticks covers hours of queueing in
+seconds of wall time. Environments are not built (`prepare_envs=False`).
+
+Usage:
+    python matchmaking_simulator.py --models 500 --ticks 200 --arrival-rate 20
+    python matchmaking_simulator.py --elo-dist bimodal --owners 20 --json report.json
+
+Or from Python, to compare matchmaker changes on the same workload:
+    from matchmaking_simulator import run_simulation
+    report = run_simulation(num_models=300, ticks=100, seed=1)
+"""
+import argparse, json, random, time
+from typing import Dict, List
+
+import numpy as np
+
+# db imports
+from sqlalchemy import update
+
+# core imports
+from core.models import Model, Elo, Environment, Matchmaking, Game, PlayerGame
+
+# import configs
+from config import DEFAULT_ELO, HUMANITY_MODEL_NAME, STANDARD_MODELS
+
+# local imports
+from matchmaking import matchmaking_algorithm
+from elo_updates import settle_games, backfill_current_ratings
+from game_stats import record_outcomes
+from pair_history import pair_history
+from matchmaking_benchmark import make_session, QueryCounter
+
+
+DEFAULT_SIMULATION = {
+    "env_id": "Simulated-v0",
+    "num_players": 2,
+    "num_models": 200,          # size of the submitted-model population
+    "num_owners": 50,           # distinct owner emails
+    "owner_skew": 1.2,          # zipf exponent of models per owner (0 = uniform)
+    "elo_dist": "normal",       # "normal", "uniform" or "bimodal"
+    "elo_mean": DEFAULT_ELO,
+    "elo_std": 150,
+    "num_standard_models": 0,
+    "arrival_rate": 10.0,       # mean model arrivals per tick (Poisson)
+    "human_arrival_rate": 0.0,  # mean human arrivals per tick (Poisson)
+    "queue_time_limit": 300,    # seconds a client waits before abandoning
+    "game_ticks": 5,            # ticks a game lasts
+    "requeue_prob": 0.8,        # chance a model rejoins right after its game
+    "tick_seconds": 3.0,        # simulated seconds per tick
+    "ticks": 100,
+    "seed": 0,
+}
+
+
+def sample_elos(config: Dict, n: int, rng: np.random.Generator) -> np.ndarray:
+    if config["elo_dist"] == "uniform":
+        half_width = config["elo_std"] * np.sqrt(3)
+        return rng.uniform(config["elo_mean"] - half_width, config["elo_mean"] + half_width, size=n)
+    if config["elo_dist"] == "bimodal":
+        modes = rng.choice([-1, 1], size=n) * config["elo_std"]
+        return rng.normal(config["elo_mean"] + modes, config["elo_std"] / 3)
+    return rng.normal(config["elo_mean"], config["elo_std"], size=n)
+
+
+def sample_owners(config: Dict, n: int, rng: np.random.Generator) -> np.ndarray:
+    weights = 1 / np.arange(1, config["num_owners"] + 1) ** config["owner_skew"]
+    return rng.choice(config["num_owners"], size=n, p=weights / weights.sum())
+
+
+def seed_population(db, config: Dict, rng: np.random.Generator) -> List[str]:
+    now = time.time()
+    db.add(Environment(environment_id=config["env_id"], num_players=config["num_players"]))
+
+    model_names = [f"sim-model-{i}" for i in range(config["num_models"])]
+    for model_name, elo, owner in zip(model_names, sample_elos(config, len(model_names), rng), sample_owners(config, len(model_names), rng)):
+        db.add(Model(model_name=model_name, description="simulated", email=f"owner-{owner}@example.com", model_token=model_name))
+        db.add(Elo(model_name=model_name, environment_id=config["env_id"], elo=float(elo), updated_at=now))
+
+    for i in range(config["num_standard_models"]):
+        model_name = f"sim-standard-{i}"
+        STANDARD_MODELS.append(model_name)
+        db.add(Model(model_name=model_name, description="simulated standard", email="system@textarena.ai", model_token=model_name))
+        db.add(Elo(model_name=model_name, environment_id=config["env_id"], elo=config["elo_mean"], updated_at=now))
+
+    if config["human_arrival_rate"] > 0:
+        db.add(Model(model_name=HUMANITY_MODEL_NAME, description="humans", email="system@textarena.ai", model_token=HUMANITY_MODEL_NAME))
+        db.add(Elo(model_name=HUMANITY_MODEL_NAME, environment_id=config["env_id"], elo=config["elo_mean"], updated_at=now))
+
+    db.commit()
+    backfill_current_ratings(db)
+    return model_names
+
+
+def enqueue(db, config: Dict, model_name: str, human_ip: str = None):
+    now = time.time()
+    db.add(Matchmaking(
+        environment_id=config["env_id"],
+        model_name=model_name,
+        joined_at=now,
+        time_limit=config["queue_time_limit"],
+        last_checked=now,
+        is_human=human_ip is not None,
+        human_ip=human_ip
+    ))
+
+
+def finish_games(db, config: Dict, ends: Dict[int, int], tick: int, rng: np.random.Generator) -> List[str]:
+    """Conclude games whose duration is over; returns the models that want to requeue."""
+    requeue = []
+    finished = [g for g, end in ends.items() if end <= tick]
+    for game_id in finished:
+        del ends[game_id]
+        players = db.query(PlayerGame).filter(PlayerGame.game_id == game_id).all()
+        winner = rng.integers(len(players))
+        record_outcomes(db, game_id, {player.player_id: 1 if idx == winner else -1 for idx, player in enumerate(players)})
+
+        for player in players:
+            if player.is_human or player.model_name in STANDARD_MODELS:
+                continue
+            if rng.uniform() < config["requeue_prob"]:
+                requeue.append(player.model_name)
+    db.commit()
+    settle_games(db, finished)
+    return requeue
+
+
+def run_simulation(**overrides) -> Dict:
+    """Run one simulation and return its report (all times in milliseconds / simulated seconds)."""
+    config = dict(DEFAULT_SIMULATION, **overrides)
+    random.seed(config["seed"])
+    np.random.seed(config["seed"])
+    rng = np.random.default_rng(config["seed"])
+
+    engine, db = make_session()
+    counter = QueryCounter(engine)
+    standard_before = list(STANDARD_MODELS)
+
+    try:
+        idle = seed_population(db, config, rng)
+        rng.shuffle(idle)
+        pair_history.rebuild(db)
+        environment = db.query(Environment).filter(Environment.environment_id == config["env_id"]).one()
+        elos = dict(db.query(Elo.model_name, Elo.elo).all())
+
+        tick_ms, tick_queries, queue_sizes, match_rates = [], [], [], []
+        queue_waits, elo_gaps = [], []
+        abandoned, human_count = 0, 0
+        game_ends: Dict[int, int] = {}
+
+        for tick in range(config["ticks"]):
+            # arrivals
+            for _ in range(min(len(idle), rng.poisson(config["arrival_rate"]))):
+                enqueue(db, config, idle.pop())
+            for _ in range(rng.poisson(config["human_arrival_rate"])):
+                enqueue(db, config, HUMANITY_MODEL_NAME, human_ip=f"10.0.{human_count // 256}.{human_count % 256}")
+                human_count += 1
+            db.commit()
+
+            # clients that gave up waiting
+            for mm in db.query(Matchmaking).filter(Matchmaking.joined_at < time.time() - Matchmaking.time_limit).all():
+                if not mm.is_human:
+                    idle.insert(0, mm.model_name)
+                db.delete(mm)
+                abandoned += 1
+            db.commit()
+
+            queued = {mm.id: mm.joined_at for mm in db.query(Matchmaking).all()}
+            queue_sizes.append(len(queued))
+
+            # one real matchmaking tick
+            max_game_id = db.query(Game.id).order_by(Game.id.desc()).limit(1).scalar() or 0
+            counter.count = 0
+            start = time.perf_counter()
+            matchmaking_algorithm(db=db, environment=environment, prepare_envs=False)
+            tick_ms.append(1000 * (time.perf_counter() - start))
+            tick_queries.append(counter.count)
+
+            # inspect the new games
+            now = time.time()
+            matched = 0
+            new_games = db.query(Game).filter(Game.id > max_game_id).all()
+            for game in new_games:
+                players = db.query(PlayerGame).filter(PlayerGame.game_id == game.id).all()
+                game_elos = [elos.get(p.model_name, DEFAULT_ELO) for p in players]
+                elo_gaps.append(max(game_elos) - min(game_elos))
+                game_ends[game.id] = tick + config["game_ticks"]
+                matched += len(players)
+            still_queued = {mm_id for mm_id, in db.query(Matchmaking.id).all()}
+            queue_waits.extend(now - joined_at for mm_id, joined_at in queued.items() if mm_id not in still_queued)
+            match_rates.append(matched / len(queued) if queued else 0)
+
+            # game completions and requeues
+            for model_name in finish_games(db, config, game_ends, tick, rng):
+                enqueue(db, config, model_name)
+            db.commit()
+            elos = {name: elo for name, elo in (
+                db.query(Elo.model_name, Elo.elo).order_by(Elo.id).all()
+            )}
+
+            # advance simulated time
+            db.execute(update(Matchmaking).values(
+                joined_at=Matchmaking.joined_at - config["tick_seconds"],
+                last_checked=Matchmaking.last_checked - config["tick_seconds"]
+            ))
+            db.commit()
+
+        def dist(values):
+            values = np.asarray(values, dtype=float)
+            if len(values) == 0:
+                return {"count": 0}
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            return {"count": len(values), "mean": float(values.mean()), "p50": float(p50),
+                    "p90": float(p90), "p99": float(p99), "max": float(values.max())}
+
+        games_created = len(elo_gaps)
+        return {
+            "config": config,
+            "tick_ms": dist(tick_ms),
+            "queries_per_tick": dist(tick_queries),
+            "queue_size": dist(queue_sizes),
+            # time_in_queue is aged by tick_seconds per tick, so waits are simulated seconds
+            "queue_wait_seconds": dist(queue_waits),
+            "elo_gap": dist(elo_gaps),
+            "match_rate": dist(match_rates),
+            "games_created": games_created,
+            "abandoned": abandoned,
+        }
+    finally:
+        STANDARD_MODELS[:] = standard_before
+        db.close()
+        engine.dispose()
+
+
+def print_report(report: Dict):
+    print(f"games created: {report['games_created']}, abandoned queue entries: {report['abandoned']}")
+    print(f"{'metric':<22} {'count':>7} {'mean':>10} {'p50':>10} {'p90':>10} {'p99':>10} {'max':>10}")
+    for key in ["tick_ms", "queries_per_tick", "queue_size", "queue_wait_seconds", "elo_gap", "match_rate"]:
+        d = report[key]
+        if d["count"] == 0:
+            print(f"{key:<22} {0:>7}")
+            continue
+        print(f"{key:<22} {d['count']:>7} {d['mean']:>10.2f} {d['p50']:>10.2f} {d['p90']:>10.2f} {d['p99']:>10.2f} {d['max']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the matchmaker on a synthetic workload.")
+    for key, default in DEFAULT_SIMULATION.items():
+        flag = "--" + key.replace("_", "-").replace("num-", "")
+        parser.add_argument(flag, dest=key, type=type(default), default=default)
+    parser.add_argument("--json", dest="json_path", default=None, help="also write the report to this file")
+    args = vars(parser.parse_args())
+    json_path = args.pop("json_path")
+
+    report = run_simulation(**args)
+    print_report(report)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
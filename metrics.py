@@ -0,0 +1,73 @@
+import threading
+from collections import defaultdict, deque
+from typing import Dict
+
+import numpy as np
+
+# import configs
+from config import METRICS_SAMPLE_SIZE
+
+
+def _key(name: str, labels: Dict) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}"
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics store.
+
+    Counters accumulate, gauges keep the last value and histograms keep the
+    most recent `sample_size` observations to report percentiles from.
+    """
+    def __init__(self, sample_size: int = METRICS_SAMPLE_SIZE):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, deque] = defaultdict(lambda: deque(maxlen=sample_size))
+        self._histogram_counts: Dict[str, int] = defaultdict(int)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._histograms[key].append(value)
+            self._histogram_counts[key] += 1
+
+    def summary(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (list(samples), self._histogram_counts[key]) for key, samples in self._histograms.items()}
+
+        histogram_summary = {}
+        for key, (samples, total) in histograms.items():
+            values = np.array(samples, dtype=float)
+            p50, p90, p99 = np.percentile(values, [50, 90, 99]) if len(values) else (None, None, None)
+            histogram_summary[key] = {
+                "count": total,
+                "mean": float(values.mean()) if len(values) else None,
+                "p50": None if p50 is None else float(p50),
+                "p90": None if p90 is None else float(p90),
+                "p99": None if p99 is None else float(p99),
+                "max": float(values.max()) if len(values) else None,
+            }
+        return {"counters": counters, "gauges": gauges, "histograms": histogram_summary}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._histogram_counts.clear()
+
+
+metrics = MetricsRegistry()
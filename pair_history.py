@@ -0,0 +1,84 @@
+import threading, time
+from collections import deque, defaultdict
+from itertools import combinations
+from typing import Dict, Iterable, Tuple
+
+# db imports
+from sqlalchemy.orm import Session
+
+# core imports
+from core.models import Game, PlayerGame
+
+# import configs
+from config import RECENCY_WINDOW
+
+
+class PairHistoryIndex:
+    """
+    Sliding-window count of games per unordered model pair.
+
+    Games are recorded as they are created and expire once they are older than
+    `window` seconds, so looking up how often two models met recently is O(1).
+    """
+    def __init__(self, window: float = RECENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._events = deque()  # (started_at, pair) in insertion order
+        self._counts: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    @staticmethod
+    def _key(model1: str, model2: str) -> Tuple[str, str]:
+        return (model1, model2) if model1 <= model2 else (model2, model1)
+
+    def _expire(self, now: float):
+        cutoff = now - self.window
+        while self._events and self._events[0][0] < cutoff:
+            _, pair = self._events.popleft()
+            self._counts[pair] -= 1
+            if self._counts[pair] <= 0:
+                del self._counts[pair]
+
+    def record_game(self, model_names: Iterable[str], started_at: float = None):
+        """Register a new game between the given models."""
+        started_at = time.time() if started_at is None else started_at
+        with self._lock:
+            for model1, model2 in combinations(sorted(set(model_names)), 2):
+                pair = (model1, model2)
+                self._events.append((started_at, pair))
+                self._counts[pair] += 1
+
+    def count(self, model1: str, model2: str, now: float = None) -> int:
+        """Number of games between the two models within the window."""
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+            return self._counts.get(self._key(model1, model2), 0)
+
+    def snapshot(self, now: float = None) -> Dict[Tuple[str, str], int]:
+        """Copy of all current pair counts, keyed by sorted model-name pairs."""
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+            return dict(self._counts)
+
+    def rebuild(self, db: Session, now: float = None):
+        """Reload the window from the games table (e.g. at startup)."""
+        now = time.time() if now is None else now
+        rows = (
+            db.query(Game.id, Game.started_at, PlayerGame.model_name)
+            .join(PlayerGame, Game.id == PlayerGame.game_id)
+            .filter(Game.started_at >= now - self.window)
+            .order_by(Game.started_at, Game.id)
+            .all()
+        )
+
+        games = {}
+        for game_id, started_at, model_name in rows:
+            games.setdefault(game_id, (started_at, []))[1].append(model_name)
+
+        with self._lock:
+            self._events.clear()
+            self._counts.clear()
+        for started_at, model_names in games.values():
+            self.record_game(model_names, started_at=started_at)
+
+
+pair_history = PairHistoryIndex()
@@ -0,0 +1,48 @@
+import threading, time
+from typing import Optional, Set
+
+# import configs
+from config import MATCHMAKING_DEBOUNCE
+
+
+class QueueEvents:
+    """
+    Wake-up signal for the matchmaker.
+
+    Endpoints call `notify` whenever a queue changes (join, leave, game
+    completion); the matchmaking loop blocks in `wait` until either an event
+    arrives or the fallback interval elapses.
+    """
+    def __init__(self, debounce: float = MATCHMAKING_DEBOUNCE):
+        self.debounce = debounce
+        self._cond = threading.Condition()
+        self._dirty: Set[str] = set()
+
+    def notify(self, env_id: str):
+        """Mark the queue of `env_id` as changed and wake the matchmaker."""
+        with self._cond:
+            self._dirty.add(env_id)
+            self._cond.notify_all()
+
+    def wait(self, timeout: float) -> Optional[Set[str]]:
+        """
+        Block until a queue event arrives or `timeout` seconds pass.
+
+        Returns the set of environment ids whose queues changed, or None when
+        the timeout elapsed without events (i.e. a fallback sweep is due). After
+        the first event the call lingers for `debounce` seconds so that a burst
+        of joins is handled in a single matchmaking pass.
+        """
+        with self._cond:
+            if not self._dirty:
+                self._cond.wait(timeout)
+            if not self._dirty:
+                return None
+
+        time.sleep(self.debounce)
+        with self._cond:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+
+queue_events = QueueEvents()
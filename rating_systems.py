@@ -0,0 +1,199 @@
+import math
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+# import configs
+from config import (
+    DEFAULT_ELO,
+    INITIAL_K, HUMAN_K_FACTOR,
+    STANDARD_MODEL_K_FACTOR,
+    REDUCED_K, GAMES_THRESHOLD,
+    HUMANITY_MODEL_NAME,
+    STANDARD_MODELS,
+    GLICKO2_INITIAL_RD, GLICKO2_INITIAL_VOLATILITY,
+    GLICKO2_TAU, GLICKO2_PERIOD_SECONDS
+)
+
+
+def get_outcome_scores(rewards: List[float]) -> List[float]:
+    """Map rewards to Elo scores: 1 above the minimum, 0 below the maximum, 0.5 otherwise."""
+    min_reward, max_reward = min(rewards), max(rewards)
+    return [
+        1 if reward > min_reward else (0 if reward < max_reward else 0.5)
+        for reward in rewards
+    ]
+
+
+def get_k_factor(model_name: str, games_played: int) -> float:
+    """Determine K-factor based on model type and games played."""
+    if model_name == HUMANITY_MODEL_NAME:
+        return HUMAN_K_FACTOR
+    if model_name in STANDARD_MODELS:
+        return STANDARD_MODEL_K_FACTOR
+    return INITIAL_K if games_played < GAMES_THRESHOLD else REDUCED_K
+
+
+def compute_elo_updates(player_details: List[Dict]):
+    """Set `new_elo` on every player dict from its outcome, previous Elo and K-factor."""
+    # Calculate average opponent Elo for each player
+    for player in player_details:
+        opponents = [p for p in player_details if p['model_name'] != player['model_name']]
+        if opponents:
+            avg_opp_elo = sum([opp['prev_elo'] for opp in opponents]) / len(opponents)
+        else:
+            avg_opp_elo = DEFAULT_ELO  # Default if no opponents
+
+        expected_score = 1 / (1 + 10 ** ((avg_opp_elo - player['prev_elo']) / 400))
+        new_elo = player['prev_elo'] + player['k_factor'] * (player['outcome'] - expected_score)
+        player['new_elo'] = round(new_elo, 2)
+
+
+class RatingSystem(ABC):
+    """
+    Incremental rating backend.
+
+    A rating state is a dict with `rating`, `deviation`, `volatility` and
+    `updated_at` (unused fields are None). `update` receives the players of one
+    finished game as dicts with `model_name`, `reward`, `outcome` (see
+    `get_outcome_scores`), `games_played` (including this game) and `state`,
+    and returns their new states in the same order. Updates only touch the
+    players of the game.
+    """
+    name: str = None
+
+    @abstractmethod
+    def initial_state(self) -> Dict:
+        """State of a model that has not played yet."""
+
+    @abstractmethod
+    def update(self, players: List[Dict], now: float) -> List[Dict]:
+        """New states of the players of one finished game, in the order given."""
+
+
+class EloSystem(RatingSystem):
+    """Elo against the average opponent rating with a dynamic K-factor."""
+    name = "elo"
+
+    def initial_state(self) -> Dict:
+        return {"rating": DEFAULT_ELO, "deviation": None, "volatility": None, "updated_at": None}
+
+    def update(self, players: List[Dict], now: float) -> List[Dict]:
+        player_details = [
+            {
+                'model_name': p['model_name'],
+                'outcome': p['outcome'],
+                'prev_elo': p['state']['rating'],
+                'k_factor': get_k_factor(p['model_name'], p['games_played'])
+            }
+            for p in players
+        ]
+        compute_elo_updates(player_details)
+        return [
+            {"rating": player['new_elo'], "deviation": None, "volatility": None, "updated_at": now}
+            for player in player_details
+        ]
+
+
+class Glicko2System(RatingSystem):
+    """
+    Glicko-2 (Glickman, 2012) with one rating period per game.
+
+    Each game is scored pairwise (a higher reward beats a lower one, equal
+    rewards draw) and applied as a rating period of its players only. Time
+    without games is accounted for lazily: every GLICKO2_PERIOD_SECONDS since a
+    player's last update counts as one empty period and widens its deviation.
+    """
+    name = "glicko2"
+    scale = 400 / math.log(10)  # 173.7178
+
+    def __init__(self, tau: float = GLICKO2_TAU, period_seconds: float = GLICKO2_PERIOD_SECONDS):
+        self.tau = tau
+        self.period_seconds = period_seconds
+
+    def initial_state(self) -> Dict:
+        return {"rating": DEFAULT_ELO, "deviation": GLICKO2_INITIAL_RD,
+                "volatility": GLICKO2_INITIAL_VOLATILITY, "updated_at": None}
+
+    @staticmethod
+    def _g(phi: float) -> float:
+        return 1 / math.sqrt(1 + 3 * phi * phi / (math.pi * math.pi))
+
+    def _new_volatility(self, phi: float, sigma: float, delta: float, v: float) -> float:
+        """Illinois iteration of step 5 of the Glicko-2 paper."""
+        a = math.log(sigma * sigma)
+
+        def f(x):
+            ex = math.exp(x)
+            return (ex * (delta * delta - phi * phi - v - ex)) / (2 * (phi * phi + v + ex) ** 2) - (x - a) / (self.tau ** 2)
+
+        big_a = a
+        if delta * delta > phi * phi + v:
+            big_b = math.log(delta * delta - phi * phi - v)
+        else:
+            k = 1
+            while f(a - k * self.tau) < 0:
+                k += 1
+            big_b = a - k * self.tau
+        f_a, f_b = f(big_a), f(big_b)
+        while abs(big_b - big_a) > 1e-6:
+            big_c = big_a + (big_a - big_b) * f_a / (f_b - f_a)
+            f_c = f(big_c)
+            if f_c * f_b <= 0:
+                big_a, f_a = big_b, f_b
+            else:
+                f_a = f_a / 2
+            big_b, f_b = big_c, f_c
+        return math.exp(big_a / 2)
+
+    def update(self, players: List[Dict], now: float) -> List[Dict]:
+        # convert to the Glicko-2 scale, widening the deviation for idle periods
+        scaled = []
+        for p in players:
+            state = p['state']
+            phi = state['deviation'] / self.scale
+            sigma = state['volatility']
+            if state['updated_at'] is not None and now > state['updated_at']:
+                idle_periods = (now - state['updated_at']) / self.period_seconds
+                phi = min(math.sqrt(phi * phi + idle_periods * sigma * sigma), GLICKO2_INITIAL_RD / self.scale)
+            scaled.append(((state['rating'] - DEFAULT_ELO) / self.scale, phi, sigma))
+
+        new_states = []
+        for i, (mu, phi, sigma) in enumerate(scaled):
+            v_inv, score_sum = 0.0, 0.0
+            for j, (mu_j, phi_j, _) in enumerate(scaled):
+                if j == i:
+                    continue
+                reward_i, reward_j = players[i]['reward'], players[j]['reward']
+                score = 1.0 if reward_i > reward_j else (0.0 if reward_i < reward_j else 0.5)
+                g = self._g(phi_j)
+                expected = 1 / (1 + math.exp(-g * (mu - mu_j)))
+                v_inv += g * g * expected * (1 - expected)
+                score_sum += g * (score - expected)
+
+            if v_inv == 0:
+                # no opponents: only the deviation grows
+                new_states.append({"rating": players[i]['state']['rating'], "deviation": phi * self.scale,
+                                   "volatility": sigma, "updated_at": now})
+                continue
+
+            v = 1 / v_inv
+            new_sigma = self._new_volatility(phi, sigma, v * score_sum, v)
+            phi_star = math.sqrt(phi * phi + new_sigma * new_sigma)
+            new_phi = 1 / math.sqrt(1 / (phi_star * phi_star) + 1 / v)
+            new_mu = mu + new_phi * new_phi * score_sum
+            new_states.append({
+                "rating": round(new_mu * self.scale + DEFAULT_ELO, 2),
+                "deviation": new_phi * self.scale,
+                "volatility": new_sigma,
+                "updated_at": now
+            })
+        return new_states
+
+
+RATING_SYSTEM_CLASSES = {system.name: system for system in (EloSystem, Glicko2System)}
+
+
+def get_rating_system(name: str) -> RatingSystem:
+    if name not in RATING_SYSTEM_CLASSES:
+        raise ValueError(f"Unknown rating system '{name}'.")
+    return RATING_SYSTEM_CLASSES[name]()
@@ -2,7 +2,7 @@ import textarena as ta
 from database import get_db
 from sqlalchemy.orm import Session
 import secrets, time
-from core.models import Model, Base, Environment, Matchmaking, PlayerGame, Game, Elo, PlayerLog
+from core.models import Model, Base, Environment, Matchmaking, PlayerGame, Game, Elo, PlayerLog, CurrentRating
 
 from config import STANDARD_MODELS, DEFAULT_ELO, HUMANITY_MODEL_NAME
 
@@ -45,6 +45,12 @@ def register_standard_models(db: Session):
                 updated_at=time.time()
             )
             db.add(elo)
+            db.merge(CurrentRating(
+                model_name=model_name,
+                environment_id=elo.environment_id,
+                elo=elo.elo,
+                updated_at=elo.updated_at
+            ))
     
     # Register humanity collective
     humanity = db.query(Model).filter(Model.model_name == HUMANITY_MODEL_NAME).first()
@@ -66,5 +72,11 @@ def register_standard_models(db: Session):
             updated_at=time.time()
         )
         db.add(elo)
+        db.merge(CurrentRating(
+            model_name=HUMANITY_MODEL_NAME,
+            environment_id=elo.environment_id,
+            elo=elo.elo,
+            updated_at=elo.updated_at
+        ))
     
     db.commit()
\ No newline at end of file
@@ -0,0 +1,107 @@
+import logging, threading, time
+from itertools import groupby
+from typing import List
+
+# db imports
+from sqlalchemy import delete, update
+from sqlalchemy.orm import Session
+
+# core imports
+from core.models import Game, PendingSettlement
+
+# import configs
+from config import SETTLEMENT_BATCH_SIZE, SETTLEMENT_MAX_ATTEMPTS
+
+# local imports
+from elo_updates import settle_games
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SettlementQueue:
+    """
+    Durable queue of finished games waiting for their rating update.
+
+    Endpoints `enqueue` a game in the same transaction that records its
+    outcome; the settlement worker calls `process` to settle the oldest games
+    in batches, deleting their queue rows in the same transaction as the new
+    ratings. Rows survive restarts, so no finished game is ever skipped.
+    """
+    def __init__(self):
+        self._wakeup = threading.Event()
+
+    def enqueue(self, db: Session, game_id: int, env_id: str = None):
+        """Queue a finished game; the caller commits (then calls `notify`)."""
+        db.add(PendingSettlement(game_id=game_id, environment_id=env_id, enqueued_at=time.time(), attempts=0))
+
+    def notify(self):
+        self._wakeup.set()
+
+    def wait(self, timeout: float) -> bool:
+        woken = self._wakeup.wait(timeout)
+        self._wakeup.clear()
+        return woken
+
+    @staticmethod
+    def is_pending(db: Session, game_id: int) -> bool:
+        return db.query(PendingSettlement.id).filter(PendingSettlement.game_id == game_id).first() is not None
+
+    def process(self, db: Session, batch_size: int = SETTLEMENT_BATCH_SIZE) -> int:
+        """
+        Settle the oldest pending games; returns how many were settled.
+
+        Games are taken in (started_at, id) order, the order `settle_games`
+        and `elo_replay` use, rather than in the order they were enqueued.
+        """
+        pending = (
+            db.query(PendingSettlement)
+            .join(Game, Game.id == PendingSettlement.game_id)
+            .filter(PendingSettlement.attempts < SETTLEMENT_MAX_ATTEMPTS)
+            .order_by(Game.started_at, Game.id)
+            .limit(batch_size)
+            .all()
+        )
+        metrics.set_gauge("settlements_pending", db.query(PendingSettlement).count())
+        if not pending:
+            return 0
+
+        now = time.time()
+        try:
+            self._settle(db, pending)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Batch settlement failed, settling games one by one: {e}")
+            return sum(self._settle_one(db, row_id) for row_id in [row.id for row in pending])
+
+        for row in pending:
+            metrics.observe("settlement_lag_seconds", now - row.enqueued_at)
+        return len(pending)
+
+    @staticmethod
+    def _settle(db: Session, rows: List[PendingSettlement]):
+        # consecutive games with the same rating environment override are settled together
+        for env_id, group in groupby(rows, key=lambda row: row.environment_id):
+            settle_games(db, [row.game_id for row in group], env_id=env_id, commit=False)
+        db.execute(delete(PendingSettlement).where(PendingSettlement.id.in_([row.id for row in rows])))
+        db.commit()
+
+    def _settle_one(self, db: Session, row_id: int) -> int:
+        row = db.get(PendingSettlement, row_id)
+        try:
+            self._settle(db, [row])
+            return 1
+        except Exception as e:
+            db.rollback()
+            db.execute(
+                update(PendingSettlement)
+                .where(PendingSettlement.id == row_id)
+                .values(attempts=PendingSettlement.attempts + 1, last_error=str(e))
+            )
+            db.commit()
+            metrics.increment("settlement_errors")
+            logger.error(f"Settlement of game '{row.game_id}' failed: {e}")
+            return 0
+
+
+settlement_queue = SettlementQueue()
@@ -0,0 +1,83 @@
+import random, time
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+import matchmaking
+from matchmaking import compute_match_score, compute_pair_score_matrix, generate_candidates
+from pair_history import PairHistoryIndex
+from config import HUMANITY_MODEL_NAME, STANDARD_MODELS, MIN_WAIT_FOR_STANDARD
+
+
+def random_queue(rng: random.Random, size: int):
+    """Queued players (a few humans and standard models among them) like `get_queue_snapshot` returns."""
+    players = []
+    for i in range(size):
+        kind = rng.random()
+        if kind < 0.1:
+            model_name, email = HUMANITY_MODEL_NAME, "humans@example.com"
+        elif kind < 0.15 and STANDARD_MODELS:
+            model_name, email = rng.choice(STANDARD_MODELS), " "
+        else:
+            model_name, email = f"model-{i}", f"owner-{rng.randrange(max(size // 3, 1))}@example.com"
+        time_in_queue = rng.uniform(0, 2 * MIN_WAIT_FOR_STANDARD)
+        players.append({
+            "matchmaking": None,
+            "model_name": model_name,
+            "email": email,
+            "elo": rng.gauss(1000, 150),
+            "time_in_queue": time_in_queue,
+            "pct_queue": time_in_queue / 300,
+        })
+    return players
+
+
+@pytest.fixture
+def history(monkeypatch):
+    index = PairHistoryIndex()
+    monkeypatch.setattr(matchmaking, "pair_history", index)
+    return index
+
+
+def scored(combos):
+    """Positive scores keyed by the players' positions in the queue."""
+    scores = {}
+    for combo in combos:
+        score = compute_match_score(combo)
+        if score > 0:
+            scores[frozenset(player["index"] for player in combo)] = score
+    return scores
+
+
+# small and medium queues; 4-player queues stay smaller to keep the brute force quick
+@pytest.mark.parametrize("num_players,size", [(2, 6), (2, 60), (3, 8), (3, 40), (4, 10), (4, 25)])
+@pytest.mark.parametrize("seed", range(5))
+def test_candidates_match_all_combinations(history, seed, num_players, size):
+    rng = random.Random(seed)
+    queue = random_queue(rng, size)
+    for index, player in enumerate(queue):
+        player["index"] = index
+    for _ in range(size):
+        history.record_game([p["model_name"] for p in rng.sample(queue, 2)], started_at=time.time())
+
+    brute_force = scored(combinations(queue, num_players))
+    windowed = scored(generate_candidates(queue, num_players))
+    assert windowed.keys() == brute_force.keys()
+    for key, score in brute_force.items():
+        assert windowed[key] == pytest.approx(score)
+
+
+@pytest.mark.parametrize("size", [2, 7, 40, 120])
+@pytest.mark.parametrize("seed", range(5))
+def test_pair_score_matrix_matches_match_score(history, seed, size):
+    rng = random.Random(seed)
+    queue = random_queue(rng, size)
+    for _ in range(size):
+        history.record_game([p["model_name"] for p in rng.sample(queue, 2)], started_at=time.time())
+
+    matrix = compute_pair_score_matrix(queue)
+    expected = np.zeros((size, size))
+    for i, j in combinations(range(size), 2):
+        expected[i, j] = expected[j, i] = compute_match_score((queue[i], queue[j]))
+    np.testing.assert_allclose(matrix, expected)
@@ -0,0 +1,57 @@
+import pytest
+
+from core.models import Environment, Game, PlayerGame
+from core.schemas import GetResultsRequest
+from endpoints.model_play import get_results_endpoint
+from game_stats import record_outcomes
+from matchmaking_benchmark import make_session
+from settlement_queue import settlement_queue
+
+ENV_ID = "Results-v0"
+
+
+@pytest.fixture
+def db():
+    engine, session = make_session()
+    session.add(Environment(environment_id=ENV_ID, num_players=2))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def finish_game(db):
+    game = Game(environment_id=ENV_ID, status="active", started_at=1000.0)
+    db.add(game)
+    db.flush()
+    for player_id, model_name in enumerate(("a", "b")):
+        db.add(PlayerGame(game_id=game.id, model_name=model_name, player_id=player_id, last_action_time=1000.0))
+    db.flush()
+    record_outcomes(db, game.id, {0: 1, 1: -1})
+    settlement_queue.enqueue(db, game.id)
+    db.commit()
+    return game.id
+
+
+def get_results(db, game_id):
+    payload = GetResultsRequest(game_id=game_id, model_name="a", env_id=ENV_ID)
+    return get_results_endpoint.__wrapped__(request=None, payload=payload, db=db)
+
+
+def test_first_game_with_queued_settlement(db):
+    results = get_results(db, finish_game(db))
+    assert results["rating_pending"] is True
+    assert results["prev_elo_score"] is None and results["current_elo_score"] is None
+    assert results["outcome"] == "Win"
+
+
+def test_pending_rating_hides_the_previous_game_rating(db):
+    finish_game(db)
+    settlement_queue.process(db)
+    game_id = finish_game(db)
+    assert get_results(db, game_id)["current_elo_score"] is None
+
+    settlement_queue.process(db)
+    results = get_results(db, game_id)
+    assert results["rating_pending"] is False
+    assert results["current_elo_score"] > results["prev_elo_score"]
@@ -0,0 +1,102 @@
+import threading, time
+
+import pytest
+
+from env_cache import EnvironmentCache
+from env_handlers import EnvironmentManagerBase, LocalEnvHandler
+import env_handlers
+
+GAME_ID = 10_001
+
+
+class ThinkingHandler(LocalEnvHandler):
+    """Standard-model game whose model thinks until `release` is set; its move hands the turn over."""
+    def __init__(self, game_id, release, calls):
+        self.game_id = game_id
+        self.done = False
+        self.local_pid = 0
+        self.local_model_name = "standard"
+        self.snapshot_stamp = "saved"
+        self.env = self  # the handler reads env.state.current_player_id
+        self.state = type("State", (), {"current_player_id": 0})()
+        self.release, self.calls = release, calls
+
+    def local_model(self, prompt):
+        self.calls.append(self)
+        self.release.wait(5)
+        return "[move]"
+
+    def checkpoint(self):
+        pass
+
+    def _get_local_turn(self):
+        return {"prompt": ""}
+
+    def _execute_local_model_step(self, turn, action):
+        self.state.current_player_id = 1
+
+
+def wait_for_job(game_id):
+    deadline = time.time() + 5
+    while game_id in LocalEnvHandler._turn_jobs and time.time() < deadline:
+        time.sleep(0.01)
+    assert game_id not in LocalEnvHandler._turn_jobs
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = EnvironmentCache(max_entries=1, idle_ttl=1.0)
+    monkeypatch.setattr(EnvironmentManagerBase, "_environments", cache)
+    return cache
+
+
+def test_thinking_handler_is_pinned_and_reload_does_not_schedule_again(cache):
+    release, calls = threading.Event(), []
+    handler = ThinkingHandler(GAME_ID, release, calls)
+    cache.put(GAME_ID, handler)
+    try:
+        handler.schedule_local_turns()
+        assert handler.pinned
+
+        # idle TTL and LRU pressure (another saved game) while the model thinks
+        cache.put(GAME_ID + 1, ThinkingHandler(GAME_ID + 1, release, calls))
+        cache.evict_expired(now=time.time() + 100)
+        assert cache.peek(GAME_ID) is handler
+        assert GAME_ID + 1 not in cache
+
+        # a handler reloaded from a snapshot taken on the model's turn
+        reloaded = ThinkingHandler(GAME_ID, release, calls)
+        reloaded.schedule_local_turns()
+    finally:
+        release.set()
+    wait_for_job(GAME_ID)
+    assert calls == [handler]
+    assert handler.state.current_player_id == 1
+
+    # unpinned once the job is done
+    cache.evict_expired(now=time.time() + 100)
+    assert GAME_ID not in cache
+
+
+def test_stale_snapshot_does_not_replace_a_thinking_handler(cache, monkeypatch):
+    release, calls = threading.Event(), []
+    handler = ThinkingHandler(GAME_ID, release, calls)
+    snapshot = ThinkingHandler(GAME_ID, release, calls)
+    monkeypatch.setattr(env_handlers, "ENV_SNAPSHOTS_ENABLED", True)
+    monkeypatch.setattr(env_handlers.snapshots, "is_stale", lambda game_id, env: True)
+    monkeypatch.setattr(env_handlers.snapshots, "load", lambda game_id: snapshot)
+    cache.put(GAME_ID, handler)
+    try:
+        handler.schedule_local_turns()
+        with EnvironmentManagerBase.game_lock(GAME_ID):
+            assert EnvironmentManagerBase._get_cached(GAME_ID) is handler
+    finally:
+        release.set()
+    wait_for_job(GAME_ID)
+    assert calls == [handler]
+
+    # once the job is done a stale handler is reloaded as before
+    with EnvironmentManagerBase.game_lock(GAME_ID):
+        assert EnvironmentManagerBase._get_cached(GAME_ID) is snapshot
+    wait_for_job(GAME_ID)
+    assert calls == [handler, snapshot]
@@ -0,0 +1,74 @@
+import random
+
+import numpy as np
+import pytest
+
+import matchmaking
+from matchmaking import greedy_pair_matching, max_weight_pair_matching
+
+
+def random_edges(rng: random.Random, n: int, density: float):
+    edges = [(i, j, round(rng.random(), 3)) for i in range(n) for j in range(i + 1, n) if rng.random() < density]
+    rows = np.array([i for i, _, _ in edges], dtype=int)
+    cols = np.array([j for _, j, _ in edges], dtype=int)
+    weights = np.array([w for _, _, w in edges], dtype=float)
+    return rows, cols, weights
+
+
+def brute_force(rows, cols, weights, n):
+    """Best (matched pairs, total weight) over every matching of the graph."""
+    adjacency = {}
+    for i, j, w in zip(rows.tolist(), cols.tolist(), weights.tolist()):
+        adjacency.setdefault(i, []).append((j, w))
+
+    def best(free):
+        if not free:
+            return 0, 0.0
+        i, rest = free[0], free[1:]
+        result = best(rest)  # leave i unmatched
+        for j, w in adjacency.get(i, []):
+            if j in rest:
+                pairs, weight = best(tuple(k for k in rest if k != j))
+                result = max(result, (pairs + 1, weight + w))
+        return result
+
+    return best(tuple(range(n)))
+
+
+def score(edges, rows, cols, weights):
+    """(matched pairs, total weight) of the chosen edge positions."""
+    matched = [node for edge in edges for node in (rows[edge], cols[edge])]
+    assert len(matched) == len(set(matched)), "a player is matched twice"
+    return len(edges), sum(weights[edge] for edge in edges)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_max_weight_matches_brute_force(seed, monkeypatch):
+    rng = random.Random(seed)
+    n = rng.randint(2, 9)
+    rows, cols, weights = random_edges(rng, n, density=rng.uniform(0.2, 1.0))
+    # without the per-player edge cap the matching must be optimal
+    monkeypatch.setattr(matchmaking, "MATCHING_MAX_EDGES_PER_PLAYER", n)
+
+    edges = max_weight_pair_matching(rows, cols, weights, n)
+    if len(weights) == 0:
+        assert edges == []
+        return
+    found = score(edges, rows, cols, weights)
+    expected = brute_force(rows, cols, weights, n)
+    assert found[0] == expected[0]
+    assert found[1] == pytest.approx(expected[1])
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_capped_max_weight_never_matches_fewer_than_greedy(seed):
+    rng = random.Random(seed)
+    n = rng.randint(2, 30)
+    rows, cols, weights = random_edges(rng, n, density=rng.uniform(0.2, 1.0))
+    greedy_edges = greedy_pair_matching(rows, cols, weights, n)
+
+    edges = max_weight_pair_matching(rows, cols, weights, n, seed_edges=greedy_edges)
+    if len(weights) == 0:
+        assert edges == []
+        return
+    assert score(edges, rows, cols, weights)[0] >= len(greedy_edges)
@@ -0,0 +1,60 @@
+import pytest
+
+from core.models import Environment, Game, PlayerGame, Elo
+from elo_replay import load_games, replay, rewrite_elos
+from elo_updates import settle_games
+from game_stats import record_outcomes
+from matchmaking_benchmark import make_session
+from settlement_queue import settlement_queue
+
+ENV_ID = "Replay-v0"
+
+
+@pytest.fixture
+def db():
+    engine, session = make_session()
+    session.add(Environment(environment_id=ENV_ID, num_players=2))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def finish_game(db, started_at, players=("a", "b")):
+    game = Game(environment_id=ENV_ID, status="active", started_at=started_at)
+    db.add(game)
+    db.flush()
+    for player_id, model_name in enumerate(players):
+        db.add(PlayerGame(game_id=game.id, model_name=model_name, player_id=player_id, last_action_time=started_at))
+    db.flush()
+    record_outcomes(db, game.id, {0: 1, 1: -1})
+    db.commit()
+    return game.id
+
+
+def test_rewrite_replaces_the_history(db):
+    for g in range(5):
+        settle_games(db, [finish_game(db, 1000.0 + g)])
+    expected = [elo for elo, in db.query(Elo.elo).order_by(Elo.id)]
+    history = load_games(db)
+    assert rewrite_elos(db, history, replay(history)) == len(expected)
+    assert [elo for elo, in db.query(Elo.elo).order_by(Elo.id)] == pytest.approx(expected)
+
+
+def test_rewrite_fails_if_a_game_was_settled_after_load(db):
+    settle_games(db, [finish_game(db, 1000.0)])
+    history = load_games(db)
+    settle_games(db, [finish_game(db, 1001.0)])
+    with pytest.raises(RuntimeError):
+        rewrite_elos(db, history, replay(history))
+    assert db.query(Elo).count() == 4
+
+
+def test_rewrite_fails_if_a_game_was_queued_after_load(db):
+    settle_games(db, [finish_game(db, 1000.0)])
+    history = load_games(db)
+    settlement_queue.enqueue(db, finish_game(db, 1001.0))
+    db.commit()
+    with pytest.raises(RuntimeError):
+        rewrite_elos(db, history, replay(history))
+    assert db.query(Elo).count() == 2
@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from core.models import Environment, Game, PlayerGame
+from elo_updates import count_games_played
+from game_stats import record_outcomes
+from matchmaking_benchmark import make_session
+
+GAMES = 40
+MODELS = [f"model-{i}" for i in range(5)]
+
+
+@pytest.fixture
+def db():
+    engine, session = make_session()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def play_games(db, rng):
+    """Finished games whose ids do not follow their start times."""
+    db.add(Environment(environment_id="Order-v0", num_players=2))
+    start_times = [1000.0 + rng.randrange(GAMES // 2) for _ in range(GAMES)]
+    for started_at in start_times:
+        game = Game(environment_id="Order-v0", status="active", started_at=started_at)
+        db.add(game)
+        db.flush()
+        for player_id, model_name in enumerate(rng.sample(MODELS, 2)):
+            db.add(PlayerGame(game_id=game.id, model_name=model_name, player_id=player_id, last_action_time=started_at))
+        db.flush()
+        record_outcomes(db, game.id, {0: 1, 1: -1})
+    db.commit()
+    return db.query(Game.id, Game.environment_id, Game.started_at).order_by(Game.started_at, Game.id).all()
+
+
+def expected_counts(db, games):
+    counts, expected = {}, {}
+    for game_id, _, _ in games:
+        for (model_name,) in db.query(PlayerGame.model_name).filter(PlayerGame.game_id == game_id):
+            counts[model_name] = counts.get(model_name, 0) + 1
+            expected[(game_id, model_name)] = counts[model_name]
+    return expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_games_played_does_not_depend_on_batching(db, seed):
+    rng = random.Random(seed)
+    games = play_games(db, rng)
+    expected = expected_counts(db, games)
+
+    # settle the games in random batches, each in (started_at, id) order
+    order = list(range(GAMES))
+    rng.shuffle(order)
+    counted = {}
+    while order:
+        size = rng.randint(1, 8)
+        batch, order = sorted(order[:size]), order[size:]
+        counted.update(count_games_played(db, [games[i] for i in batch], MODELS))
+    assert counted == expected
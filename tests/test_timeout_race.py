@@ -0,0 +1,111 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from core.models import Model, Environment, Game, PlayerGame, PlayerLog, ModelStats, PendingSettlement
+from core.schemas import StepRequest
+from endpoints.model_play import step_endpoint
+from env_handlers import EnvironmentManagerBase
+from timeout_manager import handle_action_timeout
+import env_handlers
+
+GAMES = 30
+
+
+class FinalMoveHandler:
+    """Handler of a game whose next move (player 0's) ends it with player 0 winning."""
+    def __init__(self):
+        self.done = False
+        self.info = {}
+        self.snapshot_stamp = None
+        self.env = self  # remove_env reads env.env.state.observations
+        self.state = type("State", (), {"observations": {0: "final", 1: "final"}})()
+
+    def check_done(self):
+        return self.done
+
+    def check_player_turn(self, player_id):
+        return player_id == 0
+
+    def execute_step(self, action):
+        time.sleep(0.005)  # widen the window for the timeout to race the step
+        self.done, self.info = True, {"reason": "Player 0 won."}
+
+    def extract_results(self):
+        return {0: 1, 1: -1}, self.info
+
+
+@pytest.fixture
+def Session(tmp_path, monkeypatch):
+    monkeypatch.setattr(env_handlers, "ENV_SNAPSHOTS_ENABLED", False)
+    engine = create_engine(f"sqlite:///{tmp_path / 'race.db'}", connect_args={"check_same_thread": False, "timeout": 30})
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def create_games(db, count):
+    db.add(Environment(environment_id="Race-v0", num_players=2))
+    for name in ("a", "b"):
+        db.add(Model(model_name=name, description="", email=f"{name}@example.com", model_token=f"token-{name}"))
+    game_ids = []
+    for _ in range(count):
+        game = Game(environment_id="Race-v0", started_at=time.time(), status="active")
+        db.add(game)
+        db.flush()
+        player_a = PlayerGame(game_id=game.id, model_name="a", player_id=0, last_action_time=time.time())
+        db.add_all([player_a, PlayerGame(game_id=game.id, model_name="b", player_id=1, last_action_time=time.time())])
+        db.flush()
+        # player a has an open observation, so a timeout would blame them
+        db.add(PlayerLog(player_game_id=player_a.id, model_name="a", timestamp_observation=0.0, observation="[]"))
+        game_ids.append(game.id)
+    db.commit()
+    return game_ids
+
+
+def test_step_and_timeout_conclude_a_game_once(Session):
+    with Session() as db:
+        game_ids = create_games(db, GAMES)
+    for game_id in game_ids:
+        EnvironmentManagerBase._environments.put(game_id, FinalMoveHandler())
+
+    def step(game_id, start):
+        start.wait()
+        with Session() as db:
+            payload = StepRequest(env_id="Race-v0", model_name="a", model_token="token-a", game_id=game_id, action_text="[0]")
+            return step_endpoint.__wrapped__(request=None, payload=payload, db=db)
+
+    def timeout(game_id, start):
+        start.wait()
+        with Session() as db:
+            return handle_action_timeout(db=db, game_id=game_id, model_name="a")
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for game_id in game_ids:
+                start = threading.Barrier(2)
+                stepped = executor.submit(step, game_id, start)
+                timed_out = executor.submit(timeout, game_id, start)
+                assert stepped.result()["done"] is True
+                timed_out.result()
+    finally:
+        for game_id in game_ids:
+            EnvironmentManagerBase._environments.pop(game_id)
+
+    with Session() as db:
+        assert db.query(Game).filter(Game.status == "finished").count() == GAMES
+        assert db.query(PendingSettlement).count() == GAMES
+        for name in ("a", "b"):
+            stats = db.get(ModelStats, (name, "Race-v0"))
+            assert stats.games == GAMES
+            assert stats.wins + stats.losses + stats.draws == GAMES
+        # every game holds the outcome of whichever side concluded it
+        for game in db.query(Game).all():
+            rewards = dict(db.query(PlayerGame.model_name, PlayerGame.reward).filter(PlayerGame.game_id == game.id).all())
+            expected = {"a": -1, "b": 0} if "timed out" in game.reason else {"a": 1, "b": -1}
+            assert rewards == expected
+        assert db.query(func.count(PlayerGame.id)).filter(PlayerGame.reward.is_(None)).scalar() == 0
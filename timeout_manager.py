@@ -1,5 +1,5 @@
 from typing import List, Tuple, Dict
-from sqlalchemy import delete, or_
+from sqlalchemy import delete, update, select, or_, func
 from sqlalchemy.orm import Session
 import time
 import logging 
@@ -11,79 +11,222 @@ from core.models import Game, PlayerGame, PlayerLog, Matchmaking
 from config import STEP_TIMEOUT, MATCHMAKING_INACTIVITY_TIMEOUT
 
 # local imports
-from elo_updates import update_elos
+from game_stats import record_outcomes
+from settlement_queue import settlement_queue
+from queue_events import queue_events
+from deadline_scheduler import deadlines, STEP, LOAD, QUEUE
+from metrics import metrics
+from heartbeat_cache import heartbeats
+from env_handlers import EnvironmentManagerBase
 
 logger = logging.getLogger(__name__)
 
-def handle_action_timeout(db: Session, game_id: int, model_name: str):
-    # Query all PlayerGame records with reward == None for the given game_id
-    players = db.query(PlayerGame).filter(
-        PlayerGame.game_id == game_id,
-        PlayerGame.reward == None
-    ).all()
-
-    # Separate opponents and player based on model_name
-    opponents = [pg for pg in players if pg.model_name != model_name]
-    player = next((pg for pg in players if pg.model_name == model_name), None)
-
-    game = db.query(Game).filter(Game.id == game_id).first()
-    player.reward = -1 # Timed-out player loses
-    player.outcome = "Loss"
-    for opp in opponents:
-        opp.reward = 0 # counted as win
-        opp.outcome = "Win"
+def handle_action_timeout(db: Session, game_id: int, model_name: str) -> bool:
+    """
+    Conclude a game whose player `model_name` timed out and queue its rating
+    update. Runs and commits under the game lock, so a step that finishes the
+    game concurrently either lands first (and the timeout is dropped) or sees
+    the game concluded. Returns whether the game was concluded here.
+    """
+    # committed per game: holding the db write lock while waiting for another game's lock could deadlock
+    with EnvironmentManagerBase.game_lock(game_id):
+        players = db.query(PlayerGame).filter(PlayerGame.game_id == game_id).all()
+
+        # Timed-out player loses, opponents are counted as winners
+        rewards = {pg.player_id: -1 if pg.model_name == model_name else 0 for pg in players}
+        game = record_outcomes(db, game_id, rewards, reason=f"Player '{model_name}' timed out.")
+        if game is None:
+            return False
+        # keep the observations at the time of the timeout for `check_turn`
+        EnvironmentManagerBase.remove_env(game_id, db=db)
+        # Queue the rating update
+        settlement_queue.enqueue(db, game_id)
+        db.commit()
+        env_id = game.environment_id
 
-    game.status = "finished"
-    game.reason = f"Player '{model_name}' timed out."
-
-    db.commit()
     # logger.info(f"Player '{player.model_name}' in game '{game.id}' timed out. Game concluded.")
+    settlement_queue.notify()
+    queue_events.notify(env_id)
+    return True
+
 
-    # Update Elo ratings
-    update_elos(db, game.id, game.environment_id)
+def _release_failed_games(db: Session, game_ids: List[int]):
+    """Drop the environments and pending deadlines of games that were marked failed."""
+    if not game_ids:
+        return
+    player_game_ids = db.scalars(select(PlayerGame.id).where(PlayerGame.game_id.in_(game_ids))).all()
+    for player_game_id in player_game_ids:
+        deadlines.cancel(STEP, player_game_id)
+    for game_id in game_ids:
+        deadlines.cancel(LOAD, game_id)
+        EnvironmentManagerBase.remove_env(game_id)
 
 
 def handle_matchmaking_timeout(db: Session, matchmaking_id: int):
     deletion_row = db.query(Matchmaking).filter(Matchmaking.id == matchmaking_id).first()
     db.delete(deletion_row)
     db.commit()
-
-def check_and_enforce_timeouts(db: Session):
-    # check in-game timeouts
-    for game in db.query(Game).filter(Game.status == "active").all():
-        # get the relevant player Games
-        for pgame in db.query(PlayerGame).filter(PlayerGame.game_id == game.id).all():
-            for plog in db.query(PlayerLog).filter(
-                PlayerLog.player_game_id == pgame.id,
-                PlayerLog.timestamp_observation.isnot(None),
-                PlayerLog.timestamp_action.is_(None)).all():
-                # Check if timed out
-                if (time.time() - plog.timestamp_observation) > STEP_TIMEOUT:
-                    # timed out
-                    handle_action_timeout(
-                        db=db,
-                        game_id=game.id,
-                        model_name=plog.model_name
-                    )
-
-    # check for game-not-loading timeouts (i.e. env initted, but no observations)
-    for pg in db.query(PlayerGame).filter(PlayerGame.outcome.is_(None)).all():
-        # check for player logs
-        player_logs = db.query(PlayerLog).filter(PlayerLog.player_game_id == pg.id).all()
-        if len(player_logs) == 0 and (time.time() - pg.last_action_time) > STEP_TIMEOUT:
-            # simply set game status to failed
-            failed_game = db.query(Game).filter(Game.id == pg.game_id).first()
-            failed_game.status = "failed"
-    
+    heartbeats.discard(matchmaking_id)
+
+def _check_step_timeout(db: Session, player_game_id: int, game_id: int, model_name: str, now: float) -> bool:
+    # oldest observation of this player that is still waiting for an action
+    oldest_open = db.query(func.min(PlayerLog.timestamp_observation)).join(
+        PlayerGame, PlayerLog.player_game_id == PlayerGame.id
+    ).join(
+        Game, Game.id == PlayerGame.game_id
+    ).filter(
+        PlayerLog.player_game_id == player_game_id,
+        PlayerLog.timestamp_observation.isnot(None),
+        PlayerLog.timestamp_action.is_(None),
+        Game.status == "active"
+    ).scalar()
+    if oldest_open is None:
+        return False
+
+    if (now - oldest_open) > STEP_TIMEOUT:
+        return handle_action_timeout(db=db, game_id=game_id, model_name=model_name)
+    deadlines.watch_step(player_game_id, game_id, model_name, oldest_open)
+    return False
+
+
+def _check_load_timeout(db: Session, game_id: int, now: float) -> bool:
+    # players of this game that never received an observation
+    unloaded = db.query(PlayerGame).join(Game).filter(
+        PlayerGame.game_id == game_id,
+        PlayerGame.outcome.is_(None),
+        ~PlayerGame.logs.any(),
+        Game.status == "active"
+    ).all()
+    if not unloaded:
+        return False
+
+    last_action_time = min(pg.last_action_time for pg in unloaded)
+    if (now - last_action_time) > STEP_TIMEOUT:
+        # simply set game status to failed (unless it concluded meanwhile)
+        failed = db.execute(
+            update(Game).where(Game.id == game_id, Game.status == "active").values(status="failed")
+        ).rowcount
+        db.commit()
+        if failed:
+            _release_failed_games(db, [game_id])
+        return bool(failed)
+    deadlines.watch_game_start(game_id, last_action_time)
+    return False
+
+
+def _check_queue_timeout(db: Session, matchmaking_id: int, now: float) -> bool:
+    queue_item = db.query(Matchmaking).filter(Matchmaking.id == matchmaking_id).first()
+    if queue_item is None:
+        return False
+
+    # remove those where last_checked has timed out (heartbeats may not be flushed yet)
+    last_checked = heartbeats.last_checked(matchmaking_id, queue_item.last_checked)
+    if (now - last_checked) > MATCHMAKING_INACTIVITY_TIMEOUT:
+        handle_matchmaking_timeout(db=db, matchmaking_id=matchmaking_id)
+        return True
+    deadlines.watch_queue(matchmaking_id, last_checked)
+    return False
+
+
+def _report(source: str, handled: Dict[str, int]) -> Dict[str, int]:
+    for kind, count in handled.items():
+        if count:
+            metrics.increment("timeouts_handled", count, kind=kind, source=source)
+    if any(handled.values()):
+        logger.info(f"Timeouts handled ({source}): {handled}")
+    return handled
+
+
+def check_and_enforce_timeouts(db: Session) -> Dict[str, int]:
+    """
+    Enforce step, game-loading and queue timeouts for the deadlines that expired.
+
+    Deadlines are fed by the endpoints (observations, game creation, queue
+    heartbeats); every expired one is re-checked against the db and either
+    enforced or re-scheduled. Returns how many timeouts of each kind were handled.
+    """
+    now = time.time()
+    handled = {STEP: 0, LOAD: 0, QUEUE: 0}
+    for kind, key, payload in deadlines.pop_expired(now):
+        if kind == STEP:
+            game_id, model_name = payload
+            handled[STEP] += _check_step_timeout(db, key, game_id, model_name, now)
+        elif kind == LOAD:
+            handled[LOAD] += _check_load_timeout(db, key, now)
+        elif kind == QUEUE:
+            handled[QUEUE] += _check_queue_timeout(db, key, now)
+    return _report("deadlines", handled)
+
+
+def sweep_timeouts(db: Session) -> Dict[str, int]:
+    """
+    Full timeout sweep as a few set-based statements.
+
+    Used as a periodic safety net next to the deadline scheduler (e.g. for state
+    written by another process). Returns how many timeouts of each kind were handled.
+    """
+    # write pending heartbeats first so the queue cleanup sees them
+    heartbeats.flush(db)
+
+    now = time.time()
+    cutoff = now - STEP_TIMEOUT
+
+    # 1. open observations older than STEP_TIMEOUT in active games (the player
+    #    whose observation has waited longest is the offender of its game)
+    open_logs = (
+        select(
+            PlayerGame.game_id,
+            PlayerLog.model_name,
+            func.row_number().over(
+                partition_by=PlayerGame.game_id,
+                order_by=(PlayerLog.timestamp_observation.asc(), PlayerLog.id.asc())
+            ).label("rank")
+        )
+        .join(PlayerLog, PlayerLog.player_game_id == PlayerGame.id)
+        .join(Game, Game.id == PlayerGame.game_id)
+        .where(
+            Game.status == "active",
+            PlayerLog.timestamp_observation.isnot(None),
+            PlayerLog.timestamp_observation < cutoff,
+            PlayerLog.timestamp_action.is_(None)
+        )
+        .subquery()
+    )
+    timed_out = db.execute(
+        select(open_logs.c.game_id, open_logs.c.model_name).where(open_logs.c.rank == 1)
+    ).all()
+    concluded = sum(
+        handle_action_timeout(db=db, game_id=game_id, model_name=model_name)
+        for game_id, model_name in timed_out
+    )
+
+    # 2. active games with a player that never got an observation within STEP_TIMEOUT
+    unloaded_games = (
+        select(PlayerGame.game_id)
+        .where(
+            PlayerGame.outcome.is_(None),
+            PlayerGame.last_action_time < cutoff,
+            ~PlayerGame.logs.any()
+        )
+    )
+    failed_ids = db.scalars(
+        select(Game.id).where(Game.status == "active", Game.id.in_(unloaded_games))
+    ).all()
+    if failed_ids:
+        db.execute(
+            update(Game)
+            .where(Game.id.in_(failed_ids))
+            .values(status="failed")
+            .execution_options(synchronize_session=False)
+        )
+
+    # 3. queue entries without a recent heartbeat
+    stale = db.execute(
+        delete(Matchmaking)
+        .where(Matchmaking.last_checked < now - MATCHMAKING_INACTIVITY_TIMEOUT)
+        .execution_options(synchronize_session=False)
+    ).rowcount
     db.commit()
+    _release_failed_games(db, failed_ids)
 
-
-    # check queue timeouts
-    for queue_item in db.query(Matchmaking).filter():
-        # remove those where last_checked has timed out
-        # print(time.time() - queue_item.last_checked)
-        if (time.time() - queue_item.last_checked) > MATCHMAKING_INACTIVITY_TIMEOUT:
-            handle_matchmaking_timeout(
-                db=db,
-                matchmaking_id=queue_item.id
-            )
\ No newline at end of file
+    return _report("sweep", {STEP: concluded, LOAD: len(failed_ids), QUEUE: stale})
@@ -1,8 +1,8 @@
 import math, time
 from database import get_db
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, func, case, label, and_
-from core.models import Model, Elo, Game, PlayerGame, PlayerLog
+from sqlalchemy import desc, func, case, label, and_, cast, Integer
+from core.models import Model, Elo, Game, PlayerGame, PlayerLog, CurrentRating
 from config import ENV_NAME_TO_ID, DEFAULT_ELO
 
 
@@ -34,21 +34,32 @@ def get_model(db: Session, model_name: str) -> Model:
 
 
 def get_latest_elo(db: Session, model_name: str, env_id: str):
-    return (
-        db.query(Elo)
-        .filter(Elo.model_name == model_name, Elo.environment_id == env_id)
-        .order_by(desc(Elo.updated_at))
-        .first()
-    )
+    return db.get(CurrentRating, (model_name, env_id))
 
 
-def get_elo_history(db: Session, model_name: str, env_id: str):
-    records = (
-        db.query(Elo)
-        .filter(Elo.model_name == model_name, Elo.environment_id == env_id)
-        .order_by(Elo.updated_at)
-        .all()
-    )
+def get_elo_history(db: Session, model_name: str, env_id: str, max_points: int = None, bucket_seconds: float = None):
+    """
+    Elo timeline of a model, optionally downsampled in SQL to the last point of
+    every `bucket_seconds` window, or to at most `max_points` evenly sized windows.
+    """
+    filters = (Elo.model_name == model_name, Elo.environment_id == env_id)
+    if max_points and not bucket_seconds:
+        first, last = db.query(func.min(Elo.updated_at), func.max(Elo.updated_at)).filter(*filters).one()
+        if first is not None and last > first:
+            bucket_seconds = (last - first) / max(max_points - 1, 1)
+
+    query = db.query(Elo).filter(*filters)
+    if bucket_seconds:
+        latest_per_bucket = (
+            db.query(func.max(Elo.id))
+            .filter(*filters)
+            .group_by(cast(Elo.updated_at / bucket_seconds, Integer))
+        )
+        query = query.filter(Elo.id.in_(latest_per_bucket))
+    records = query.order_by(Elo.updated_at).all()
+    if max_points:
+        records = records[-max_points:]
+
     return [
         {
             "time": time.strftime("%Y-%m-%d %H:%M", time.localtime(record.updated_at)),